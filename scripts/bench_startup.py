@@ -0,0 +1,93 @@
+"""Measure how long `sniff` takes to start, in fresh interpreters.
+
+Runs `python -X importtime` on the CLI entry module several times and
+reports the wall time of each run and the modules that took longest to
+import, so a slow new import shows up before it reaches the router.
+
+Example:
+    $ python scripts/bench_startup.py --runs 10 --top 15
+    $ python scripts/bench_startup.py --module sniff.cli.sniff --json
+    $ python scripts/bench_startup.py --pyz dist/sniff.pyz
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr: str):
+    """{module: (self_us, cumulative_us)} from -X importtime output"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[12:].split("|")
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run_once(python: str, module: str, pyz: str = None):
+    env = {**os.environ, "PYTHONPATH": pyz or REPO}
+    code = f"import {module}"
+    start_s = time.perf_counter()
+    result = subprocess.run([python, "-X", "importtime", "-c", code],
+                            env=env, capture_output=True, text=True)
+    wall_s = time.perf_counter() - start_s
+    if result.returncode:
+        sys.exit(f"importing {module} failed:\n{result.stderr}")
+    return wall_s, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark sniff's cold start with -X importtime.")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="fresh interpreters to start. Default: 5")
+    parser.add_argument("--top", type=int, default=10,
+                        help="slowest modules to list. Default: 10")
+    parser.add_argument("--module", type=str, default="sniff.cli.sniff",
+                        help="module to import. Default: sniff.cli.sniff")
+    parser.add_argument("--python", type=str, default=sys.executable,
+                        help="interpreter to run. Default: this one")
+    parser.add_argument("--pyz", type=str, default=None,
+                        help="import from this zipapp instead of the repo")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    # the first run warms the OS file cache and writes .pyc files
+    run_once(args.python, args.module, args.pyz)
+    walls, runs = [], []
+    for _ in range(args.runs):
+        wall_s, times = run_once(args.python, args.module, args.pyz)
+        walls.append(wall_s)
+        runs.append(times)
+
+    modules = {m: statistics.median(r[m][1] for r in runs if m in r)
+               for m in runs[-1]}
+    top = sorted(modules.items(), key=lambda kv: -kv[1])[:args.top]
+    result = {
+        "module": args.module,
+        "runs": args.runs,
+        "wall_ms_median": round(statistics.median(walls) * 1000, 1),
+        "wall_ms_min": round(min(walls) * 1000, 1),
+        "import_ms_median": round(modules.get(args.module, 0) / 1000, 1),
+        "top_cumulative_ms": {m: round(us / 1000, 1) for m, us in top},
+    }
+    if args.json:
+        print(json.dumps(result, indent=4))
+        return
+    print(f"{args.module}: {result['wall_ms_median']}ms wall (median of "
+          f"{args.runs}, min {result['wall_ms_min']}ms), "
+          f"{result['import_ms_median']}ms importing")
+    for m, ms in result["top_cumulative_ms"].items():
+        print(f"{ms:>9.1f}ms  {m}")
+
+
+if __name__ == "__main__":
+    main()
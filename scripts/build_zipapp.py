@@ -0,0 +1,81 @@
+"""Bundle sniff and its dependencies into one precompiled zipapp.
+
+The router then runs `python3 sniff.pyz ...` (or `./sniff.pyz`) without
+pip, and without compiling any module on its first run. Bytecode is only
+used by the same Python minor version that built it, so build with the
+router's Python (3.9 on RUTX11 firmware); other versions fall back to the
+bundled sources.
+
+Example:
+    $ python3.9 scripts/build_zipapp.py --output dist/sniff.pyz
+    $ scp dist/sniff.pyz root@192.168.1.1:/opt/sniff/sniff.pyz
+    root@RUTX11:~# python3 /opt/sniff/sniff.pyz --api-url ...
+"""
+import argparse
+import compileall
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import zipapp
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGES = ("sniff", "dpath")
+MAIN = "sniff.cli.sniff:main"
+
+
+def package_dir(name: str):
+    if name == "sniff":
+        return os.path.join(REPO, "sniff")
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.submodule_search_locations:
+        sys.exit(f"package '{name}' isn't installed, `pip install {name}`")
+    return list(spec.submodule_search_locations)[0]
+
+
+def build(output: str, optimize: int, is_compressed: bool,
+          is_source_kept: bool):
+    with tempfile.TemporaryDirectory() as staging:
+        for name in PACKAGES:
+            shutil.copytree(package_dir(name), os.path.join(staging, name),
+                            ignore=shutil.ignore_patterns("__pycache__",
+                                                          "*.pyc"))
+        # zipimport only finds .pyc files next to their sources (legacy)
+        if not compileall.compile_dir(staging, quiet=1, legacy=True,
+                                      optimize=optimize):
+            sys.exit("compiling failed")
+        if not is_source_kept:
+            for root, _, files in os.walk(staging):
+                for f in files:
+                    if f.endswith(".py"):
+                        os.unlink(os.path.join(root, f))
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        zipapp.create_archive(staging, output,
+                              interpreter="/usr/bin/env python3",
+                              main=MAIN,
+                              compressed=is_compressed)
+    print(f"built {output} ({os.path.getsize(output)} bytes) "
+          f"for Python {sys.version_info[0]}.{sys.version_info[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="build a precompiled sniff zipapp.")
+    parser.add_argument("--output", type=str, default="dist/sniff.pyz",
+                        help="zipapp to write. Default: dist/sniff.pyz")
+    parser.add_argument("--optimize", type=int, default=0, choices=(0, 1),
+                        help="bytecode optimization level, 1 strips \
+                        asserts. Default: 0")
+    parser.add_argument("--compress", action="store_true",
+                        help="deflate the archive. Smaller, but slower to \
+                        import on the router's CPU.")
+    parser.add_argument("--no-source", action="store_true",
+                        help="bundle only bytecode. Smaller, but only runs \
+                        on the Python minor version that built it.")
+    args = parser.parse_args()
+    build(args.output, args.optimize, args.compress, not args.no_source)
+
+
+if __name__ == "__main__":
+    main()
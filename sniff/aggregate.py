@@ -0,0 +1,162 @@
+import logging as log
+import time
+from array import array
+
+from sniff.device import Device, DeviceStats
+
+np = None  # numpy is optional and slow to import, see _import_numpy()
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+
+class Aggregator():
+    """Merge devices from several scans into one record per MAC with RSSI
+    statistics: count, first/last seen, min/max/mean and last RSSI.
+
+    Example:
+        >>> from sniff.aggregate import Aggregator
+        >>> from sniff.device import Device
+        >>> agg = Aggregator()
+        >>> agg.add([Device(0xA, -60)], now_s=100)
+        >>> agg.add([Device(0xA, -70)], now_s=110)
+        >>> agg.records()
+        [DeviceStats({'rssi': -70, 'host': '', 'mac': '00:00:00:00:00:0A',
+          'count': 2, 'first_s': 100, 'last_s': 110, 'rssi_min': -70,
+          'rssi_max': -60, 'rssi_mean': -65.0})]
+    """
+
+    def __init__(self):
+        self.scans = 0
+        # key -> [count, first_s, last_s, rssi min, rssi max, rssi sum, last]
+        self.devices: dict[int, list] = {}
+
+    def add(self, devices: list[Device], now_s: float = None):
+        now_s = now_s or time.time()
+        self.scans += 1
+        for d in devices:
+            rssi = d.rssi
+            s = self.devices.get(d.key)
+            if s is None:
+                self.devices[d.key] = [1, now_s, now_s, rssi, rssi, rssi, d]
+                continue
+            s[0] += 1
+            s[2] = now_s
+            s[3] = min(s[3], rssi)
+            s[4] = max(s[4], rssi)
+            s[5] += rssi
+            s[6] = d
+
+    def records(self):
+        return [DeviceStats(d, count, int(first_s), int(last_s),
+                            rssi_min, rssi_max, round(rssi_sum / count, 1))
+                for count, first_s, last_s, rssi_min, rssi_max, rssi_sum, d
+                in self.devices.values()]
+
+
+class NumpyAggregator(Aggregator):
+    """Aggregator that appends observations to flat arrays and computes the
+    statistics in one vectorized pass, for sites with many devices."""
+
+    def __init__(self):
+        super().__init__()
+        self._index: dict[int, int] = {}  # key -> row
+        self._last: list[Device] = []  # row -> latest device
+        self._rows = array("i")
+        self._rssi = array("d")
+        self._at_s = array("d")
+
+    def add(self, devices: list[Device], now_s: float = None):
+        now_s = now_s or time.time()
+        self.scans += 1
+        for d in devices:
+            row = self._index.get(d.key)
+            if row is None:
+                row = self._index[d.key] = len(self._last)
+                self._last.append(d)
+            else:
+                self._last[row] = d
+            self._rows.append(row)
+            self._rssi.append(d.rssi)
+            self._at_s.append(now_s)
+
+    def records(self):
+        n = len(self._last)
+        if not n:
+            return []
+        rows = np.frombuffer(self._rows, dtype=np.intc)
+        rssi = np.frombuffer(self._rssi, dtype=np.float64)
+        at_s = np.frombuffer(self._at_s, dtype=np.float64)
+
+        count = np.bincount(rows, minlength=n)
+        mean = np.bincount(rows, weights=rssi, minlength=n) / count
+        rssi_min = np.full(n, np.inf)
+        rssi_max = np.full(n, -np.inf)
+        first_s = np.full(n, np.inf)
+        last_s = np.full(n, -np.inf)
+        np.minimum.at(rssi_min, rows, rssi)
+        np.maximum.at(rssi_max, rows, rssi)
+        np.minimum.at(first_s, rows, at_s)
+        np.maximum.at(last_s, rows, at_s)
+
+        return [DeviceStats(d, int(count[i]), int(first_s[i]),
+                            int(last_s[i]), int(rssi_min[i]),
+                            int(rssi_max[i]), round(float(mean[i]), 1))
+                for i, d in enumerate(self._last)]
+
+
+def make_aggregator(use_numpy=False):
+    if use_numpy and _import_numpy() is None:
+        log.warning("numpy isn't installed, aggregating without it.")
+    return NumpyAggregator() if use_numpy and np is not None \
+        else Aggregator()
+
+
+def aggregate(rounds: list[tuple[float, list[Device]]], use_numpy=False):
+    """One record per device from scans done at (unix time, devices)"""
+    agg = make_aggregator(use_numpy)
+    for now_s, devices in list(rounds):  # a copy, it may still grow
+        agg.add(devices, now_s)
+    return agg.records()
+
+
+def windowed(scan_once, rounds: int, round_s: float, use_numpy=False,
+             done: list[tuple[float, list[Device]]] = None,
+             until_s: float = None):
+    """Call scan_once() `rounds` times, starting one every `round_s`, and
+    return one aggregated record per device. Just scan_once() if rounds<=1.
+
+    Each round is appended to `done` as (unix time, devices) when it's
+    scanned, so the caller can aggregate() the ones done if this is cut
+    short. With `until_s` (a time.monotonic()), rounds that wouldn't be
+    done by then, going by how long the last one took, aren't started.
+    """
+    if rounds <= 1:
+        return scan_once()
+    done = [] if done is None else done
+    start_s = time.monotonic()
+    round_took_s = 0.0
+    for i in range(rounds):
+        at_s = start_s + i * round_s
+        if i and until_s is not None \
+                and max(at_s, time.monotonic()) + round_took_s > until_s:
+            log.warning(f"stopping after {i} of {rounds} scans, the next \
+                        wouldn't be done in time.")
+            break
+        wait_s = at_s - time.monotonic()
+        if wait_s > 0:
+            time.sleep(wait_s)
+        round_start_s = time.monotonic()
+        done.append((time.time(), scan_once()))
+        round_took_s = time.monotonic() - round_start_s
+    records = aggregate(done, use_numpy)
+    log.info(f"aggregated {len(records)} devices from {len(done)} scans.")
+    return records
@@ -0,0 +1,10 @@
+"""Benchmarks that run off-router: fake and recorded ubus transports, a
+fake `ubus` executable, a fake ubusd and a local HTTP sink to upload to.
+
+Example:
+    $ python -m sniff.bench parse --wifi 100 --ble 5000
+    $ python -m sniff.bench cycle --transport socket --ble 3000
+    root@RUTX11:~# python3 -m sniff.bench record --out /tmp/capture.json
+    $ python -m sniff.bench cycle --replay capture.json
+    $ python -m sniff.bench all --baseline sniff/bench/baseline.json
+"""
@@ -0,0 +1,274 @@
+import argparse
+import json
+import logging as log
+import os
+import shlex
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from typing import Any
+
+from sniff import cycle, parser as sniff_parser
+from sniff.bench import fakeubus
+from sniff.bench.sink import Sink
+from sniff.bench.transports import (FakeTransport, RecordingTransport,
+                                    ReplayTransport)
+from sniff.cli.sniff import create_parser
+from sniff.bench.fakeubusd import FakeUbusd, synthetic_objects
+from sniff.transport import SocketTransport, SubprocessTransport, \
+    get_transport
+
+TRANSPORTS = ("fake", "socket", "subprocess", "replay")
+# (wifi devices, bluetooth devices)
+SCENARIOS = {"quiet": (10, 10), "busy": (50, 3000)}
+DEFAULT_TOLERANCE = 0.25
+# changes smaller than these are noise, whatever the percentage
+NOISE_FLOORS = {"_ms_median": 2, "_ms_max": 10, "_kib": 64}
+
+
+def _ms(seconds: float):
+    return round(seconds * 1000, 2)
+
+
+def bench_parse(n_wifi: int, n_ble: int, repeat: int = 5):
+    """Devices per second through wifi_scan_parser and ble_scan_parser,
+    best of `repeat` timeit runs"""
+    objects = synthetic_objects(n_wifi, n_ble)
+    wifi_result = objects["iwinfo"]["scan"]({})
+    ble_result = objects["blesem"]["scan.result"]({})
+    results = {}
+    for name, parse, result, n in (
+            ("wifi", sniff_parser.wifi_scan_parser, wifi_result, n_wifi),
+            ("ble", sniff_parser.ble_scan_parser, ble_result, n_ble)):
+        timer = timeit.Timer(lambda: parse(result))
+        number, _ = timer.autorange()
+        best_s = min(timer.repeat(repeat, number)) / number
+        results[f"{name}_devices_per_s"] = round(n / best_s)
+    return results
+
+
+def make_args(api_url: str, sniff_args: list[str] = ()):
+    """sniff's args for a benchmark cycle, without touching config.ini"""
+    return vars(create_parser().parse_args([
+        "--api-url", api_url,
+        "--api-headers", "content-type: application/json",
+        "--ble-wait-s", "0",
+        "--no-outbox",
+        "--no-router-cache",
+        *sniff_args]))
+
+
+def make_transport(name: str, tmp_dir: str, n_wifi=10, n_ble=10,
+                   latency_s=0.0, replay: str = None, is_timed=False):
+    if name == "fake":
+        return FakeTransport(latency_s=latency_s, n_wifi=n_wifi,
+                             n_ble=n_ble)
+    if name == "socket":
+        path = os.path.join(tmp_dir, "ubus.sock")
+        FakeUbusd(path, synthetic_objects(n_wifi, n_ble), latency_s).start()
+        return SocketTransport(path)
+    if name == "subprocess":
+        fakeubus.install(tmp_dir, n_wifi, n_ble, latency_s)
+        return SubprocessTransport()
+    if name == "replay":
+        if not replay:
+            raise ValueError("--replay is required with --transport replay")
+        return ReplayTransport(replay, is_timed)
+    raise ValueError(f"unknown transport '{name}', "
+                     f"options: {', '.join(TRANSPORTS)}")
+
+
+def bench_cycle(transport, args: dict[str, Any], sink: Sink,
+                cycles: int = 10, tmp_dir: str = None):
+    """Latency of scan + send cycles, with bytes uploaded per cycle and the
+    peak memory allocated by one cycle. Presence, history and the
+    scheduler are on if `args` enable them, like in Daemon.cycle, with the
+    history file in `tmp_dir`."""
+    if args["history"]:
+        args = {**args, "history_path": os.path.join(
+            tmp_dir or tempfile.gettempdir(), "bench-history.bin")}
+    collectors = cycle.make_collectors(args, transport)
+    cache = cycle.make_cache(args)
+    targets = cycle.make_targets(args)
+    presence = cycle.make_presence(args, is_in_memory=True)
+    scheduler = cycle.make_scheduler(args, is_in_memory=True)
+    history = cycle.make_history(args)
+
+    def run():
+        start_s = time.perf_counter()
+        body = cycle.scan(args, collectors, cache=cache, presence=presence,
+                          scheduler=scheduler, history=history)
+        scanned_s = time.perf_counter()
+        cycle.send(body, targets)
+        return scanned_s - start_s, time.perf_counter() - scanned_s
+
+    run()  # warm up caches and the connection
+    sink.reset()
+    scans, sends = [], []
+    for _ in range(cycles):
+        scan_s, send_s = run()
+        scans.append(scan_s)
+        sends.append(send_s)
+    stats = sink.stats()
+
+    tracemalloc.start()
+    run()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for target in targets:
+        target.close()
+    if history is not None:
+        history.close()
+
+    totals = sorted(a + b for a, b in zip(scans, sends))
+    return {
+        "cycle_ms_median": _ms(statistics.median(totals)),
+        "cycle_ms_max": _ms(totals[-1]),
+        "scan_ms_median": _ms(statistics.median(scans)),
+        "send_ms_median": _ms(statistics.median(sends)),
+        "payload_raw_bytes": stats["raw_bytes"] // max(1, stats["requests"]),
+        "payload_wire_bytes":
+            stats["wire_bytes"] // max(1, stats["requests"]),
+        "peak_kib": round(peak_bytes / 1024, 1),
+    }
+
+
+def record(out: str, cycles: int, args: dict[str, Any]):
+    """Run sniff's ubus calls `cycles` times through the real transport and
+    save what ubus returned to `out`."""
+    transport = RecordingTransport(
+        get_transport(args["ubus_transport"], args["ubus_socket"]), out)
+    collectors = cycle.make_collectors(args, transport)
+    for i in range(cycles):
+        cycle.scan(args, collectors)
+        print(f"recorded cycle {i + 1}/{cycles}: "
+              f"{len(transport.calls)} calls so far")
+    print(f"saved {len(transport.calls)} calls to '{out}'")
+
+
+def run_all(tmp_dir: str, sink: Sink, cycles: int):
+    """The standard suite, flattened to {"<bench>.<scenario>.<metric>": n}"""
+    results = {}
+    for scenario, (n_wifi, n_ble) in SCENARIOS.items():
+        for k, v in bench_parse(n_wifi, n_ble).items():
+            results[f"parse.{scenario}.{k}"] = v
+        scenario_dir = os.path.join(tmp_dir, scenario)
+        os.makedirs(scenario_dir, exist_ok=True)
+        for name in ("fake", "socket"):
+            transport = make_transport(name, scenario_dir, n_wifi, n_ble)
+            for k, v in bench_cycle(transport, make_args(sink.url), sink,
+                                    cycles, scenario_dir).items():
+                results[f"cycle_{name}.{scenario}.{k}"] = v
+            transport.close()
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float],
+            tolerance: float = DEFAULT_TOLERANCE):
+    """Metrics more than `tolerance` worse than the baseline. Rates
+    (*_per_s) regress when lower, everything else when higher."""
+    regressions = []
+    for key, value in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        floor = next((f for suffix, f in NOISE_FLOORS.items()
+                      if key.endswith(suffix)), 0)
+        if abs(value - base) <= floor:
+            continue
+        change = (value - base) / base
+        if key.endswith("_per_s"):
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{key}: {base} -> {value} "
+                               f"({round(100 * change)}% worse)")
+    return regressions
+
+
+def create_parser_bench():
+    p = argparse.ArgumentParser(
+        prog="python -m sniff.bench",
+        description="benchmark sniff off-router with fake or recorded ubus.")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    parse = sub.add_parser("parse", help="parser throughput")
+    parse.add_argument("--wifi", type=int, default=100)
+    parse.add_argument("--ble", type=int, default=3000)
+    parse.add_argument("--repeat", type=int, default=5)
+
+    cyc = sub.add_parser("cycle", help="end-to-end scan and upload")
+    cyc.add_argument("--transport", choices=TRANSPORTS, default="fake")
+    cyc.add_argument("--wifi", type=int, default=10)
+    cyc.add_argument("--ble", type=int, default=10)
+    cyc.add_argument("--latency-s", type=float, default=0,
+                     help="seconds each fake ubus call takes")
+    cyc.add_argument("--replay", type=str, default=None,
+                     help="capture from `record` to replay, instead of \
+                     --transport")
+    cyc.add_argument("--timed", action="store_true",
+                     help="replay calls as slow as they were recorded")
+    cyc.add_argument("--cycles", type=int, default=10)
+    cyc.add_argument("--sniff-args", type=str, default="",
+                     help="extra sniff flags, eg. '--compression gzip'")
+
+    rec = sub.add_parser("record", help="record real ubus output to replay")
+    rec.add_argument("--out", type=str, required=True)
+    rec.add_argument("--cycles", type=int, default=3)
+    rec.add_argument("--sniff-args", type=str, default="",
+                     help="sniff flags, eg. '--ble-wait-s 10'")
+
+    suite = sub.add_parser("all", help="the standard suite")
+    suite.add_argument("--cycles", type=int, default=10)
+    suite.add_argument("--baseline", type=str, default=None,
+                       help="compare to results saved by --save-baseline")
+    suite.add_argument("--save-baseline", type=str, default=None)
+    suite.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                       help="fraction worse than baseline that fails. "
+                       f"Default: {DEFAULT_TOLERANCE}")
+    return p
+
+
+def main():
+    args = create_parser_bench().parse_args()
+    log.basicConfig(level=log.WARNING, format="%(levelname)s %(message)s")
+
+    if args.command == "parse":
+        print(json.dumps(bench_parse(args.wifi, args.ble, args.repeat),
+                         indent=4))
+        return
+    if args.command == "record":
+        sniff_args = make_args("", shlex.split(args.sniff_args))
+        return record(args.out, args.cycles, sniff_args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sink = Sink().start()
+        if args.command == "cycle":
+            name = "replay" if args.replay else args.transport
+            transport = make_transport(name, tmp_dir, args.wifi,
+                                       args.ble, args.latency_s,
+                                       args.replay, args.timed)
+            sniff_args = make_args(sink.url, shlex.split(args.sniff_args))
+            print(json.dumps(bench_cycle(transport, sniff_args, sink,
+                                         args.cycles, tmp_dir), indent=4))
+            return
+
+        results = run_all(tmp_dir, sink, args.cycles)
+        print(json.dumps(results, indent=4))
+        if args.save_baseline:
+            with open(args.save_baseline, "w") as f:
+                json.dump(results, f, indent=4)
+                f.write("\n")
+        if args.baseline:
+            with open(args.baseline, "r") as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            for r in regressions:
+                print(f"REGRESSION {r}", file=sys.stderr)
+            if regressions:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
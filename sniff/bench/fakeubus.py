@@ -0,0 +1,74 @@
+"""A fake `ubus` command line tool, for the subprocess transport.
+
+Supports `ubus call <path> <method> [json]` and `ubus list`, answering from
+sniff.bench.fakeubusd.synthetic_objects. Configured by environment
+variables: FAKE_UBUS_WIFI and FAKE_UBUS_BLE (device counts),
+FAKE_UBUS_LATENCY_S and FAKE_UBUS_SEED. install() puts it first in PATH as
+`ubus`.
+
+Example:
+    $ FAKE_UBUS_BLE=100 python -m sniff.bench.fakeubus call blesem scan.result
+"""
+import json
+import os
+import stat
+import sys
+import time
+
+from sniff.bench.fakeubusd import UbusStatus, synthetic_objects
+
+_SHIM = """#!/bin/sh
+exec "{python}" -m sniff.bench.fakeubus "$@"
+"""
+
+
+def install(dir: str, n_wifi=10, n_ble=10, latency_s=0.0, seed=0):
+    """Write a `ubus` executable to `dir`, put dir first in PATH and set
+    its environment. Returns the executable's path."""
+    path = os.path.join(dir, "ubus")
+    with open(path, "w") as f:
+        f.write(_SHIM.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    os.environ["PATH"] = f"{dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))),
+         os.environ.get("PYTHONPATH", "")])
+    os.environ["FAKE_UBUS_WIFI"] = str(n_wifi)
+    os.environ["FAKE_UBUS_BLE"] = str(n_ble)
+    os.environ["FAKE_UBUS_LATENCY_S"] = str(latency_s)
+    os.environ["FAKE_UBUS_SEED"] = str(seed)
+    return path
+
+
+def main(argv: list[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    objects = synthetic_objects(int(os.environ.get("FAKE_UBUS_WIFI", 10)),
+                                int(os.environ.get("FAKE_UBUS_BLE", 10)),
+                                int(os.environ.get("FAKE_UBUS_SEED", 0)))
+    if argv[:1] == ["list"]:
+        print("\n".join(objects))
+        return 0
+    if len(argv) < 3 or argv[0] != "call":
+        print("usage: ubus call <path> <method> [<message>]",
+              file=sys.stderr)
+        return 1
+    path, method = argv[1], argv[2]
+    args = json.loads(argv[3]) if len(argv) > 3 else {}
+    handler = objects.get(path, {}).get(method)
+    if handler is None:
+        print("Command failed: Not found", file=sys.stderr)
+        return 4
+    time.sleep(float(os.environ.get("FAKE_UBUS_LATENCY_S", 0)))
+    try:
+        result = handler(args)
+    except UbusStatus as e:
+        print(f"Command failed: {e}", file=sys.stderr)
+        return e.status
+    if result is not None:
+        print(json.dumps(result, indent="\t"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""A fake ubusd that speaks the ubus protocol on a local unix socket, so the
+socket transport can be run and tested off-router.
+
+Example:
+    $ python -m sniff.bench.fakeubusd --socket /tmp/ubus.sock --wifi 20 \
+        --ble 50 &
+    $ sniff --ubus-transport socket --ubus-socket /tmp/ubus.sock ...
+"""
+import argparse
+import itertools
+import logging as log
+import os
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Any, Callable
+
+from sniff import blobmsg
+from sniff import transport as t
+
+Handler = Callable[[dict[str, Any]], Any]
+
+
+class UbusStatus(Exception):
+    """Raise from a method handler to reply with a non-zero ubus status."""
+
+    def __init__(self, status: int):
+        super().__init__(f"ubus status {status}")
+        self.status = status
+
+
+def _random_mac(rng: random.Random):
+    return ":".join(f"{rng.randrange(256):02X}" for _ in range(6))
+
+
+def synthetic_objects(n_wifi=10, n_ble=10, seed=0, ble_discover_s=0):
+    """ubus objects that return made-up router info and scan results, like:
+    iwinfo scan, blesem scan.start/scan.result, mnfinfo get, system board
+    and rut_fota get_info.
+
+    Bluetooth devices are found evenly over `ble_discover_s` after
+    scan.start, like a real scan.
+    """
+    rng = random.Random(seed)
+    wifi_macs = [_random_mac(rng) for _ in range(n_wifi)]
+    ble_macs = [_random_mac(rng) for _ in range(n_ble)]
+
+    # wlan0-1 is a second interface on wlan0's radio, like a guest AP
+    phys = {"wlan0": "phy0", "wlan0-1": "phy0", "wlan1": "phy1"}
+    channels = {"phy0": [1, 6, 11], "phy1": [36, 149]}
+
+    def iwinfo_info(args):
+        if args.get("device") not in phys:
+            raise UbusStatus(t.UBUS_STATUS_NOT_FOUND)
+        return {"phy": phys[args["device"]]}
+
+    def iwinfo_scan(args):
+        # each radio hears every BSSID, on its own band
+        choices = channels.get(phys.get(args.get("device")),
+                               [1, 6, 11, 36, 149])
+        return {"results": [{
+            "ssid": f"wifi {i}",
+            "bssid": mac,
+            "mode": "Master",
+            "channel": rng.choice(choices),
+            "signal": rng.randint(-95, -30),
+            "quality": rng.randint(0, 70),
+            "quality_max": 70,
+            "encryption": {"enabled": True, "wpa": [2]},
+        } for i, mac in enumerate(wifi_macs)]}
+
+    ble_scan_s = [0.0]
+
+    def blesem_start(args):
+        ble_scan_s[0] = time.monotonic()
+
+    def blesem_result(args):
+        found = n_ble
+        if ble_discover_s > 0:
+            found = int(n_ble * (time.monotonic() - ble_scan_s[0])
+                        / ble_discover_s)
+        return {"scanning": 1, "devices": [
+            {"rssi": rng.randint(-100, -40), "address": mac,
+             **({"name": f"ble {i}"} if i % 3 == 0 else {})}
+            for i, mac in enumerate(ble_macs[:found])]}
+
+    return {
+        "iwinfo": {
+            "devices": lambda args: {"devices": list(phys)},
+            "info": iwinfo_info,
+            "scan": iwinfo_scan},
+        "blesem": {
+            "scan.start": blesem_start,
+            "scan.result": blesem_result},
+        "mnfinfo": {
+            "get": lambda args: {"mnfinfo": {"mac": "001E42000000",
+                                             "serial": "1100000000"}}},
+        "system": {
+            "board": lambda args: {"hostname": "RUTX11-fake",
+                                   "model": "RUTX11"}},
+        "rut_fota": {
+            "get_info": lambda args: {"fw": "RUTX_R_00.07.06.5"}},
+    }
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    server: "FakeUbusd"
+
+    def send(self, msg_type: int, seq: int, peer: int, attrs: bytes):
+        self.request.sendall(t._MSG_HDR.pack(0, msg_type, seq, peer)
+                             + blobmsg.blob_attr(0, attrs))
+
+    def send_status(self, seq: int, peer: int, status: int):
+        self.send(t.UBUS_MSG_STATUS, seq, peer,
+                  blobmsg.blob_attr(t.UBUS_ATTR_STATUS,
+                                    struct.pack(">i", status)))
+
+    def recv(self):
+        head = self.request.recv(t._MSG_HDR.size + t._BLOB_HDR.size,
+                                 socket.MSG_WAITALL)
+        if len(head) < t._MSG_HDR.size + t._BLOB_HDR.size:
+            return None
+        _, msg_type, seq, peer = t._MSG_HDR.unpack_from(head)
+        id_len, = t._BLOB_HDR.unpack_from(head, t._MSG_HDR.size)
+        length = (id_len & blobmsg.BLOB_ATTR_LEN_MASK) - t._BLOB_HDR.size
+        body = self.request.recv(length, socket.MSG_WAITALL) \
+            if length else b""
+        attrs = {i: bytes(p) for i, _, p in blobmsg.iter_attrs(body)}
+        return msg_type, seq, peer, attrs
+
+    def handle(self):
+        client_id = next(self.server.ids)
+        self.send(t.UBUS_MSG_HELLO, 0, client_id, b"")
+        while True:
+            msg = self.recv()
+            if msg is None:
+                return
+            msg_type, seq, peer, attrs = msg
+            if msg_type == t.UBUS_MSG_LOOKUP:
+                self.lookup(seq, peer, attrs)
+            elif msg_type == t.UBUS_MSG_INVOKE:
+                self.invoke(seq, peer, attrs)
+            else:
+                self.send_status(seq, peer, 1)  # UBUS_STATUS_INVALID_COMMAND
+
+    def lookup(self, seq: int, peer: int, attrs: dict[int, bytes]):
+        path = attrs[t.UBUS_ATTR_OBJPATH].split(b"\0")[0].decode()
+        obj_id = self.server.ids_by_path.get(path)
+        if obj_id is None:
+            return self.send_status(seq, peer, t.UBUS_STATUS_NOT_FOUND)
+        id_attr = struct.pack(">I", obj_id)
+        self.send(t.UBUS_MSG_DATA, seq, peer,
+                  blobmsg.blob_attr(t.UBUS_ATTR_OBJPATH,
+                                    path.encode() + b"\0")
+                  + blobmsg.blob_attr(t.UBUS_ATTR_OBJID, id_attr)
+                  + blobmsg.blob_attr(t.UBUS_ATTR_OBJTYPE, id_attr)
+                  + blobmsg.blob_attr(t.UBUS_ATTR_SIGNATURE, b""))
+        self.send_status(seq, peer, t.UBUS_STATUS_OK)
+
+    def invoke(self, seq: int, peer: int, attrs: dict[int, bytes]):
+        obj_id, = struct.unpack(">I", attrs[t.UBUS_ATTR_OBJID][:4])
+        method = attrs[t.UBUS_ATTR_METHOD].split(b"\0")[0].decode()
+        args = blobmsg.decode(attrs.get(t.UBUS_ATTR_DATA, b""))
+        methods = self.server.objects_by_id.get(obj_id)
+        if methods is None:
+            return self.send_status(seq, peer, t.UBUS_STATUS_NOT_FOUND)
+        if method not in methods:
+            return self.send_status(seq, peer, 3)  # METHOD_NOT_FOUND
+
+        time.sleep(self.server.latency_s)
+        self.server.calls += 1
+        try:
+            result = methods[method](args)
+        except UbusStatus as e:
+            return self.send_status(seq, peer, e.status)
+        if result is not None:
+            self.send(t.UBUS_MSG_DATA, seq, peer,
+                      blobmsg.blob_attr(t.UBUS_ATTR_OBJID,
+                                        attrs[t.UBUS_ATTR_OBJID])
+                      + blobmsg.blob_attr(t.UBUS_ATTR_DATA,
+                                          blobmsg.encode(result)))
+        self.send_status(seq, peer, t.UBUS_STATUS_OK)
+
+
+class FakeUbusd(socketserver.ThreadingUnixStreamServer):
+    """Serve `objects` ({path: {method: handler(args) -> dict}}) over a unix
+    socket at `path`, waiting `latency_s` before each reply."""
+    daemon_threads = True
+
+    def __init__(self,
+                 path: str,
+                 objects: dict[str, dict[str, Handler]] = None,
+                 latency_s: float = 0):
+        if os.path.exists(path):
+            os.unlink(path)
+        objects = synthetic_objects() if objects is None else objects
+        self.path = path
+        self.latency_s = latency_s
+        self.calls = 0
+        self.ids = itertools.count(1)
+        self.ids_by_path = {p: next(self.ids) for p in objects}
+        self.objects_by_id = {self.ids_by_path[p]: m
+                              for p, m in objects.items()}
+        super().__init__(path, _RequestHandler)
+
+    def start(self):
+        """serve in a background thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="fakeubusd",
+        description="serve made-up ubus objects on a unix socket.")
+    parser.add_argument("--socket", type=str, default="/tmp/ubus.sock")
+    parser.add_argument("--wifi", type=int, default=10,
+                        help="number of wifi devices to return")
+    parser.add_argument("--ble", type=int, default=10,
+                        help="number of bluetooth devices to return")
+    parser.add_argument("--latency-s", type=float, default=0,
+                        help="seconds to wait before each reply")
+    parser.add_argument("--ble-discover-s", type=float, default=0,
+                        help="seconds a bluetooth scan takes to find \
+                        all devices")
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.INFO)
+    server = FakeUbusd(args.socket,
+                       synthetic_objects(args.wifi, args.ble,
+                                         ble_discover_s=args.ble_discover_s),
+                       args.latency_s)
+    log.info(f"serving fake ubusd on '{args.socket}'...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
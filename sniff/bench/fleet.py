@@ -0,0 +1,245 @@
+"""Simulate a fleet of routers posting to an API, eg. sniff-receiver.
+
+Each router posts a body shaped like sniff's every `--interval-s`, spread
+evenly over the interval, on a new connection like a cron run. Reports the
+request rate reached, status counts and latency percentiles.
+
+Example:
+    $ python -m sniff.bench.fleet --start-receiver --routers 6000 \\
+        --interval-s 60 --duration-s 60 --compression gzip
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from typing import Any
+from urllib.parse import urlsplit
+
+from sniff import sender
+from sniff.device import int_to_mac
+
+
+def make_body(router: int, n_wifi: int, n_ble: int, rng: random.Random):
+    """A body like cycle.scan() returns, for router number `router`"""
+    now_s = int(time.time())
+
+    def devices(n: int, is_wifi: bool):
+        return [{**({"quality": round(rng.random(), 2)} if is_wifi else {}),
+                 "rssi": rng.randint(-100, -30),
+                 "host": f"device {i}" if i % 3 == 0 else "",
+                 "mac": int_to_mac(rng.getrandbits(48))}
+                for i in range(n)]
+
+    return {
+        "id": uuid.uuid4().hex,
+        "scan": {"ble_start_s": now_s - 10, "ble_end_s": now_s,
+                 "wifi_start_s": now_s - 10, "wifi_end_s": now_s - 8},
+        "router": {"serial": f"{1100000000 + router}",
+                   "mac": f"{0x001E42000000 + router:012X}",
+                   "fw": "RUTX_R_00.07.06.5",
+                   "hostname": f"RUTX11-{router}",
+                   "timezone": "UTC+0000"},
+        "wifi": devices(n_wifi, True),
+        "ble": devices(n_ble, False),
+    }
+
+
+class Fleet():
+    """Routers posting to `url` every `interval_s` for `duration_s`"""
+
+    def __init__(self, url: str, routers: int, interval_s: float,
+                 duration_s: float, n_wifi: int = 10, n_ble: int = 50,
+                 compression: str = "none", batch: int = 1,
+                 concurrency: int = 512, seed: int = 0):
+        u = urlsplit(url)
+        self.host, self.port = u.hostname, u.port or 80
+        self.path = u.path or "/"
+        self.routers = routers
+        self.interval_s = interval_s
+        self.duration_s = duration_s
+        self.compression = compression
+        self.batch = batch
+        self.concurrency = concurrency
+        rng = random.Random(seed)
+        # a few scans to pick from, it's the server being measured
+        self.templates = [make_body(i, n_wifi, n_ble, rng)
+                          for i in range(16)]
+        self.statuses: dict[str, int] = {}
+        self.latencies_s: list[float] = []
+        self.bodies = 0
+        self.devices = 0
+        self.late = 0
+
+    def _encode(self, router: int):
+        bodies = []
+        for _ in range(self.batch):
+            body = dict(self.templates[router % len(self.templates)])
+            body["id"] = uuid.uuid4().hex
+            body["router"] = {**body["router"],
+                              "mac": f"{0x001E42000000 + router:012X}"}
+            bodies.append(body)
+        self.bodies += len(bodies)
+        self.devices += sum(len(b["wifi"]) + len(b["ble"]) for b in bodies)
+        data = bodies[0] if self.batch == 1 else bodies
+        wire = sender.compress(json.dumps(data).encode(), self.compression,
+                               6)
+        headers = f"POST {self.path} HTTP/1.1\r\n" \
+            f"Host: {self.host}:{self.port}\r\n" \
+            "Content-Type: application/json\r\n" \
+            f"Content-Length: {len(wire)}\r\n" \
+            "Connection: close\r\n"
+        if self.compression != "none":
+            headers += f"Content-Encoding: {self.compression}\r\n"
+        return headers.encode() + b"\r\n" + wire
+
+    async def _post(self, router: int, slots: asyncio.Semaphore):
+        request = self._encode(router)
+        start_s = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(self.host,
+                                                           self.port)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status = (await reader.readline()).split(b" ")[1].decode()
+                await reader.read()
+            finally:
+                writer.close()
+            self.latencies_s.append(time.perf_counter() - start_s)
+        except (OSError, IndexError, asyncio.IncompleteReadError) as e:
+            status = type(e).__name__
+        finally:
+            slots.release()
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    async def run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        step_s = self.interval_s / self.routers
+        start_s = time.perf_counter()
+        n = 0
+        while True:
+            at_s = n * step_s
+            if at_s >= self.duration_s:
+                break
+            delay_s = start_s + at_s - time.perf_counter()
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+            elif delay_s < -1:
+                self.late += 1  # can't keep up, the client is the limit
+            await slots.acquire()
+            task = asyncio.create_task(self._post(n % self.routers, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            n += 1
+        await asyncio.gather(*tasks)
+        return self.report(n, time.perf_counter() - start_s)
+
+    def report(self, requests: int, elapsed_s: float):
+        lat_ms = sorted(1000 * s for s in self.latencies_s) or [0]
+
+        def pct(p: float):
+            return round(lat_ms[min(len(lat_ms) - 1,
+                                    int(p * len(lat_ms)))], 1)
+
+        return {
+            "requests": requests,
+            "elapsed_s": round(elapsed_s, 1),
+            "requests_per_s": round(requests / elapsed_s, 1),
+            "target_per_s": round(self.routers / self.interval_s, 1),
+            "bodies_per_s": round(self.bodies / elapsed_s, 1),
+            "devices_per_s": round(self.devices / elapsed_s),
+            "statuses": self.statuses,
+            "late": self.late,
+            "latency_ms_p50": pct(0.5),
+            "latency_ms_p99": pct(0.99),
+            "latency_ms_max": round(lat_ms[-1], 1),
+            "latency_ms_mean": round(statistics.mean(lat_ms), 1),
+        }
+
+
+def start_receiver(db_path: str, port: int, extra: list[str] = ()):
+    """sniff-receiver in its own process, once it's accepting requests"""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "sniff.cli.receiver", "--port", str(port),
+         "--db-path", db_path, "--log-level", "WARNING", *extra],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__)))),
+             os.environ.get("PYTHONPATH", "")])})
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats",
+                                   timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("sniff-receiver didn't start")
+
+
+def receiver_stats(url: str) -> dict[str, Any]:
+    u = urlsplit(url)
+    try:
+        with urllib.request.urlopen(f"{u.scheme}://{u.netloc}/stats",
+                                    timeout=5) as r:
+            return json.loads(r.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def main():
+    p = argparse.ArgumentParser(
+        prog="python -m sniff.bench.fleet",
+        description="simulate many routers posting to an API.")
+    p.add_argument("--url", type=str, default="http://127.0.0.1:8080/")
+    p.add_argument("--start-receiver", action="store_true",
+                   help="run sniff-receiver on --url's port, with a \
+                   temporary database")
+    p.add_argument("--receiver-args", type=str, default="",
+                   help="extra sniff-receiver flags, eg. '--max-pending 50'")
+    p.add_argument("--routers", type=int, default=3000)
+    p.add_argument("--interval-s", type=float, default=60,
+                   help="seconds between each router's posts")
+    p.add_argument("--duration-s", type=float, default=60)
+    p.add_argument("--wifi", type=int, default=10,
+                   help="wifi devices per body")
+    p.add_argument("--ble", type=int, default=50,
+                   help="bluetooth devices per body")
+    p.add_argument("--compression", choices=sender.COMPRESSIONS,
+                   default="none")
+    p.add_argument("--batch", type=int, default=1,
+                   help="bodies per request, like an outbox catching up")
+    p.add_argument("--concurrency", type=int, default=512,
+                   help="most requests in flight")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        proc = None
+        if args.start_receiver:
+            proc = start_receiver(os.path.join(tmp_dir, "sniff.db"),
+                                  urlsplit(args.url).port or 80,
+                                  args.receiver_args.split())
+        try:
+            fleet = Fleet(args.url, args.routers, args.interval_s,
+                          args.duration_s, args.wifi, args.ble,
+                          args.compression, args.batch, args.concurrency)
+            report = asyncio.run(fleet.run())
+            report["receiver"] = receiver_stats(args.url)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""A local HTTP server to upload to, that counts what it receives.
+
+Example:
+    $ python -m sniff.bench.sink --port 8765 &
+    $ sniff --api-url http://127.0.0.1:8765/ ...
+"""
+import argparse
+import gzip
+import json
+import logging as log
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _read_chunked(rfile):
+    body = b""
+    while True:
+        size = int(rfile.readline().split(b";")[0], 16)
+        if not size:
+            rfile.readline()
+            return body
+        body += rfile.read(size)
+        rfile.readline()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "Sink"
+    protocol_version = "HTTP/1.1"  # keep-alive, like a real API
+    # headers and body are written separately, don't wait for an ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding", "") == "chunked":
+            wire = _read_chunked(self.rfile)
+        else:
+            wire = self.rfile.read(int(self.headers.get("Content-Length",
+                                                        0)))
+        encoding = self.headers.get("Content-Encoding", "")
+        raw = gzip.decompress(wire) if encoding == "gzip" \
+            else zlib.decompress(wire) if encoding == "deflate" else wire
+        body = json.loads(raw)
+        self.server.record(len(wire), len(raw),
+                           len(body) if isinstance(body, list) else 1,
+                           body)
+        status = self.server.status
+        reply = b"ok"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        log.debug(f"sink: {format % args}")
+
+
+class Sink(ThreadingHTTPServer):
+    """Accept POSTed JSON bodies on `host`:`port` (0 for any free port) and
+    keep count of requests, bodies and bytes on the wire and decoded.
+    Replies `status` to every request, eg. 503 to test retries.
+
+    Example:
+        >>> from sniff.bench.sink import Sink
+        >>> sink = Sink().start()
+        >>> sender.post_data({"scan": {}}, sink.url, {})
+        (None, 'ok')
+        >>> sink.stats()
+        {'requests': 1, 'bodies': 1, 'wire_bytes': 12, 'raw_bytes': 12}
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, status=200,
+                 is_kept=False):
+        super().__init__((host, port), _Handler)
+        self.status = status
+        self.is_kept = is_kept  # keep received bodies, eg. to check them
+        self.requests = 0
+        self.bodies = 0
+        self.wire_bytes = 0
+        self.raw_bytes = 0
+        self.received = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def record(self, wire_bytes: int, raw_bytes: int, bodies: int, body):
+        with self._lock:
+            self.requests += 1
+            self.bodies += bodies
+            self.wire_bytes += wire_bytes
+            self.raw_bytes += raw_bytes
+            if self.is_kept:
+                self.received.append(body)
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "bodies": self.bodies,
+                    "wire_bytes": self.wire_bytes,
+                    "raw_bytes": self.raw_bytes}
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.bodies = 0
+            self.wire_bytes = self.raw_bytes = 0
+            self.received = []
+
+    def start(self):
+        """serve in a background thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="sniff.bench.sink",
+        description="accept and count uploads from sniff.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--status", type=int, default=200,
+                        help="HTTP status to reply with")
+    args = parser.parse_args()
+
+    log.basicConfig(level=log.DEBUG, format="%(message)s")
+    sink = Sink(args.host, args.port, args.status)
+    log.info(f"sink listening on {sink.url}")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        log.info(f"received: {sink.stats()}")
+
+
+if __name__ == "__main__":
+    main()
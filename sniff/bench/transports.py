@@ -0,0 +1,141 @@
+import json
+import logging as log
+import os
+import subprocess
+import threading
+import time
+from typing import Any
+
+from sniff.bench.fakeubusd import Handler, UbusStatus, synthetic_objects
+from sniff.transport import (Transport, UBUS_STATUS_NOT_FOUND,
+                             _status_error, parse_cmd)
+
+CAPTURE_VERSION = 1
+
+
+class FakeTransport(Transport):
+    """Answer `ubus call`s in-process from made-up objects (see
+    sniff.bench.fakeubusd.synthetic_objects), after `latency_s`. Measures
+    sniff itself, without any IPC.
+
+    Example:
+        >>> from sniff.bench.transports import FakeTransport
+        >>> FakeTransport(n_wifi=2).call("ubus call iwinfo scan")["results"]
+        [{'ssid': 'wifi 0', ...}, {'ssid': 'wifi 1', ...}]
+    """
+    name = "fake"
+
+    def __init__(self,
+                 objects: dict[str, dict[str, Handler]] = None,
+                 latency_s: float = 0,
+                 n_wifi: int = 10,
+                 n_ble: int = 10,
+                 seed: int = 0):
+        self.objects = objects if objects is not None \
+            else synthetic_objects(n_wifi, n_ble, seed)
+        self.latency_s = latency_s
+        self.calls = 0
+
+    def call(self, cmd_str: str, timeout_s: float = None):
+        parsed = parse_cmd(cmd_str)
+        if parsed is None:
+            raise _status_error(cmd_str, UBUS_STATUS_NOT_FOUND)
+        path, method, args = parsed
+        handler = self.objects.get(path, {}).get(method)
+        if handler is None:
+            raise _status_error(cmd_str, UBUS_STATUS_NOT_FOUND)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        self.calls += 1
+        try:
+            result = handler(args)
+        except UbusStatus as e:
+            raise _status_error(cmd_str, e.status)
+        # a copy, as if decoded from ubusd's reply
+        return json.loads(json.dumps(result if result is not None else {}))
+
+
+class RecordingTransport(Transport):
+    """Pass calls through to `transport` and record each result (or error
+    status) and how long it took, to replay later with ReplayTransport.
+
+    The capture file is rewritten after every call, so it's complete even
+    if sniff is stopped.
+    """
+    name = "record"
+
+    def __init__(self, transport: Transport, path: str):
+        self.transport = transport
+        self.path = path
+        self.calls: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def call(self, cmd_str: str, timeout_s: float = None):
+        start_s = time.monotonic()
+        record: dict[str, Any] = {"cmd": cmd_str}
+        try:
+            result = self.transport.call(cmd_str, timeout_s)
+            record["result"] = result
+            return result
+        except subprocess.CalledProcessError as e:
+            record["status"] = e.returncode
+            raise
+        except subprocess.TimeoutExpired:
+            record["timeout"] = True
+            raise
+        finally:
+            record["elapsed_s"] = round(time.monotonic() - start_s, 4)
+            with self._lock:
+                self.calls.append(record)
+                self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CAPTURE_VERSION, "calls": self.calls}, f)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """Answer calls from a capture made by RecordingTransport.
+
+    Each command gets its recorded results in order, starting over after
+    the last one, so replays are deterministic. With `is_timed`, each call
+    also takes as long as it did when recorded.
+    """
+    name = "replay"
+
+    def __init__(self, path: str, is_timed: bool = False):
+        with open(path, "r") as f:
+            capture = json.load(f)
+        if capture.get("version") != CAPTURE_VERSION:
+            raise ValueError(f"unsupported capture version in '{path}': "
+                             f"{capture.get('version')}")
+        self.path = path
+        self.is_timed = is_timed
+        self.records: dict[str, list[dict[str, Any]]] = {}
+        for record in capture["calls"]:
+            self.records.setdefault(record["cmd"], []).append(record)
+        self._next = {cmd: 0 for cmd in self.records}
+        self._lock = threading.Lock()
+        log.debug(f"replaying {len(capture['calls'])} calls from '{path}'.")
+
+    def call(self, cmd_str: str, timeout_s: float = None):
+        records = self.records.get(cmd_str)
+        if not records:
+            raise _status_error(cmd_str, UBUS_STATUS_NOT_FOUND)
+        with self._lock:
+            i = self._next[cmd_str]
+            self._next[cmd_str] = (i + 1) % len(records)
+        record = records[i]
+        if self.is_timed:
+            time.sleep(record["elapsed_s"])
+        if record.get("timeout"):
+            raise subprocess.TimeoutExpired(cmd_str, timeout_s)
+        if "result" not in record:
+            raise _status_error(cmd_str,
+                                record.get("status", UBUS_STATUS_NOT_FOUND))
+        return json.loads(json.dumps(record["result"]))
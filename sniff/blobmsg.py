@@ -0,0 +1,144 @@
+"""Encode and decode libubox blob/blobmsg attributes, as used by ubusd.
+
+A blob attribute is a 32-bit big-endian header (extended flag, 7-bit id,
+24-bit length including the header) followed by its payload, padded to 4
+bytes. blobmsg attributes set the extended flag and prefix the payload with
+a name, and use the id as the value type.
+"""
+import struct
+from typing import Any, Iterator
+
+BLOB_ATTR_EXTENDED = 0x80000000
+BLOB_ATTR_ID_MASK = 0x7f000000
+BLOB_ATTR_ID_SHIFT = 24
+BLOB_ATTR_LEN_MASK = 0x00ffffff
+
+BLOBMSG_TYPE_UNSPEC = 0
+BLOBMSG_TYPE_ARRAY = 1
+BLOBMSG_TYPE_TABLE = 2
+BLOBMSG_TYPE_STRING = 3
+BLOBMSG_TYPE_INT64 = 4
+BLOBMSG_TYPE_INT32 = 5
+BLOBMSG_TYPE_INT16 = 6
+BLOBMSG_TYPE_INT8 = 7  # also used for booleans
+BLOBMSG_TYPE_DOUBLE = 8
+
+_HDR = struct.Struct(">I")
+_INT32_MIN, _INT32_MAX = -2**31, 2**31 - 1
+
+
+def pad(length: int):
+    return (length + 3) & ~3
+
+
+def blob_attr(attr_id: int, payload: bytes, extended=False):
+    """Encode one blob attribute, padded to 4 bytes."""
+    length = _HDR.size + len(payload)
+    if length > BLOB_ATTR_LEN_MASK:
+        raise ValueError(f"blob attribute too long: {length} bytes")
+    id_len = (attr_id << BLOB_ATTR_ID_SHIFT) | length
+    if extended:
+        id_len |= BLOB_ATTR_EXTENDED
+    return _HDR.pack(id_len) + payload + b"\0" * (pad(length) - length)
+
+
+def iter_attrs(buf: bytes, offset=0, end=None) \
+        -> Iterator[tuple[int, bool, memoryview]]:
+    """Yield (id, extended, payload) of each blob attribute in buf."""
+    view = memoryview(buf)
+    end = len(buf) if end is None else end
+    while offset + _HDR.size <= end:
+        id_len, = _HDR.unpack_from(view, offset)
+        length = id_len & BLOB_ATTR_LEN_MASK
+        if length < _HDR.size or offset + length > end:
+            raise ValueError(f"bad blob attribute length {length} "
+                             f"at offset {offset}")
+        attr_id = (id_len & BLOB_ATTR_ID_MASK) >> BLOB_ATTR_ID_SHIFT
+        extended = bool(id_len & BLOB_ATTR_EXTENDED)
+        yield attr_id, extended, view[offset + _HDR.size:offset + length]
+        offset += pad(length)
+
+
+def _encode_value(value: Any):
+    if isinstance(value, bool):
+        return BLOBMSG_TYPE_INT8, bytes([int(value)])
+    if isinstance(value, int):
+        if _INT32_MIN <= value <= _INT32_MAX:
+            return BLOBMSG_TYPE_INT32, struct.pack(">i", value)
+        return BLOBMSG_TYPE_INT64, struct.pack(">q", value)
+    if isinstance(value, float):
+        return BLOBMSG_TYPE_DOUBLE, struct.pack(">d", value)
+    if isinstance(value, str):
+        return BLOBMSG_TYPE_STRING, value.encode() + b"\0"
+    if isinstance(value, dict):
+        return BLOBMSG_TYPE_TABLE, encode(value)
+    if isinstance(value, (list, tuple)):
+        return BLOBMSG_TYPE_ARRAY, b"".join(
+            blobmsg_attr("", v) for v in value)
+    if value is None:
+        return BLOBMSG_TYPE_UNSPEC, b""
+    raise TypeError(f"can't encode {type(value).__name__} as blobmsg")
+
+
+def blobmsg_attr(name: str, value: Any):
+    """Encode one named blobmsg attribute."""
+    name_b = name.encode()
+    hdr_len = pad(2 + len(name_b) + 1)
+    hdr = struct.pack(">H", len(name_b)) + name_b
+    hdr += b"\0" * (hdr_len - len(hdr))
+    blob_type, data = _encode_value(value)
+    return blob_attr(blob_type, hdr + data, extended=True)
+
+
+def encode(table: dict[str, Any]):
+    """Encode a dict as the contents of a blobmsg table."""
+    return b"".join(blobmsg_attr(k, v) for k, v in table.items())
+
+
+def _decode_value(blob_type: int, data: memoryview):
+    if blob_type == BLOBMSG_TYPE_STRING:
+        return bytes(data).split(b"\0", 1)[0].decode(errors="replace")
+    if blob_type == BLOBMSG_TYPE_INT32:
+        return struct.unpack_from(">i", data)[0]
+    if blob_type == BLOBMSG_TYPE_INT8:
+        return bool(data[0])
+    if blob_type == BLOBMSG_TYPE_TABLE:
+        return decode(data)
+    if blob_type == BLOBMSG_TYPE_ARRAY:
+        return [v for _, v in _iter_blobmsg(data)]
+    if blob_type == BLOBMSG_TYPE_INT64:
+        return struct.unpack_from(">q", data)[0]
+    if blob_type == BLOBMSG_TYPE_INT16:
+        return struct.unpack_from(">h", data)[0]
+    if blob_type == BLOBMSG_TYPE_DOUBLE:
+        return struct.unpack_from(">d", data)[0]
+    return None
+
+
+def _iter_named(buf: memoryview):
+    for blob_type, extended, payload in iter_attrs(buf):
+        if not extended:
+            continue  # not a blobmsg attribute
+        name_len, = struct.unpack_from(">H", payload)
+        name = bytes(payload[2:2 + name_len]).decode(errors="replace")
+        yield name, blob_type, payload[pad(2 + name_len + 1):]
+
+
+def _iter_blobmsg(buf: memoryview):
+    for name, blob_type, data in _iter_named(buf):
+        yield name, _decode_value(blob_type, data)
+
+
+def iter_array(buf: bytes, name: str) -> Iterator[Any]:
+    """Yield the values of the array `name` in a blobmsg table one at a
+    time, decoding each only when it's reached."""
+    for attr_name, blob_type, data in _iter_named(memoryview(buf)):
+        if attr_name == name and blob_type == BLOBMSG_TYPE_ARRAY:
+            for _, value in _iter_blobmsg(data):
+                yield value
+            return
+
+
+def decode(buf: bytes):
+    """Decode the contents of a blobmsg table into a dict."""
+    return {k: v for k, v in _iter_blobmsg(memoryview(buf))}
@@ -0,0 +1,151 @@
+import json
+import logging as log
+import os
+import time
+from typing import Any
+
+import sniff.params as ps
+
+
+def _stat_key(path: str):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime, st.st_size]
+    except OSError:
+        return None
+
+
+def _read(path: str):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def parse_ttls(ttls: str):
+    """Parse "fw=86400,hostname=3600" into {"fw": 86400.0, ...}
+
+    Raises:
+        ValueError: if a pair isn't name=seconds.
+    """
+    parsed = {}
+    for pair in filter(str.strip, ttls.split(",")):
+        name, _, seconds = pair.partition("=")
+        try:
+            if not name.strip() or "=" in seconds:
+                raise ValueError
+            parsed[name.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"'{pair.strip()}' isn't name=seconds")
+    return parsed
+
+
+class RouterCache():
+    """Cache slow-changing router identity fields on disk, each with its
+    own TTL.
+
+    Fields are keyed by collector name (mnf, fw, hostname, timezone).
+    hostname and timezone are dropped when /etc/config/system changes, and
+    everything is dropped when a firmware upgrade or reboot is detected.
+    The default path is on tmpfs, so a reboot clears it anyway.
+    Pass path=None to keep the cache in memory only.
+
+    Example:
+        >>> from sniff.cache import RouterCache
+        >>> cache = RouterCache("/tmp/sniff/router.json")
+        >>> cache.get("fw") or cache.set("fw", fw.fw())
+        'RUTX_R_00.07.06.5'
+        >>> cache.save()
+    """
+    DEFAULT_PATH = ps.ROUTER_CACHE_PATH
+    DEFAULT_TTLS_S = ps.ROUTER_CACHE_TTLS_S
+    # fields that come from /etc/config/system
+    SYSTEM_FIELDS = ("hostname", "timezone")
+
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 ttls_s: dict[str, float] = None,
+                 path_etc_config_system=ps.PATH_ETC_CONFIG_SYSTEM,
+                 path_fw_version=ps.PATH_FW_VERSION,
+                 path_boot_id=ps.PATH_BOOT_ID):
+        self.path = path
+        self.ttls_s = {**self.DEFAULT_TTLS_S, **(ttls_s or {})}
+        self.path_etc_config_system = path_etc_config_system
+        self.path_fw_version = path_fw_version
+        self.path_boot_id = path_boot_id
+        self.fields: dict[str, dict[str, Any]] = {}
+        self.fingerprint: dict[str, Any] = {}
+        self._is_dirty = False
+        self.load()
+
+    def _fingerprint(self):
+        return {
+            "system": _stat_key(self.path_etc_config_system),
+            "fw": [_stat_key(self.path_fw_version),
+                   _read(self.path_boot_id)],
+        }
+
+    def load(self):
+        if self.path:
+            try:
+                with open(self.path, "r") as f:
+                    saved = json.load(f)
+                self.fields = saved.get("fields", {})
+                self.fingerprint = saved.get("fingerprint", {})
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                log.warning(f"ignoring bad router cache '{self.path}': {e}")
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop fields whose source changed since they were cached."""
+        fingerprint = self._fingerprint()
+        if fingerprint["fw"] != self.fingerprint.get("fw"):
+            if self.fields:
+                log.info("firmware or boot changed, clearing router cache.")
+            self.clear()
+        elif fingerprint["system"] != self.fingerprint.get("system"):
+            log.info(f"'{self.path_etc_config_system}' changed, \
+                     clearing {self.SYSTEM_FIELDS} from router cache.")
+            for name in self.SYSTEM_FIELDS:
+                self.fields.pop(name, None)
+            self._is_dirty = True
+        self.fingerprint = fingerprint
+
+    def clear(self):
+        self.fields = {}
+        self._is_dirty = True
+
+    def get(self, name: str, default: Any = None):
+        field = self.fields.get(name)
+        if field is None:
+            return default
+        age_s = time.time() - field["at_s"]
+        if not 0 <= age_s < self.ttls_s.get(name, 0):
+            log.debug("router cache '%s' expired after %ds.", name, age_s)
+            del self.fields[name]
+            self._is_dirty = True
+            return default
+        return field["value"]
+
+    def set(self, name: str, value: Any):
+        self.fields[name] = {"value": value, "at_s": time.time()}
+        self._is_dirty = True
+        return value
+
+    def save(self):
+        """Write the cache atomically, if it changed."""
+        if not self.path or not self._is_dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"fingerprint": self.fingerprint,
+                           "fields": self.fields}, f)
+            os.replace(tmp_path, self.path)
+            self._is_dirty = False
+        except OSError as e:
+            log.warning(f"couldn't write router cache '{self.path}': {e}")
@@ -1,11 +1,18 @@
 from argparse import ArgumentParser
+import logging as log
 import os
 import configparser
 import sys
 from typing import Any
 
+import sniff.params as ps
 
-DEFAULT_CONFIG_FILE = os.path.join(os.getcwd(), "config.ini")
+DEFAULT_CONFIG_FILE = ps.CONFIG_PATH
+# where older versions wrote it: the directory sniff was run from
+LEGACY_CONFIG_FILE = "config.ini"
+_warned: set[str] = set()  # legacy config files warned about
+# args that are about this run, never saved to the config file
+NOT_SAVED = ("write_config",)
 
 
 # Function to convert string to boolean
@@ -20,24 +27,73 @@ def str2bool(v):
         return v
 
 
-def get_or_write_config(parser: ArgumentParser, filepath: str = None):
-    args: dict[str, Any] = vars(parser.parse_args(sys.argv[1:]))
-    filepath = filepath or args.pop("config_file", DEFAULT_CONFIG_FILE)
+def check_choices(parser: ArgumentParser, args: dict[str, Any]):
+    """Exit with a usage error if an arg isn't one of its choices. argparse
+    only checks the command line, not defaults read from the config file.
+    """
+    for action in parser._actions:
+        value = args.get(action.dest)
+        if action.choices is not None and value not in action.choices:
+            choices = ", ".join(map(str, action.choices))
+            parser.error(f"argument {action.option_strings[0]}: invalid "
+                         f"choice '{value}' (check the config file), "
+                         f"choose from {choices}")
+
+
+def find_config(filepath: str = None):
+    """The config file to read: `filepath` if given, else
+    DEFAULT_CONFIG_FILE, unless only a config.ini in the working directory
+    (from older versions) exists. That one is read, with a warning, until
+    it's moved or rewritten with --write-config."""
+    if filepath:
+        return filepath
+    if os.path.exists(DEFAULT_CONFIG_FILE) \
+            or not os.path.exists(LEGACY_CONFIG_FILE):
+        return DEFAULT_CONFIG_FILE
+    legacy = os.path.abspath(LEGACY_CONFIG_FILE)
+    if legacy not in _warned:
+        _warned.add(legacy)
+        log.warning(f"reading deprecated config file '{legacy}'. Move it \
+                    to {DEFAULT_CONFIG_FILE}, or run once with \
+                    --write-config to copy it there.")
+    return legacy
+
+
+def get_or_write_config(parser: ArgumentParser,
+                        filepath: str = None,
+                        argv: list[str] = None,
+                        is_writable: bool = True):
+    """Parse args with defaults from the config file, if there is one (see
+    find_config). With --write-config (and `is_writable`), save these args
+    to `filepath` or DEFAULT_CONFIG_FILE for later runs. Returns the args
+    as a dict."""
+    read_path = find_config(filepath)
+    filepath = filepath or DEFAULT_CONFIG_FILE
+    argv = sys.argv[1:] if argv is None else argv
 
-    # check for config file and load or generate it
     config = configparser.ConfigParser()
-    if os.path.exists(filepath):
-        # load the config file
-        config.read(filepath)
-        if 'DEFAULT' in config:
-            # override default argparse values with config values
-            defaults = {k: str2bool(v) for k, v in config['DEFAULT'].items()}
-            parser.set_defaults(**defaults)
-    else:
-        # generate the config file with default argparse values
-        args = parser.parse_args()  # this will be the defaults initially
-        config['DEFAULT'] = {k: str(getattr(args, k)) for k in vars(args)}
-        defaults = {k: str2bool(v) for k, v in config['DEFAULT'].items()}
+    if os.path.exists(read_path):
+        # override default argparse values with config values
+        config.read(read_path)
+        defaults = {k: str2bool(v) for k, v in config['DEFAULT'].items()
+                    if k not in NOT_SAVED}
         parser.set_defaults(**defaults)
+    args: dict[str, Any] = vars(parser.parse_args(argv))
+    check_choices(parser, args)
+    if not (is_writable and args.get("write_config")):
+        return args
+
+    # save the args of this run, defaults overridden by its flags
+    config['DEFAULT'] = {k: str(v) for k, v in args.items()
+                         if k not in NOT_SAVED}
+    try:
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
         with open(filepath, 'w') as configfile:
             config.write(configfile)
+    except OSError as e:
+        log.warning(f"couldn't write config file '{filepath}': {e}")
+        return args
+    parser.set_defaults(**{k: str2bool(v)
+                           for k, v in config['DEFAULT'].items()})
+    # as read back from the file on later runs, eg. '%%' unescaped
+    return vars(parser.parse_args(argv))
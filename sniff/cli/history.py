@@ -0,0 +1,148 @@
+import argparse
+import configparser
+import json
+import logging as log
+import re
+import sys
+import time
+from datetime import datetime
+
+import sniff.params as ps
+from sniff.cli import config
+from sniff.history import SOURCES, History
+
+_UNITS_S = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_time(text: str, now_s: float = None):
+    """Unix time from a time ago like '15m', '2h' or '1d', unix seconds, or
+    a local date and time like '2024-02-23 08:00'.
+
+    Raises:
+        argparse.ArgumentTypeError: if it's none of those.
+    """
+    now_s = now_s or time.time()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", text.strip())
+    if match:
+        return now_s - float(match[1]) * _UNITS_S[match[2]]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text.strip()).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"bad time '{text}', eg. '15m', '2h', '1d', 1708650000 or "
+            "'2024-02-23 08:00'")
+
+
+def _configured_path():
+    """--history-path from sniff's config.ini, if it's been written"""
+    parser = configparser.ConfigParser()
+    parser.read(config.find_config())
+    return parser["DEFAULT"].get("history_path", ps.HISTORY_PATH)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog="sniff history",
+        description="query the devices sniff has seen, recorded with \
+            --history. Sightings are printed oldest first.")
+    parser.add_argument(
+        "--mac",
+        type=str,
+        action="append",
+        default=[],
+        help="a MAC, or a prefix of one like an OUI 'AC:23:3F' or \
+            'C3:00:00/20'. Repeat for any of several.")
+    parser.add_argument(
+        "--since",
+        type=parse_time,
+        help="only sightings since, eg. '15m', '2h', '1d', unix seconds \
+            or '2024-02-23 08:00'.")
+    parser.add_argument(
+        "--until",
+        type=parse_time,
+        help="only sightings until, like --since.")
+    parser.add_argument(
+        "--min-rssi",
+        type=int,
+        help="only sightings at least this strong, eg. -70.")
+    parser.add_argument(
+        "--max-rssi",
+        type=int,
+        help="only sightings at most this strong.")
+    parser.add_argument(
+        "--source",
+        type=str,
+        choices=SOURCES,
+        help="only wifi or bluetooth sightings.")
+    parser.add_argument(
+        "--last",
+        action='store_true',
+        help="only the latest sighting of each MAC, eg. when it was last \
+            seen.")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=0,
+        help="print only the newest this many. Default: all")
+    parser.add_argument(
+        "--json",
+        action='store_true',
+        help="print one JSON object per line.")
+    parser.add_argument(
+        "--no-numpy",
+        action='store_true',
+        help="scan with struct even if numpy is installed.")
+    parser.add_argument(
+        "--history-path",
+        type=str,
+        default=_configured_path(),
+        help="Default: '%(default)s' (from config.ini if it's set)")
+    return parser
+
+
+def main(argv: list[str] = None):
+    args = create_parser().parse_args(argv)
+    log.basicConfig(level=log.WARNING,
+                    format="%(levelname)s - %(message)s")
+    history = History(args.history_path, is_read_only=True)
+    try:
+        history.open()
+    except (OSError, ValueError) as e:
+        log.error(f"can't read history: {e}")
+        sys.exit(1)
+    start_s = time.perf_counter()
+    try:
+        sightings = history.query(macs=args.mac, since_s=args.since,
+                                  until_s=args.until,
+                                  min_rssi=args.min_rssi,
+                                  max_rssi=args.max_rssi,
+                                  source=args.source,
+                                  is_numpy=not args.no_numpy)
+    except ValueError as e:
+        log.error(e)
+        sys.exit(2)
+    finally:
+        history.close()
+    elapsed_s = time.perf_counter() - start_s
+
+    if args.last:
+        latest = {s.key: s for s in sightings}
+        sightings = sorted(latest.values(), key=lambda s: s.t_s)
+    if args.limit > 0:
+        sightings = sightings[-args.limit:]
+    for s in sightings:
+        if args.json:
+            print(json.dumps(s.to_dict()))
+        else:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s.t_s))
+            print(f"{when}  {s.source:<4}  {s.rssi:>4}  {s.mac}")
+    print(f"{len(sightings)} of {len(history)} sightings, searched in "
+          f"{round(elapsed_s * 1000, 1)}ms.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
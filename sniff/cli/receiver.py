@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import logging as log
+import signal
+
+import sniff.params as ps
+from sniff.receiver import Receiver, Store
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog="sniff-receiver",
+        description="accept uploads from sniff routers over HTTP and \
+            store them in SQLite.")
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=ps.RECEIVER_HOST,
+        help="address to listen on, eg. 0.0.0.0 for every interface. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=ps.RECEIVER_PORT,
+        help="Default: '%(default)s'")
+    parser.add_argument(
+        "--db-path",
+        type=str,
+        default=ps.RECEIVER_DB_PATH,
+        help="SQLite database to store scans and devices in. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=ps.RECEIVER_MAX_PENDING,
+        help="most requests waiting to be written before new ones get \
+            503. Default: '%(default)s'")
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=ps.RECEIVER_MAX_BATCH,
+        help="most requests written per transaction. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--max-body-bytes",
+        type=int,
+        default=ps.RECEIVER_MAX_BODY_BYTES,
+        help="largest request body, decompressed, before 413. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--retry-after-s",
+        type=int,
+        default=ps.RECEIVER_RETRY_AFTER_S,
+        help="Retry-After to send with 503. Default: '%(default)s'")
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default=ps.LOG_LEVEL,
+        help="Default: '%(default)s'")
+    return parser
+
+
+async def serve(receiver: Receiver):
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, task.cancel)
+    try:
+        await receiver.serve()
+    except asyncio.CancelledError:
+        log.info("stopping...")
+
+
+def main():
+    args = create_parser().parse_args()
+    log.basicConfig(level=args.log_level.upper(),
+                    format="%(asctime)s %(levelname)s - %(message)s")
+    store = Store(args.db_path, args.max_pending, args.max_batch)
+    receiver = Receiver(store, args.host, args.port, args.max_body_bytes,
+                        args.retry_after_s)
+    try:
+        asyncio.run(serve(receiver))
+    finally:
+        store.close()
+        log.info(f"stored: {store.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,36 @@
 import argparse
 import sys
+import time
 import logging as log
-import json
-from subprocess import CalledProcessError
 
-from sniff import sender, logger, reader, ubus
-from sniff.ubus import UbusBLE, UbusWifi, UbusFW, UbusMnf, UbusSystem
+from sniff import cycle, logger, metrics, sender
+from sniff.cache import parse_ttls
+from sniff.columnar import WIRE_FORMATS
+from sniff.filters import NO_MIN_RSSI
+from sniff.lock import OVERLAP_ACTIONS
+from sniff.transport import TRANSPORT_NAMES
+from sniff.ubus import UbusBLE
 import sniff.params as ps
 from sniff.cli import config
 
 
+def _ttls(text: str):
+    """Check comma-separated name=seconds, eg. --api-timeouts-s. Kept
+    as text, like config.ini has it."""
+    try:
+        parse_ttls(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
 def create_parser():
     parser = argparse.ArgumentParser(
         prog="sniff.py",
         description="a CLI tool to scan bluetooth and wifi \
-            signals from `ubus` and send to AWS Lambda.")
+            signals from `ubus` and send to AWS Lambda.",
+        epilog="`sniff history` queries the devices recorded with \
+            --history, see `sniff history -h`.")
     parser.add_argument(
         "--no-wifi",
         action='store_true',
@@ -50,14 +66,15 @@ def create_parser():
         "--sender-config-file",
         type=str,
         default=ps.DATA_SENDER_CONFIG_PATH,
-        help=f"path to Teltonika Data to Server config file.\
-             Default: '{ps.DATA_SENDER_CONFIG_PATH}'")  # noqa
+        help="path to Teltonika Data to Server config file.\
+             Default: '%(default)s'")  # noqa
     parser.add_argument(
         "--api-headers",
         type=str,
         default="",
         help="headers to include in the API call. Comma-separated. \
-            Overrides default from --query-api-headers --sender-config-file.")
+            Overrides default from --query-api-headers --sender-config-file \
+            for every API.")
     parser.add_argument(
         "--api-url",
         type=str,
@@ -68,36 +85,415 @@ def create_parser():
         "--query-api-headers",
         type=str,
         default=ps.DEFAULT_QUERY_API_HEADERS,
-        help=f"DPath query to search Data to Server file specified by \
-            --sender-config-file for HTTP headers. \
+        help="DPath query to search Data to Server file specified by \
+            --sender-config-file for HTTP headers. Each output uses the \
+            headers in its own section if it has any. \
             Error if --api-headers not specified and not found in file.\
-            Default: {ps.DEFAULT_QUERY_API_HEADERS}")
+            Default: %(default)s")
     parser.add_argument(
         "--query-api-url",
         type=str,
         default=ps.DEFAULT_QUERY_API_URL,
-        help=f"DPath query to search Data to Server file specified by \
-            --sender-config-file for an HTTP URL. \
+        help="DPath query to search Data to Server file specified by \
+            --sender-config-file for HTTP URLs. Bodies are uploaded to \
+            every enabled output found, at once. \
             Error if --api-url not specified and not found in file.\
-            Default: {ps.DEFAULT_QUERY_API_URL}")
+            Default: %(default)s")
+    parser.add_argument(
+        "--wifi-radios",
+        type=str,
+        default="",
+        help="comma-separated wifi interfaces to scan at once, \
+            eg. 'wlan0,wlan1'. Default: every radio from \
+            `ubus call iwinfo devices`")
+    for section, what, random in (
+            ("wifi", "wifi", "randomized (locally administered) MACs, like \
+                phones' private addresses"),
+            ("ble", "bluetooth", "random addresses, like phones' and \
+                beacons' rotating ones. blesem doesn't say which addresses \
+                are random, so it goes by the top two bits: public \
+                addresses starting 40-7F or C0-FF (about half of vendor \
+                OUIs) are dropped too, unless they're in \
+                --ble-allow-macs")):
+        parser.add_argument(
+            f"--{section}-allow-macs",
+            type=str,
+            default="",
+            help=f"comma-separated MAC prefixes of {what} devices to keep, \
+                dropping the rest: OUIs like 'AC:23:3F' or any bit \
+                length like 'C3:00:00/20'.")
+        parser.add_argument(
+            f"--{section}-deny-macs",
+            type=str,
+            default="",
+            help=f"comma-separated MAC prefixes of {what} devices to drop.")
+        parser.add_argument(
+            f"--{section}-allow-names",
+            type=str,
+            default="",
+            help=f"comma-separated name patterns of {what} devices to keep, \
+                eg. 'Tile*,iBeacon?', case-insensitive. Devices matching \
+                these or --{section}-allow-macs are kept.")
+        parser.add_argument(
+            f"--{section}-deny-names",
+            type=str,
+            default="",
+            help=f"comma-separated name patterns of {what} devices to \
+                drop, eg. '*TV*'.")
+        parser.add_argument(
+            f"--{section}-min-rssi",
+            type=int,
+            default=NO_MIN_RSSI,
+            help=f"drop {what} devices weaker than this, eg. -85. \
+                Default: '%(default)s' (keep all)")
+        parser.add_argument(
+            f"--{section}-drop-random",
+            action='store_true',
+            help=f"drop {what} devices with {random}.")
     parser.add_argument(
         "--ble-wait-s",
         type=int,
         default=UbusBLE.DEFAULT_BLE_WAIT_S,
-        help=f"seconds to scan bluetooth before \
+        help="seconds to scan bluetooth before \
             retrieving results. Should be more than ~10s. \
-            Default: '{UbusBLE.DEFAULT_BLE_WAIT_S}'")
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--ble-adaptive",
+        action='store_true',
+        help="poll bluetooth results instead of waiting --ble-wait-s, \
+            and stop once no new devices were found for --ble-stable-s.")
+    parser.add_argument(
+        "--ble-poll-s",
+        type=float,
+        default=UbusBLE.DEFAULT_POLL_S,
+        help="seconds between bluetooth result polls with \
+            --ble-adaptive. Default: '%(default)s'")
+    parser.add_argument(
+        "--ble-stable-s",
+        type=float,
+        default=UbusBLE.DEFAULT_STABLE_S,
+        help="with --ble-adaptive, stop scanning bluetooth after this \
+            many seconds without a new device. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--ble-min-wait-s",
+        type=float,
+        default=UbusBLE.DEFAULT_MIN_WAIT_S,
+        help="with --ble-adaptive, scan bluetooth at least this long. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--ble-max-wait-s",
+        type=float,
+        default=UbusBLE.DEFAULT_MAX_WAIT_S,
+        help="with --ble-adaptive, scan bluetooth at most this long. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--collector-timeout-s",
+        type=float,
+        default=ps.COLLECTOR_TIMEOUT_S,
+        help="seconds to wait for each ubus collector (wifi, firmware, \
+            etc.) before giving up on it, plus --ble-wait-s (or \
+            --ble-max-wait-s) for bluetooth. \
+            Collectors run at the same time. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--scans-per-window",
+        type=int,
+        default=1,
+        help="scan wifi and bluetooth this many times, --ble-wait-s \
+            apart, and send one record per device with its count, \
+            first/last seen and min/max/mean RSSI. Fewer if they don't \
+            fit in --cycle-budget-s, and if a scan is cut short the ones \
+            done are sent. Default: '1'")
+    parser.add_argument(
+        "--aggregate-numpy",
+        action='store_true',
+        help="use numpy to aggregate --scans-per-window, faster with \
+            many devices. Needs numpy installed.")
+    parser.add_argument(
+        "--presence",
+        action='store_true',
+        help="send only devices that entered, exited or changed RSSI \
+            since the last scan, under the 'presence' key, instead of the \
+            full 'wifi' and 'ble' lists. Full lists are still sent every \
+            --presence-keyframe-s.")
+    parser.add_argument(
+        "--presence-path",
+        type=str,
+        default=ps.PRESENCE_PATH,
+        help="file to keep presence state in between runs. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--presence-exit-misses",
+        type=int,
+        default=ps.PRESENCE_EXIT_MISSES,
+        help="scans a device must be missing from before it exits. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--presence-rssi-delta",
+        type=int,
+        default=ps.PRESENCE_RSSI_DELTA,
+        help="RSSI change needed to send an update for a device. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--presence-keyframe-s",
+        type=float,
+        default=ps.PRESENCE_KEYFRAME_S,
+        help="seconds between sending full device lists. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--history",
+        action='store_true',
+        help="record every device found in a fixed-size file on the \
+            router, for `sniff history` to query, eg. when a MAC was last \
+            seen during an outage.")
+    parser.add_argument(
+        "--history-path",
+        type=str,
+        default=ps.HISTORY_PATH,
+        help="file to keep the history in. On tmpfs by default, so it \
+            survives runs but not reboots. Default: '%(default)s'")
+    parser.add_argument(
+        "--history-records",
+        type=int,
+        default=ps.HISTORY_RECORDS,
+        help="sightings kept, 16 bytes each, the oldest are overwritten. \
+            Applies when the file is made, delete it to change it. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--no-router-cache",
+        action='store_true',
+        help="disables caching router info (mac, serial, fw, hostname, \
+            timezone) between runs. Queries ubus every run.")
+    parser.add_argument(
+        "--refresh-router-cache",
+        action='store_true',
+        help="ignore cached router info and query it again.")
+    parser.add_argument(
+        "--router-cache-path",
+        type=str,
+        default=ps.ROUTER_CACHE_PATH,
+        help="file to cache router info in. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--router-cache-ttl-s",
+        type=_ttls,
+        default="",
+        help=f"comma-separated seconds to cache each router field, \
+            eg. 'fw=3600,hostname=600'. Fields not listed use their \
+            default: {','.join(f'{k}={v}' for k, v in ps.ROUTER_CACHE_TTLS_S.items())}")  # noqa
+    parser.add_argument(
+        "--api-connect-timeout-s",
+        type=float,
+        default=ps.API_CONNECT_TIMEOUT_S,
+        help="seconds to wait to connect to --api-url. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--api-timeout-s",
+        type=float,
+        default=ps.API_TIMEOUT_S,
+        help="seconds to wait for --api-url to respond. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--api-timeouts-s",
+        type=_ttls,
+        default="",
+        help="comma-separated seconds each API may take to upload per \
+            run, by name (the output's name, or 'api' for --api-url), \
+            eg. 'site_collector=5'. APIs not listed get --api-timeout-s. \
+            A slow API only delays its own uploads.")
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default=ps.API_COMPRESSION,
+        choices=sender.COMPRESSIONS,
+        help="Content-Encoding to compress bodies with. The API must \
+            accept it. Default: '%(default)s'")
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=ps.API_COMPRESS_LEVEL,
+        help="1 (fastest) to 9 (smallest). \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--compress-min-bytes",
+        type=int,
+        default=ps.API_COMPRESS_MIN_BYTES,
+        help="send bodies smaller than this uncompressed. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--no-stream",
+        action='store_true',
+        help="decode whole bluetooth results before parsing them, and \
+            encode whole bodies before uploading them with a \
+            Content-Length, instead of a piece at a time with chunked \
+            transfer encoding. Uses more memory with many devices.")
+    parser.add_argument(
+        "--wire-format",
+        type=str,
+        default=WIRE_FORMATS[0],
+        choices=WIRE_FORMATS,
+        help="'columnar' sends device lists as packed columns (MACs, \
+            RSSIs) and a table of host names, several times smaller than \
+            'rows' of one object per device. The API must decode it, eg. \
+            with sniff.columnar.decode. Default: '%(default)s'")
+    parser.add_argument(
+        "--no-outbox",
+        action='store_true',
+        help="disables queueing bodies on disk. A body that fails to \
+            upload is lost instead of retried on the next run.")
+    parser.add_argument(
+        "--outbox-path",
+        type=str,
+        default=ps.OUTBOX_PATH,
+        help="directory to queue bodies in until they're uploaded. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--outbox-max-items",
+        type=int,
+        default=ps.OUTBOX_MAX_ITEMS,
+        help="most bodies to keep queued, oldest are dropped first. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--outbox-max-bytes",
+        type=int,
+        default=ps.OUTBOX_MAX_BYTES,
+        help="most bytes of bodies to keep queued, oldest are dropped \
+            first. Default: '%(default)s'")
+    parser.add_argument(
+        "--outbox-batch-size",
+        type=int,
+        default=ps.OUTBOX_BATCH_SIZE,
+        help="most queued bodies to upload per request. More than 1 \
+            sends a JSON list of bodies, only for APIs that accept one \
+            (eg. sniff-receiver). Default: '%(default)s'")
+    parser.add_argument(
+        "--body-id",
+        action='store_true',
+        help="add a unique \"id\" to each body, the same for every API \
+            and every retry, so the API can drop duplicates of outbox \
+            retries (sniff-receiver does). Off by default, since it's a \
+            field APIs with a strict schema may reject.")
+    parser.add_argument(
+        "--no-metrics",
+        action='store_true',
+        help="disables recording timings, sizes and errors of each step \
+            to --metrics-path.")
+    parser.add_argument(
+        "--metrics-path",
+        type=str,
+        default=ps.METRICS_PATH,
+        help="Prometheus textfile to write metrics to, eg. for \
+            node_exporter's textfile collector. Default: '%(default)s'")
+    parser.add_argument(
+        "--metrics-in-body",
+        action='store_true',
+        help="also send this cycle's metrics to the API, under the \
+            'metrics' key. Upload metrics are from the previous upload.")
+    parser.add_argument(
+        "--ubus-transport",
+        type=str,
+        default=ps.UBUS_TRANSPORT,
+        choices=TRANSPORT_NAMES,
+        help="how to call ubus: 'socket' talks to ubusd directly over \
+            --ubus-socket, 'subprocess' runs the `ubus` command, 'auto' \
+            uses socket if it exists. Default: '%(default)s'")
+    parser.add_argument(
+        "--ubus-socket",
+        type=str,
+        default="",
+        help=f"path to the ubusd unix socket. \
+            Default: first existing of {', '.join(ps.UBUS_SOCKET_PATHS)}")
+    parser.add_argument(
+        "--cycle-budget-s",
+        type=float,
+        default=ps.CYCLE_BUDGET_S,
+        help=f"most seconds a scan and upload may take. Collectors and \
+            the upload keep their own timeouts but are cut short to fit, \
+            keeping {ps.UPLOAD_RESERVE_S}s for the upload, and queued \
+            bodies that don't fit wait for the next run. A cron run still \
+            going {ps.CYCLE_GRACE_S}s later exits. 0 for no limit. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--on-overlap",
+        choices=OVERLAP_ACTIONS,
+        default=OVERLAP_ACTIONS[0],
+        help="what to do when another sniff is still running: 'skip' this \
+            run, or 'preempt' (stop) the other one. Default: '%(default)s'")
+    parser.add_argument(
+        "--lock-path",
+        type=str,
+        default=ps.LOCK_PATH,
+        help="file locked by the running sniff, with its PID. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--daemon",
+        action='store_true',
+        help="run forever, scanning and sending every --interval-s \
+            instead of once. Config is reloaded when its file changes.")
+    parser.add_argument(
+        "--interval-s",
+        type=float,
+        default=ps.DAEMON_INTERVAL_S,
+        help="seconds between scans in --daemon mode. \
+            Can be less than a minute. Default: '%(default)s'")
+    parser.add_argument(
+        "--adaptive-schedule",
+        action='store_true',
+        help="scan less often and wait less for bluetooth while the same \
+            devices are around, and go back to --schedule-min-interval-s \
+            and --ble-wait-s when they change. Runs from cron exit early \
+            until the next scan is due.")
+    parser.add_argument(
+        "--schedule-min-interval-s",
+        type=float,
+        default=ps.SCHEDULE_MIN_INTERVAL_S,
+        help="shortest interval between scans, when devices come and go. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--schedule-max-interval-s",
+        type=float,
+        default=ps.SCHEDULE_MAX_INTERVAL_S,
+        help="longest interval between scans, when nothing changes. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--schedule-min-ble-wait-s",
+        type=float,
+        default=ps.SCHEDULE_MIN_BLE_WAIT_S,
+        help="shortest bluetooth wait, when nothing changes. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--schedule-churn",
+        type=float,
+        default=ps.SCHEDULE_CHURN_THRESHOLD,
+        help="share of devices (0-1) that came or went since the last scan \
+            to scan as often as possible again. Below half of it, scans \
+            slow down. Default: '%(default)s'")
+    parser.add_argument(
+        "--schedule-growth",
+        type=float,
+        default=ps.SCHEDULE_GROWTH,
+        help="factor to lengthen the interval (and shorten the bluetooth \
+            wait) by after each quiet scan. Default: '%(default)s'")
+    parser.add_argument(
+        "--schedule-path",
+        type=str,
+        default=ps.SCHEDULE_PATH,
+        help="file to keep the schedule in between runs. \
+            Default: '%(default)s'")
     parser.add_argument(
         "--is-log-to-console",
         default=ps.IS_LOG_TO_CONSOLE,
         action='store_true',
-        help=f"whether to print logs to terminal.\
-            Default: '{ps.IS_LOG_TO_CONSOLE}'")
+        help="whether to print logs to terminal.\
+            Default: '%(default)s'")
     parser.add_argument(
         "--log-path",
         type=str,
         default=ps.LOG_PATH,
-        help=f"filepath to write logs to. Default: '{ps.LOG_PATH}'")
+        help=f"filepath to write logs to. Default: \
+            '/tmp/log/{ps.LOG_FILE}' (tmpfs, not flash), or \
+            '/var/log/{ps.LOG_FILE}' if /tmp/log isn't writable.")
     parser.add_argument(
         "--log-level",
         type=str,
@@ -109,97 +505,100 @@ def create_parser():
         type=str,
         default=ps.LOG_FORMAT.replace('%', '%%'),
         help=f"how to format log lines. see: https://docs.python.org/3/library/logging.html#logrecord-attributes. Default: '{ps.LOG_FORMAT.replace('%', '%%')}'")  # noqa
+    parser.add_argument(
+        "--log-json",
+        action="store_true",
+        help="write the log file as JSON lines (time, level, message, \
+            function, file, line) instead of --log-format.")
+    parser.add_argument(
+        "--log-max-bytes",
+        type=int,
+        default=ps.LOG_MAX_BYTES,
+        help="rotate the log file when it reaches this size. \
+            Default: '%(default)s'")
+    parser.add_argument(
+        "--log-backups",
+        type=int,
+        default=ps.LOG_BACKUPS,
+        help="rotated log files to keep. Default: '%(default)s'")
+    parser.add_argument(
+        "--log-buffer",
+        type=int,
+        default=ps.LOG_BUFFER_RECORDS,
+        help=f"log lines to hold in memory before writing them to the \
+            log file. They're written at once on a warning or error, \
+            after {ps.LOG_FLUSH_S}s, or at exit. 0 to write each line \
+            as it's logged. Default: '%(default)s'")
+    parser.add_argument(
+        "--write-config",
+        action='store_true',
+        help=f"save the args of this run to {ps.CONFIG_PATH}, which \
+            later runs (and `sniff history`) take their defaults from. \
+            Nothing is saved without it.")
     return parser
 
 
 def main():
+    if sys.argv[1:2] == ["history"]:
+        from sniff.cli import history
+        return history.main(sys.argv[2:])
+
     parser = create_parser()
-    config.get_or_write_config(parser)
-    args = vars(parser.parse_args(sys.argv[1:]))
+    args = config.get_or_write_config(parser)
 
     logger.init_logger(**args)
     log.debug("init'd logger.")
-    log.debug(f"args: {json.dumps(args, indent=4)}")
-    log.debug(f"""args.get("api_url")={args.get("api_url")}""")
-
-    if not args.get("api_url") or not args.get("api_headers"):
-        dsr = reader.DataSenderReader(args.get("sender_config_file"))
-        dsr.parse()
+    log.debug("args: %s", logger.LazyJSON(args))
 
-    # exit error if no API in sender config, unless api-url specified
-    if not args.get("api_url"):
-        query = args.get("query_api_url")
-        args["api_url"] = dsr.search(query)
-        if not args["api_url"]:
-            log.error(f"specify --api-url \
-                      or fix --query-api-url={query}")
+    lock = cycle.make_lock(args)
+    if args.get("daemon"):
+        from sniff.daemon import Daemon
+        if not lock.acquire():
+            return
+        try:
+            Daemon(parser).run()
+        except (ValueError, OSError) as e:
+            log.error(f"can't start the daemon: {e}")
             sys.exit(1)
-    # exit error if no headers in sender config, unless api-headers specified
-    if not args.get("api_headers"):
-        query = args.get("query_api_headers")
-        args["api_headers"] = dsr.search(query)[0]
-        if not args["api_headers"]:
-            log.error(f"specify --api-header \
-                      or fix --query-api-headers={query}")
-            sys.exit(1)
-
-    # make API URL and headers
-    api_url = args["api_url"]
-    api_headers = args["api_headers"].split(",")
-    api_headers = {h.split(":")[0]: h.split(":")[1] for h in api_headers}
-    log.debug(f"using API URL: {api_url}")
-    log.debug(f"using API headers: {json.dumps(api_headers, indent=4)}")
-
-    # exit error if ubus is not found (we probably aren't on OpenWRT)
-    try:
-        ubus.Ubus().run_cmd(ubus.Ubus.DEFAULT_RESULT_CMD)
-    except CalledProcessError as e:
-        if ubus._NO_UBUS_EXC in str(e):
-            log.error(ubus._REPLACE_EXC)
-            exit(1)
-
-    ble = UbusBLE(wait_s=args["ble_wait_s"])
-    wifi = UbusWifi(**args)
-
-    # start scanning in the background (must wait ~10s before retrieving)
-    if not args.get("no_ble"):
-        ble.scan()
-
-    # do other stuff while we wait
-    mnf = UbusMnf()
-    fw = UbusFW()
-    system = UbusSystem()
+        return
 
-    router = {} if args["no_mnf"] else mnf.mac_serial()
-    router.update({
-        "fw": "unknown" if args["no_fw"] else fw.fw(),
-        "hostname": "unknown" if args["no_system"] else system.hostname(),
-        "timezone": "unknown" if args["no_timezone"] else sender.get_timezone()
-    })
-    log.debug(f"got router info: {json.dumps(router, indent=4)}")
+    scheduler = cycle.make_scheduler(args)
+    if scheduler is not None and not scheduler.is_due():
+        log.info(f"scan not due yet, next one in \
+                 {round(scheduler.next_s - time.time())}s.")
+        return
+    if not lock.acquire():
+        return
 
-    # scan and return wifi within a few seconds
-    wifi_devices = [] if args["no_wifi"] else wifi.filtered(wifi.results())
-    ble_devices = [] if args["no_ble"] else ble.filtered(ble.results())
-
-    body = {
-        "scan": {
-            "ble_start_s": int(ble.end_s - ble.elapsed_s),
-            "ble_end_s": int(ble.end_s),
-            "wifi_start_s": int(wifi.end_s - wifi.elapsed_s),
-            "wifi_end_s": int(wifi.end_s),
-        },
-        "router": router,
-        "wifi": wifi_devices,
-        "ble": ble_devices,
-    }
-    log.debug(f"sending body: {json.dumps(body, indent=4)}")
+    deadline = cycle.make_deadline(args)
+    deadline.start_watchdog()
+    with deadline.step("setup"):
+        try:
+            targets = cycle.make_targets(args)
+        except (ValueError, OSError) as e:
+            log.error(f"can't set up uploads: {e}")
+            sys.exit(1)
 
-    # Call sender.post_data()
-    error, result = sender.post_data(
-        url=args["api_url"],
-        headers=api_headers,
-        data=body)
+        cycle.check_ubus(args)
+        cycle.make_metrics(args)
+        try:
+            collectors = cycle.make_collectors(args)
+        except ValueError:
+            sys.exit(1)
+    with metrics.timer("sniff_cycle_seconds"):
+        with deadline.step("scan"):
+            body = cycle.scan(args, collectors,
+                              cache=cycle.make_cache(args),
+                              presence=cycle.make_presence(args),
+                              scheduler=scheduler,
+                              deadline=deadline,
+                              history=cycle.make_history(args))
+        with deadline.step("upload"):
+            cycle.send(body, targets, deadline=deadline)
+    metrics.save()
+    deadline.log_steps()
+    # the watchdog stays armed: collectors that timed out still hold the
+    # process open until they finish
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import logging as log
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Union
+
+
+class Collected():
+    """The result of one collector and when it ran."""
+
+    def __init__(self, name: str, default: Any = None):
+        self.name = name
+        self.value = default
+        self.error: Exception = None
+        self.timed_out = False
+        self.is_busy = False  # skipped, still running from a previous call
+        self.start_s = 0.0
+        self.end_s = 0.0
+
+    @property
+    def elapsed_s(self):
+        return self.end_s - self.start_s
+
+    @property
+    def ok(self):
+        return self.error is None and not self.timed_out \
+            and not self.is_busy
+
+
+def _run(fn: Callable[[], Any]):
+    start_s = time.time()
+    try:
+        value, error = fn(), None
+    except Exception as e:
+        value, error = None, e
+    return start_s, time.time(), value, error
+
+
+def collect(collectors: dict[str, Callable[[], Any]],
+            timeout_s: Union[float, dict[str, float]],
+            defaults: dict[str, Any] = None,
+            running: dict[str, Future] = None):
+    """Run every collector at once in a thread pool and wait for them all,
+    giving up on each one after its own timeout.
+
+    A collector that fails or times out gets its value from `defaults`.
+    Total time is that of the slowest collector instead of the sum.
+
+    A collector that times out keeps running in its thread. With
+    `running` (the same dict on every call), those are kept in it by name
+    and skipped on later calls until they finish, so a stuck one never
+    runs twice at once on the same Ubus object.
+
+    Example:
+        >>> from sniff.collect import collect
+        >>> c = collect({"fw": fw.fw, "hostname": system.hostname},
+        ...             timeout_s=5, defaults={"fw": "unknown"})
+        >>> c["fw"].value, round(c["fw"].elapsed_s, 1)
+        ('RUTX_R_00.07.06.5', 0.1)
+    """
+    defaults = defaults or {}
+    results = {n: Collected(n, defaults.get(n)) for n in collectors}
+    if running is not None:
+        for name, future in list(running.items()):
+            if future.done():
+                del running[name]
+        for name in [n for n in collectors if n in running]:
+            results[name].is_busy = True
+            log.warning(f"collector '{name}' is still running from a \
+                        previous cycle, skipping it.")
+        collectors = {n: fn for n, fn in collectors.items()
+                      if n not in running}
+    if not collectors:
+        return results
+    if not isinstance(timeout_s, dict):
+        timeout_s = {n: timeout_s for n in collectors}
+
+    pool = ThreadPoolExecutor(max_workers=len(collectors),
+                              thread_name_prefix="collect")
+    submit_s = time.time()
+    futures = {n: pool.submit(_run, fn) for n, fn in collectors.items()}
+    # wait on the soonest deadline first so each gets its full timeout
+    for name in sorted(futures, key=lambda n: timeout_s[n]):
+        c = results[name]
+        remaining_s = submit_s + timeout_s[name] - time.time()
+        try:
+            c.start_s, c.end_s, value, c.error = \
+                futures[name].result(timeout=max(0, remaining_s))
+        except TimeoutError:
+            c.timed_out = True
+            c.start_s, c.end_s = submit_s, time.time()
+            log.error(f"collector '{name}' timed out after \
+                      {round(timeout_s[name], 1)}s.")
+            if running is not None:
+                running[name] = futures[name]
+            continue
+        if c.error is not None:
+            log.error(f"collector '{name}' failed: {c.error}")
+        else:
+            c.value = value
+        log.debug("collected '%s' in %.2fs.", name, c.elapsed_s)
+    # don't wait on collectors that timed out
+    pool.shutdown(wait=False, cancel_futures=True)
+    return results
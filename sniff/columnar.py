@@ -0,0 +1,179 @@
+"""A compact, columnar encoding of the device lists in an upload body.
+
+Instead of one object per device, repeating "rssi", "host" and "mac", each
+section is a set of columns: MACs packed into 6 bytes each, RSSI (and wifi
+quality, in percent) packed into one signed byte each, both base64, and
+host names as indexes into one string table for the whole body. Bodies
+say they're columnar with "format" and "format_version"; everything else
+in them (scan, router, presence, metrics) is unchanged.
+
+decode() turns a columnar body back into the usual one, with a list of
+device dicts per section. sniff-receiver uses it, and it's the reference
+for other backends.
+
+Example:
+    >>> from sniff import columnar
+    >>> from sniff.device import Device, mac_to_int
+    >>> body = {"ble": [Device(mac_to_int("6C:FC:DE:B0:EE:16"), -61)]}
+    >>> columnar.encode(body)
+    {'ble': {'n': 1, 'mac': 'bPzesO4W', 'rssi': 'ww==', 'host': [0]},
+     'strings': [''], 'format': 'columnar', 'format_version': 1}
+    >>> columnar.decode(columnar.encode(body))
+    {'ble': [{'rssi': -61, 'host': '', 'mac': '6C:FC:DE:B0:EE:16'}]}
+"""
+import base64
+import binascii
+from array import array
+from typing import Any, Iterable
+
+from sniff.device import Device, DeviceStats, int_to_mac
+
+FORMAT = "columnar"
+VERSION = 1
+WIRE_FORMATS = ("rows", FORMAT)
+SECTIONS = ("wifi", "ble")
+MAC_BYTES = 6
+NO_QUALITY = -1  # in the quality column, for wifi devices without one
+# DeviceStats columns: packed int8s, and plain JSON lists
+STATS_INT8 = ("rssi_min", "rssi_max")
+STATS_LISTS = ("count", "first_s", "last_s", "rssi_mean")
+
+
+def _b64(data: bytes):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _int8s(values: Iterable[int]):
+    return _b64(array("b", [-128 if v < -128 else 127 if v > 127 else v
+                            for v in values]).tobytes())
+
+
+def _unpack_int8s(text: str, n: int):
+    values = array("b", base64.b64decode(text, validate=True))
+    if len(values) != n:
+        raise ValueError(f"expected {n} values, got {len(values)}")
+    return values
+
+
+class _Strings():
+    """A string table: each distinct string once, referred to by index"""
+
+    def __init__(self):
+        self.strings: list[str] = [""]
+        self.index: dict[str, int] = {"": 0}
+
+    def add(self, s: str):
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+def _encode_section(devices: list[Device], strings: _Strings):
+    add = strings.add
+    section: dict[str, Any] = {
+        "n": len(devices),
+        "mac": _b64(b"".join([d.key.to_bytes(MAC_BYTES, "big")
+                              for d in devices])),
+        "rssi": _int8s([d.rssi for d in devices]),
+        "host": [add(d.host or "") for d in devices],
+    }
+    if any(d.quality is not None for d in devices):
+        section["quality"] = _int8s(
+            [NO_QUALITY if d.quality is None else round(100 * d.quality)
+             for d in devices])
+    if any(d.channels is not None for d in devices):
+        section["channels"] = [None if d.channels is None
+                               else list(d.channels) for d in devices]
+        section["bands"] = [None if d.channels is None
+                            else [add(b) for b in d.bands or ()]
+                            for d in devices]
+    if devices and all(isinstance(d, DeviceStats) for d in devices):
+        for name in STATS_INT8:
+            section[name] = _int8s([getattr(d, name) for d in devices])
+        for name in STATS_LISTS:
+            section[name] = [getattr(d, name) for d in devices]
+    return section
+
+
+def encode(body: dict[str, Any]):
+    """The body with its device lists (of Devices) as columns. Returns a
+    new dict, `body` isn't changed."""
+    strings = _Strings()
+    encoded = dict(body)
+    for name in SECTIONS:
+        devices = body.get(name)
+        if isinstance(devices, list):
+            encoded[name] = _encode_section(devices, strings)
+    encoded["strings"] = strings.strings
+    encoded["format"] = FORMAT
+    encoded["format_version"] = VERSION
+    return encoded
+
+
+def is_columnar(body: dict[str, Any]):
+    return body.get("format") == FORMAT
+
+
+def _decode_section(section: dict[str, Any], strings: list[str]):
+    n = section["n"]
+    macs = base64.b64decode(section["mac"], validate=True)
+    if len(macs) != n * MAC_BYTES:
+        raise ValueError(f"expected {n} MACs, got {len(macs)} bytes")
+    rssis = _unpack_int8s(section["rssi"], n)
+    hosts = section["host"]
+    qualities = _unpack_int8s(section["quality"], n) \
+        if "quality" in section else None
+    channels = section.get("channels")
+    bands = section.get("bands")
+    stats = {name: _unpack_int8s(section[name], n) for name in STATS_INT8
+             if name in section}
+    stats.update({name: section[name] for name in STATS_LISTS
+                  if name in section})
+    if any(len(c) != n for c in (hosts, channels or hosts, bands or hosts,
+                                 *stats.values())):
+        raise ValueError(f"columns of different lengths, expected {n}")
+
+    devices = []
+    for i in range(n):
+        d = {}
+        if qualities is not None and qualities[i] != NO_QUALITY:
+            d["quality"] = qualities[i] / 100
+        d["rssi"] = rssis[i]
+        d["host"] = strings[hosts[i]]
+        d["mac"] = int_to_mac(int.from_bytes(
+            macs[i * MAC_BYTES:(i + 1) * MAC_BYTES], "big"))
+        if channels is not None and channels[i] is not None:
+            d["channels"] = channels[i]
+            d["bands"] = [strings[b] for b in bands[i]]
+        for name, values in stats.items():
+            d[name] = values[i]
+        devices.append(d)
+    return devices
+
+
+def decode(body: dict[str, Any]):
+    """A columnar body as the usual one, with a list of device dicts per
+    section (like Device.to_dict()). Other bodies are returned as they are.
+
+    Raises:
+        ValueError: if it's a columnar body this can't decode.
+    """
+    if not is_columnar(body):
+        return body
+    version = body.get("format_version")
+    if version != VERSION:
+        raise ValueError(f"unsupported {FORMAT} format version {version}")
+    decoded = {k: v for k, v in body.items()
+               if k not in ("format", "format_version", "strings")}
+    strings = body.get("strings") or [""]
+    for name in SECTIONS:
+        section = body.get(name)
+        if not isinstance(section, dict):
+            continue
+        try:
+            decoded[name] = _decode_section(section, strings)
+        except (KeyError, IndexError, TypeError, binascii.Error) as e:
+            raise ValueError(f"bad {FORMAT} '{name}' section: {e!r}")
+    return decoded
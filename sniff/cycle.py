@@ -0,0 +1,511 @@
+import logging as log
+import os
+import time
+import uuid
+from concurrent.futures import Future
+from subprocess import CalledProcessError
+from typing import Any
+
+import sniff.params as ps
+from sniff import columnar, metrics, sender, reader, ubus
+from sniff.aggregate import aggregate, windowed
+from sniff.cache import RouterCache, parse_ttls
+from sniff.collect import Collected, collect
+from sniff.deadline import Deadline
+from sniff.filters import DeviceFilter
+from sniff.history import History
+from sniff.lock import RunLock
+from sniff.logger import LazyJSON
+from sniff.outbox import Outbox
+from sniff.presence import PresenceTracker
+from sniff.schedule import ChurnScheduler
+from sniff.target import Target, parse_headers, send_all, slug
+from sniff.transport import SocketTransport, Transport, get_transport
+from sniff.ubus import UbusBLE, UbusWifi, UbusFW, UbusMnf, UbusSystem
+
+# router fields when a collector fails or times out
+ROUTER_DEFAULTS = {
+    "mnf": {"serial": "unknown", "mac": "unknown"},
+    "fw": "unknown",
+    "hostname": "unknown",
+    "timezone": "",
+}
+# metrics each step starts over, for the summary in the body
+SCAN_METRICS = ("sniff_ubus", "sniff_parse", "sniff_collector",
+                "sniff_devices", "sniff_churn", "sniff_schedule")
+UPLOAD_METRICS = ("sniff_encode", "sniff_http", "sniff_upload",
+                  "sniff_target")
+
+
+def _output_apis(dsr: reader.DataSenderReader, args: dict[str, Any]):
+    """(name, url, headers) of each enabled output in the Data to Server
+    config with a URL for --query-api-url, in file order. Names are the
+    outputs' names, made safe for file names. Headers are the
+    --query-api-headers option of the same output, or the last one found
+    anywhere."""
+    query = args.get("query_api_url")
+    header_key = args.get("query_api_headers").rstrip("/").split("/")[-1]
+    apis, urls, names = [], set(), set()
+    for path, url in dsr.search_all(query):
+        section = path.split("/")[0]
+        options = dsr.config.get(section, {})
+        if not url or url in urls or options.get("enabled") == "0":
+            continue
+        urls.add(url)
+        name = slug(options.get("name") or options.get("__name__")
+                    or section)
+        while name in names:
+            name = f"{name}_"
+        names.add(name)
+        headers = args.get("api_headers") \
+            or options.get(header_key) \
+            or dsr.search(args.get("query_api_headers"))
+        apis.append((name, url, headers))
+    return apis
+
+
+def get_apis(args: dict[str, Any]):
+    """Resolve the APIs to upload to as [(name, url, headers)]: --api-url,
+    or else every enabled HTTP output in the Teltonika Data to Server
+    config file, each with its own headers unless --api-headers is given.
+
+    Raises:
+        ValueError: if no URL or headers were given or found.
+    """
+    if args.get("api_url"):
+        headers = args.get("api_headers")
+        if not headers:
+            dsr = reader.DataSenderReader(args.get("sender_config_file"))
+            headers = dsr.search(args.get("query_api_headers"))
+        apis = [("api", args["api_url"], headers)]
+    else:
+        dsr = reader.DataSenderReader(args.get("sender_config_file"))
+        dsr.parse()
+        apis = _output_apis(dsr, args)
+        # error if no API in sender config, unless api-url specified
+        if not apis:
+            query = args.get("query_api_url")
+            log.error(f"specify --api-url \
+                      or fix --query-api-url={query}")
+            raise ValueError(f"no API URL for query '{query}'")
+
+    # error if no headers in sender config, unless api-headers specified
+    resolved = []
+    for name, url, headers in apis:
+        headers = parse_headers(headers or "")
+        if not headers:
+            query = args.get("query_api_headers")
+            log.error(f"specify --api-header \
+                      or fix --query-api-headers={query}")
+            raise ValueError(f"no API headers for query '{query}'")
+        log.debug("using API '%s': %s %s", name, url, LazyJSON(headers))
+        resolved.append((name, url, headers))
+    return resolved
+
+
+def check_ubus(args: dict[str, Any]):
+    """exit error if ubus is not found (we probably aren't on OpenWRT)"""
+    transport = get_transport(args["ubus_transport"], args["ubus_socket"])
+    if isinstance(transport, SocketTransport):
+        return  # talks to ubusd directly, doesn't need the `ubus` CLI
+    try:
+        ubus.Ubus().run_cmd(ubus.Ubus.DEFAULT_RESULT_CMD)
+    except CalledProcessError as e:
+        if ubus._NO_UBUS_EXC in str(e):
+            log.error(ubus._REPLACE_EXC)
+            exit(1)
+
+
+def _split(value: Any):
+    """'a, b,,c' -> ['a', 'b', 'c']"""
+    return [v.strip() for v in str(value or "").split(",") if v.strip()]
+
+
+def make_filter(args: dict[str, Any], section: str):
+    """The DeviceFilter for `section` (wifi or ble), or None to keep every
+    device.
+
+    Raises:
+        ValueError: if a MAC prefix is invalid.
+    """
+    try:
+        device_filter = DeviceFilter(
+            allow_macs=_split(args[f"{section}_allow_macs"]),
+            deny_macs=_split(args[f"{section}_deny_macs"]),
+            allow_names=_split(args[f"{section}_allow_names"]),
+            deny_names=_split(args[f"{section}_deny_names"]),
+            min_rssi=args[f"{section}_min_rssi"],
+            drop_random=args[f"{section}_drop_random"],
+            is_ble=section == "ble")
+    except ValueError as e:
+        log.error(f"fix --{section}-allow-macs or --{section}-deny-macs: \
+                  {e}")
+        raise
+    return device_filter or None
+
+
+def make_collectors(args: dict[str, Any], transport: Transport = None):
+    """Create the Ubus objects used by a cycle. Reusable across cycles.
+
+    Raises:
+        ValueError: if a device filter is invalid.
+    """
+    kwargs = {
+        "transport": transport or get_transport(args["ubus_transport"],
+                                                args["ubus_socket"]),
+        "timeout_s": args["collector_timeout_s"],
+        "is_streaming": not args["no_stream"],
+    }
+    return {
+        "ble": UbusBLE(wait_s=args["ble_wait_s"],
+                       is_adaptive=args["ble_adaptive"],
+                       poll_s=args["ble_poll_s"],
+                       stable_s=args["ble_stable_s"],
+                       min_wait_s=args["ble_min_wait_s"],
+                       max_wait_s=args["ble_max_wait_s"],
+                       device_filter=make_filter(args, "ble"),
+                       **kwargs),
+        "wifi": UbusWifi(radios=_split(args["wifi_radios"]),
+                         device_filter=make_filter(args, "wifi"),
+                         **kwargs),
+        "mnf": UbusMnf(**kwargs),
+        "fw": UbusFW(**kwargs),
+        "system": UbusSystem(**kwargs),
+    }
+
+
+def make_cache(args: dict[str, Any]):
+    """Router identity cache on disk, or only in memory if disabled."""
+    cache = RouterCache(
+        path=None if args["no_router_cache"] else args["router_cache_path"],
+        ttls_s=parse_ttls(args["router_cache_ttl_s"]))
+    if args["refresh_router_cache"]:
+        log.info("refreshing router cache.")
+        cache.clear()
+    return cache
+
+
+def make_presence(args: dict[str, Any], is_in_memory=False):
+    """Presence tracker if enabled. In memory only for long-running use."""
+    if not args["presence"]:
+        return None
+    return PresenceTracker(
+        path=None if is_in_memory else args["presence_path"],
+        exit_after_misses=args["presence_exit_misses"],
+        rssi_delta=args["presence_rssi_delta"],
+        keyframe_s=args["presence_keyframe_s"])
+
+
+def make_scheduler(args: dict[str, Any], is_in_memory=False):
+    """Churn-adaptive scheduler if enabled. In memory only for long-running
+    use."""
+    if not args["adaptive_schedule"]:
+        return None
+    return ChurnScheduler(
+        path=None if is_in_memory else args["schedule_path"],
+        min_interval_s=args["schedule_min_interval_s"],
+        max_interval_s=args["schedule_max_interval_s"],
+        min_ble_wait_s=args["schedule_min_ble_wait_s"],
+        max_ble_wait_s=args["ble_wait_s"],
+        threshold=args["schedule_churn"],
+        growth=args["schedule_growth"])
+
+
+def make_history(args: dict[str, Any]):
+    """Sighting history on disk if enabled, None if disabled or it can't
+    be opened."""
+    if not args["history"]:
+        return None
+    try:
+        return History(args["history_path"], args["history_records"]).open()
+    except (OSError, ValueError) as e:
+        log.warning(f"couldn't open history '{args['history_path']}': {e}")
+        return None
+
+
+def make_metrics(args: dict[str, Any]):
+    """Record metrics to --metrics-path unless disabled."""
+    if args["no_metrics"]:
+        metrics.disable()
+        return None
+    return metrics.configure(args["metrics_path"])
+
+
+def router_collectors(args: dict[str, Any],
+                      collectors: dict[str, ubus.Ubus]):
+    """Collectors for the enabled router identity fields"""
+    tasks = {}
+    if not args["no_mnf"]:
+        tasks["mnf"] = collectors["mnf"].mac_serial
+    if not args["no_fw"]:
+        tasks["fw"] = collectors["fw"].fw
+    if not args["no_system"]:
+        tasks["hostname"] = collectors["system"].hostname
+    if not args["no_timezone"]:
+        tasks["timezone"] = sender.get_timezone
+    return tasks
+
+
+def _from_cache(cache: RouterCache, tasks: dict[str, Any]):
+    """Pop cached router fields out of tasks, as if they were collected."""
+    cached = {}
+    for name in list(tasks) if cache else []:
+        value = cache.get(name)
+        if value is not None:
+            cached[name] = Collected(name, value)
+            del tasks[name]
+    if cached:
+        log.debug("using cached router info: %s", list(cached))
+    return cached
+
+
+def _to_cache(cache: RouterCache, collected: dict[str, Collected]):
+    for name, c in collected.items() if cache else []:
+        if name in ROUTER_DEFAULTS and c.ok \
+                and c.value != ROUTER_DEFAULTS[name]:
+            cache.set(name, c.value)
+    if cache:
+        cache.save()
+
+
+def _router(collected: dict[str, Collected]):
+    router = dict(collected["mnf"].value) if "mnf" in collected else {}
+    for key in ("fw", "hostname", "timezone"):
+        router[key] = collected[key].value if key in collected \
+            else "unknown"
+    log.debug("got router info: %s", LazyJSON(router))
+    return router
+
+
+def _fit_rounds(rounds: int, ble: UbusBLE, deadline: Deadline = None):
+    """--scans-per-window, or as many as fit in what's left of the cycle
+    budget: the last one starts (rounds - 1) * wait_s in and can take up
+    to max_scan_s."""
+    rounds = max(1, rounds)
+    left_s = None if deadline is None \
+        else deadline.clip(None, ps.UPLOAD_RESERVE_S)
+    if rounds == 1 or left_s is None or ble.wait_s <= 0:
+        return rounds
+    fit = max(1, int((left_s - ble.max_scan_s) // ble.wait_s) + 1)
+    if fit < rounds:
+        log.warning(f"only {fit} of --scans-per-window {rounds} fit in \
+                    the --cycle-budget-s, scanning {fit} times.")
+    return min(rounds, fit)
+
+
+def scan(args: dict[str, Any],
+         collectors: dict[str, ubus.Ubus],
+         router: dict[str, Any] = None,
+         cache: RouterCache = None,
+         presence: PresenceTracker = None,
+         scheduler: ChurnScheduler = None,
+         deadline: Deadline = None,
+         history: History = None,
+         running: dict[str, Future] = None):
+    """Scan wifi and bluetooth and return the body to send to the API.
+
+    All enabled collectors run at once: router info (unless `router` is
+    given or cached) and wifi are collected while bluetooth scans.
+    With `presence`, device lists are replaced by enter/update/exit events
+    except on keyframes. With `scheduler`, bluetooth waits as long as it
+    says and the devices found set the next interval. With `deadline`,
+    collectors are cut short to leave time for the upload, and the ones
+    that time out are sent empty. With `history`, every device found is
+    recorded in it. With `running`, collectors still running after timing
+    out in an earlier scan are skipped (see sniff.collect.collect).
+
+    Devices stay Device objects in the body, sniff.stream encodes them as
+    they're sent instead of copying them all into dicts first. With
+    `--wire-format columnar`, device lists are sent as columns instead.
+    """
+    ble: UbusBLE = collectors["ble"]
+    wifi: UbusWifi = collectors["wifi"]
+    metrics.start_cycle(*SCAN_METRICS)
+    started_s = time.time()
+    if scheduler is not None:
+        ble.wait_s = scheduler.ble_wait_s
+
+    # with a window, every scan is repeated and aggregated per device
+    rounds = _fit_rounds(args["scans_per_window"], ble, deadline)
+    window_s = (rounds - 1) * ble.wait_s
+    # each window's scans so far, and when it has to be done by
+    done: dict[str, list] = {"wifi": [], "ble": []}
+    until_s: dict[str, float] = {}
+
+    def scan_ble_once():
+        # start scanning (must wait ~10s before retrieving)
+        ble.scan()
+        return ble.devices()
+
+    def scan_ble():
+        return windowed(scan_ble_once, rounds, ble.wait_s,
+                        args["aggregate_numpy"], done["ble"],
+                        until_s.get("ble"))
+
+    def scan_wifi():
+        return windowed(wifi.devices,
+                        rounds, ble.wait_s, args["aggregate_numpy"],
+                        done["wifi"], until_s.get("wifi"))
+
+    tasks = {} if router is not None else router_collectors(args, collectors)
+    cached = _from_cache(cache, tasks)
+    if not args["no_wifi"]:
+        tasks["wifi"] = scan_wifi
+    if not args["no_ble"]:
+        tasks["ble"] = scan_ble
+    timeout_s = {name: args["collector_timeout_s"] for name in tasks}
+    for name in ("wifi", "ble"):
+        if name in timeout_s:
+            timeout_s[name] += window_s
+    if "ble" in timeout_s:
+        # each round waits for devices, longer than wait_s if adaptive
+        timeout_s["ble"] += ble.max_scan_s \
+            + (rounds - 1) * max(0, ble.max_scan_s - ble.wait_s)
+    if deadline is not None:
+        timeout_s = {name: deadline.clip(t, ps.UPLOAD_RESERVE_S)
+                     for name, t in timeout_s.items()}
+
+    until_s.update({name: time.monotonic() + timeout_s[name]
+                    for name in done if name in timeout_s})
+
+    collected = collect(tasks, timeout_s, defaults=ROUTER_DEFAULTS,
+                        running=running)
+    n_done = {}  # scans per window that made it into the body
+    for name, scans in done.items():
+        c = collected.get(name)
+        if rounds == 1 or c is None:
+            continue
+        scans = list(scans)  # it may still be scanning
+        n_done[name] = len(scans)
+        if scans and not c.ok:
+            # better the scans done than none at all
+            c.value = aggregate(scans, args["aggregate_numpy"])
+            log.warning(f"sending {name} from the {len(scans)} of \
+                        {rounds} scans done before it was cut short.")
+    if router is None:
+        _to_cache(cache, collected)
+        router = _router({**collected, **cached})
+    _wifi = collected.get("wifi", Collected("wifi", []))
+    _ble = collected.get("ble", Collected("ble", []))
+    log.info("collected in " + ", ".join(
+        f"{c.name}={round(c.elapsed_s, 1)}s" for c in collected.values()))
+    for c in collected.values():
+        if not c.ok:
+            reason = "timeout" if c.timed_out \
+                else "busy" if c.is_busy else "error"
+            metrics.inc("sniff_collector_errors_total", collector=c.name,
+                        reason=reason)
+
+    body = {
+        "scan": {
+            "ble_start_s": int(_ble.start_s),
+            "ble_end_s": int(_ble.end_s),
+            "wifi_start_s": int(_wifi.start_s),
+            "wifi_end_s": int(_wifi.end_s),
+        },
+        "router": router,
+        "wifi": _wifi.value or [],
+        "ble": _ble.value or [],
+    }
+    if n_done:
+        body["scan"]["rounds"] = n_done
+    if "wifi" in collected and wifi.radio_timings:
+        body["scan"]["wifi_radios"] = wifi.radio_timings
+    if scheduler is not None:
+        scheduler.update({c.name: [d.key for d in c.value or []]
+                          for c in (_wifi, _ble)
+                          if c.name in collected and c.ok}, started_s)
+        body["scan"]["churn"] = round(scheduler.churn, 3)
+        body["scan"]["interval_s"] = round(scheduler.interval_s)
+        metrics.set_gauge("sniff_churn", scheduler.churn)
+        metrics.set_gauge("sniff_schedule_interval_seconds",
+                          scheduler.interval_s)
+    if history is not None:
+        for c in (_wifi, _ble):
+            history.append(c.name, c.value or [], c.start_s)
+    if presence is not None:
+        presence.apply(body, skip=tuple(
+            c.name for c in (_wifi, _ble) if not c.ok))
+    for c in (_wifi, _ble):
+        metrics.set_gauge("sniff_devices", len(c.value or []),
+                          section=c.name)
+    if args["metrics_in_body"]:
+        body["metrics"] = metrics.summary()
+    if args["body_id"]:
+        body["id"] = uuid.uuid4().hex
+    log.debug("body has %d wifi and %d bluetooth devices.",
+              len(body["wifi"]), len(body["ble"]))
+    if args["wire_format"] == columnar.FORMAT:
+        body = columnar.encode(body)
+    return body
+
+
+def make_outbox(args: dict[str, Any], name: str = None):
+    """The outbox, or with `name`, a separate one inside it, eg. for a
+    second API"""
+    if args["no_outbox"]:
+        return None
+    path = args["outbox_path"]
+    return Outbox(os.path.join(path, name) if name else path,
+                  max_items=args["outbox_max_items"],
+                  max_bytes=args["outbox_max_bytes"],
+                  batch_size=args["outbox_batch_size"])
+
+
+def make_sender(args: dict[str, Any], read_timeout_s: float = None):
+    return sender.Sender(connect_timeout_s=args["api_connect_timeout_s"],
+                         read_timeout_s=read_timeout_s
+                         or args["api_timeout_s"],
+                         compression=args["compression"],
+                         compress_level=args["compress_level"],
+                         compress_min_bytes=args["compress_min_bytes"],
+                         is_streaming=not args["no_stream"])
+
+
+def make_targets(args: dict[str, Any]):
+    """A Target for each API, with its own sender, time limit and outbox.
+    The first API keeps --outbox-path, others get a directory in it.
+
+    Raises:
+        ValueError: if no API URL or headers were given or found.
+    """
+    apis = get_apis(args)
+    timeouts_s = parse_ttls(args["api_timeouts_s"])
+    unknown = set(timeouts_s) - {name for name, _, _ in apis}
+    if unknown:
+        log.warning(f"--api-timeouts-s for unknown APIs: \
+                    {', '.join(sorted(unknown))}")
+    targets = []
+    for i, (name, url, headers) in enumerate(apis):
+        timeout_s = timeouts_s.get(name, args["api_timeout_s"])
+        targets.append(Target(name, url, headers,
+                              outbox=make_outbox(args, name if i else None),
+                              client=make_sender(args, timeout_s),
+                              timeout_s=timeout_s))
+    if len(targets) > 1:
+        log.info(f"uploading to {len(targets)} APIs: \
+                 {', '.join(t.name for t in targets)}.")
+    return targets
+
+
+def send(body: dict[str, Any],
+         targets: list[Target],
+         deadline: Deadline = None):
+    """Post body to every API at once. Targets with an outbox queue it
+    first and then upload everything queued, oldest first, so failed
+    uploads are retried. With `deadline`, uploads are cut short to fit it
+    and queued bodies that don't wait for the next run.
+
+    Returns {target name: Target.send() result}.
+    """
+    metrics.start_cycle(*UPLOAD_METRICS)
+    return send_all(body, targets, deadline)
+
+
+def make_deadline(args: dict[str, Any]):
+    return Deadline(args["cycle_budget_s"])
+
+
+def make_lock(args: dict[str, Any]):
+    return RunLock(args["lock_path"],
+                   is_preempt=args["on_overlap"] == "preempt")
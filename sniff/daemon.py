@@ -0,0 +1,161 @@
+import logging as log
+import os
+import signal
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import Future
+from typing import Any
+
+from sniff import cycle, logger, metrics
+import sniff.params as ps
+from sniff.cli import config
+from sniff.target import Target
+
+
+class Daemon():
+    """Run scan/post cycles on an interval in one long-lived process.
+
+    Keeps the APIs, Ubus objects, router identity cache and API
+    connections in memory and only reloads them when a config file's mtime
+    changes.
+    """
+    DEFAULT_INTERVAL_S = ps.DAEMON_INTERVAL_S
+
+    def __init__(self,
+                 parser: ArgumentParser,
+                 config_path: str = None):
+        self.parser = parser
+        self.config_path = config.find_config(config_path)
+        self.args: dict[str, Any] = {}
+        self.targets: list[Target] = []
+        self.collectors = {}
+        self.cache = None
+        self.presence = None
+        self.scheduler = None
+        self.history = None
+        # collectors that timed out and are still running, by name
+        self.running: dict[str, Future] = {}
+        self.cycles = 0
+        self._mtimes: dict[str, float] = {}
+        self._stop = threading.Event()
+
+    @property
+    def interval_s(self):
+        if self.scheduler is not None:
+            return self.scheduler.interval_s
+        return float(self.args.get("interval_s") or self.DEFAULT_INTERVAL_S)
+
+    def _watched(self):
+        return [self.config_path,
+                self.args.get("sender_config_file"),
+                ps.PATH_ETC_CONFIG_SYSTEM]
+
+    def _get_mtimes(self):
+        mtimes = {}
+        for path in filter(None, self._watched()):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def load(self):
+        """(re)read config and args, resolve the APIs, make Ubus objects"""
+        # main() already wrote it if asked, rewriting would reload again
+        args = config.get_or_write_config(self.parser, self.config_path,
+                                          is_writable=False)
+        logger.init_logger(**args)
+        targets = cycle.make_targets(args)
+
+        self.args = args
+        for target in self.targets:
+            target.close()
+        self.targets = targets
+        self.collectors = cycle.make_collectors(args)
+        cycle.make_metrics(args)
+        self.cache = cycle.make_cache(args)
+        presence = cycle.make_presence(args, is_in_memory=True)
+        if presence is not None and self.presence is not None:
+            # keep tracking the same devices across reloads
+            presence.devices = self.presence.devices
+            presence.keyframe_at_s = self.presence.keyframe_at_s
+        self.presence = presence
+        scheduler = cycle.make_scheduler(args, is_in_memory=True)
+        if scheduler is not None and self.scheduler is not None:
+            # keep the pace and the devices it's comparing to
+            scheduler.devices = self.scheduler.devices
+            scheduler.interval_s = min(scheduler.max_interval_s,
+                                       max(scheduler.min_interval_s,
+                                           self.scheduler.interval_s))
+            scheduler.ble_wait_s = min(scheduler.max_ble_wait_s,
+                                       max(scheduler.min_ble_wait_s,
+                                           self.scheduler.ble_wait_s))
+        self.scheduler = scheduler
+        if self.history is not None:
+            self.history.close()
+        self.history = cycle.make_history(args)
+        self._mtimes = self._get_mtimes()
+        log.info(f"loaded config, running every {self.interval_s}s.")
+
+    def reload_if_changed(self):
+        mtimes = self._get_mtimes()
+        if mtimes == self._mtimes:
+            return False
+        changed = [p for p in mtimes if mtimes[p] != self._mtimes.get(p)]
+        log.info(f"config changed: {changed}, reloading...")
+        try:
+            self.load()
+        except (ValueError, OSError) as e:
+            # keep running with the last good config
+            log.error(f"couldn't reload config, keeping previous: {e}")
+            self._mtimes = mtimes
+        return True
+
+    def cycle(self):
+        deadline = cycle.make_deadline(self.args)
+        with metrics.timer("sniff_cycle_seconds"):
+            with deadline.step("scan"):
+                body = cycle.scan(self.args, self.collectors,
+                                  cache=self.cache, presence=self.presence,
+                                  scheduler=self.scheduler,
+                                  deadline=deadline,
+                                  history=self.history,
+                                  running=self.running)
+            with deadline.step("upload"):
+                result = cycle.send(body, self.targets, deadline=deadline)
+        metrics.save()
+        deadline.log_steps()
+        self.cycles += 1
+        return result
+
+    def stop(self, signum=None, frame=None):
+        log.info(f"stopping after signal {signum}...")
+        self._stop.set()
+
+    def run(self):
+        """Run cycles until stopped. Cycles that overrun the interval skip
+        the missed ticks instead of running back-to-back."""
+        self.load()
+        cycle.check_ubus(self.args)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        next_s = time.monotonic()
+        while not self._stop.is_set():
+            self.reload_if_changed()
+            try:
+                self.cycle()
+            except Exception as e:
+                log.exception(f"cycle failed: {e}")
+
+            interval_s = self.interval_s
+            next_s += interval_s
+            now = time.monotonic()
+            if next_s < now:
+                skipped = int((now - next_s) // interval_s) + 1
+                log.warning(f"cycle overran interval {interval_s}s, \
+                            skipping {skipped} tick(s).")
+                next_s += skipped * interval_s
+            self._stop.wait(next_s - now)
+        log.info(f"stopped after {self.cycles} cycles.")
@@ -0,0 +1,94 @@
+"""A time budget for a whole cycle, shared by its steps.
+
+Each step keeps its own timeout but gets cut short to fit what's left of
+the budget, so a hung ubus call or a stalled upload can't push a cron run
+into the next one. A watchdog ends the process if it's still running well
+past the budget, eg. stuck somewhere no timeout covers, like a DNS lookup.
+"""
+import logging as log
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import sniff.params as ps
+
+
+class Deadline():
+    """What's left of `budget_s` seconds from when it was made (no limit if
+    0 or None), and how long each step took.
+
+    Example:
+        >>> from sniff.deadline import Deadline
+        >>> deadline = Deadline(50)
+        >>> with deadline.step("scan"):
+        ...     collect(tasks, deadline.clip(20, reserve_s=10))
+        >>> round(deadline.remaining_s(), 1)
+        38.2
+        >>> deadline.log_steps()
+        cycle took 11.8s of 50s budget: scan=11.8s.
+    """
+
+    def __init__(self, budget_s: float = ps.CYCLE_BUDGET_S):
+        self.budget_s = budget_s or None
+        self.start_s = time.monotonic()
+        self.steps: dict[str, float] = {}
+        self._watchdog: threading.Timer = None
+
+    def remaining_s(self):
+        if self.budget_s is None:
+            return float("inf")
+        return self.budget_s - (time.monotonic() - self.start_s)
+
+    @property
+    def expired(self):
+        return self.remaining_s() <= 0
+
+    def clip(self, timeout_s: float = None, reserve_s: float = 0):
+        """`timeout_s`, or less if there isn't that much left of the budget
+        after keeping `reserve_s` (at most half the budget) for later steps.
+        Never below 0."""
+        if self.budget_s is None:
+            return timeout_s
+        reserve_s = min(reserve_s, self.budget_s / 2)
+        left_s = max(0.0, self.remaining_s() - reserve_s)
+        return left_s if timeout_s is None else min(timeout_s, left_s)
+
+    @contextmanager
+    def step(self, name: str):
+        """Time a step of the cycle, for log_steps()"""
+        start_s = time.monotonic()
+        try:
+            yield
+        finally:
+            self.steps[name] = self.steps.get(name, 0) \
+                + time.monotonic() - start_s
+
+    def log_steps(self):
+        elapsed_s = time.monotonic() - self.start_s
+        budget = f" of {self.budget_s}s budget" if self.budget_s else ""
+        steps = ", ".join(f"{name}={round(s, 1)}s"
+                          for name, s in self.steps.items())
+        if self.expired:
+            log.warning(f"cycle took {round(elapsed_s, 1)}s, over its \
+                        {self.budget_s}s budget: {steps}.")
+        else:
+            log.info(f"cycle took {round(elapsed_s, 1)}s{budget}: {steps}.")
+
+    def start_watchdog(self, grace_s: float = ps.CYCLE_GRACE_S):
+        """Exit the process if it's still running `grace_s` after the
+        budget, whatever it's stuck on. Queued bodies are safe on disk."""
+        if self.budget_s is None:
+            return
+
+        def expire():
+            log.error(f"still running {grace_s}s past the {self.budget_s}s \
+                      budget, exiting.")
+            for handler in log.getLogger().handlers:
+                handler.flush()
+            os._exit(1)
+
+        self._watchdog = threading.Timer(self.remaining_s() + grace_s,
+                                         expire)
+        self._watchdog.daemon = True
+        self._watchdog.start()
@@ -0,0 +1,134 @@
+import re
+from typing import Any, Iterable
+
+# six octets of one or two hex digits, or 12 bare hex digits. int(x, 16)
+# alone would also take '+f', ' f' or '0x1'.
+_MAC = re.compile(r"[0-9A-Fa-f]{1,2}(?:[:-][0-9A-Fa-f]{1,2}){5}")
+_BARE_MAC = re.compile(r"[0-9A-Fa-f]{12}")
+
+
+def mac_to_int(mac: str):
+    """Parse a MAC address into its 48-bit integer key. Accepts ':' or '-'
+    separated octets with or without leading zeros, in any case, like
+    iwinfo's '2:BD:89:F:A1:75', or 12 bare hex digits.
+
+    Raises:
+        ValueError: if `mac` isn't a MAC address.
+
+    Example:
+        >>> from sniff.device import mac_to_int
+        >>> mac_to_int("2:BD:89:F:A1:75") == mac_to_int("02-bd-89-0f-a1-75")
+        True
+    """
+    if _BARE_MAC.fullmatch(mac):
+        return int(mac, 16)
+    if not _MAC.fullmatch(mac):
+        raise ValueError(f"bad MAC address '{mac}'")
+    key = 0
+    for octet in mac.replace("-", ":").split(":"):
+        key = key << 8 | int(octet, 16)
+    return key
+
+
+def int_to_mac(key: int):
+    """Format a 48-bit key as a zero-padded, uppercase MAC address"""
+    h = f"{key:012X}"
+    return f"{h[0:2]}:{h[2:4]}:{h[4:6]}:{h[6:8]}:{h[8:10]}:{h[10:12]}"
+
+
+class Device():
+    """One device seen in a scan, keyed by its MAC as a 48-bit int.
+
+    Kept small with __slots__, since busy sites see thousands of bluetooth
+    advertisers per scan. Converted to a dict only when sent.
+
+    Example:
+        >>> from sniff.device import Device, mac_to_int
+        >>> Device(mac_to_int("6C:FC:DE:B0:EE:16"), -61).to_dict()
+        {'rssi': -61, 'host': '', 'mac': '6C:FC:DE:B0:EE:16'}
+    """
+    __slots__ = ("key", "rssi", "host", "quality", "channels", "bands")
+
+    def __init__(self, key: int, rssi: int, host: str = "",
+                 quality: float = None, channels: tuple[int, ...] = None,
+                 bands: tuple[str, ...] = None):
+        self.key = key
+        self.rssi = rssi
+        self.host = host
+        # wifi only
+        self.quality = quality
+        self.channels = channels  # every channel and band it was seen on
+        self.bands = bands
+
+    @property
+    def mac(self):
+        return int_to_mac(self.key)
+
+    def to_dict(self) -> dict[str, Any]:
+        d = {} if self.quality is None else {"quality": self.quality}
+        d["rssi"] = self.rssi
+        d["host"] = self.host
+        d["mac"] = self.mac
+        if self.channels is not None:
+            d["channels"] = list(self.channels)
+            d["bands"] = list(self.bands or ())
+        return d
+
+    def merge_seen(self, other: "Device"):
+        """Add the channels and bands `other` was seen on to this one's"""
+        if other.channels:
+            self.channels = tuple(sorted({*(self.channels or ()),
+                                          *other.channels}))
+        if other.bands:
+            self.bands = tuple(sorted({*(self.bands or ()), *other.bands}))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+class DeviceStats(Device):
+    """A device aggregated over several scans, with its RSSI statistics"""
+    __slots__ = ("count", "first_s", "last_s",
+                 "rssi_min", "rssi_max", "rssi_mean")
+
+    def __init__(self, device: Device, count: int, first_s: int,
+                 last_s: int, rssi_min: int, rssi_max: int,
+                 rssi_mean: float):
+        super().__init__(device.key, device.rssi, device.host,
+                         device.quality, device.channels, device.bands)
+        self.count = count
+        self.first_s = first_s
+        self.last_s = last_s
+        self.rssi_min = rssi_min
+        self.rssi_max = rssi_max
+        self.rssi_mean = rssi_mean
+
+    def to_dict(self):
+        d = super().to_dict()
+        d["count"] = self.count
+        d["first_s"] = self.first_s
+        d["last_s"] = self.last_s
+        d["rssi_min"] = self.rssi_min
+        d["rssi_max"] = self.rssi_max
+        d["rssi_mean"] = self.rssi_mean
+        return d
+
+
+def dedupe(devices: Iterable[Device]):
+    """One device per MAC, the strongest if seen more than once. Wifi
+    devices seen by several radios keep every channel and band."""
+    by_key: dict[int, Device] = {}
+    for d in devices:
+        seen = by_key.get(d.key)
+        if seen is None:
+            by_key[d.key] = d
+            continue
+        strong, weak = (d, seen) if d.rssi > seen.rssi else (seen, d)
+        if weak.channels:
+            strong.merge_seen(weak)
+        by_key[d.key] = strong
+    return list(by_key.values())
+
+
+def to_dicts(devices: Iterable[Device]):
+    return [d.to_dict() for d in devices]
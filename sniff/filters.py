@@ -0,0 +1,169 @@
+"""Which devices to keep: allow and deny lists of MAC prefixes and name
+patterns, an RSSI floor, and dropping randomized MACs.
+
+Applied by the device parsers before a Device is made, so devices that are
+filtered out are never kept, aggregated or sent.
+
+Example:
+    >>> from sniff.device import mac_to_int
+    >>> from sniff.filters import DeviceFilter
+    >>> keep = DeviceFilter(allow_macs=["AC:23:3F", "C3:00:00/20"],
+    ...                     deny_names=["*TV*"], min_rssi=-85)
+    >>> keep.keeps(mac_to_int("AC:23:3F:01:02:03"), "Tag 1")
+    True
+    >>> keep.keeps(mac_to_int("AC:23:3F:01:02:03"), "Living Room TV")
+    False
+"""
+import fnmatch
+import logging as log
+import re
+from typing import Iterable
+
+MAC_BITS = 48
+NO_MIN_RSSI = -128  # the weakest RSSI bluetooth reports
+
+
+def parse_prefix(prefix: str):
+    """Parse a MAC prefix into (value, bits): an OUI like 'AC:23:3F', any
+    number of hex digits, or a bit length after a slash like 'C3:00:00/20'.
+
+    Raises:
+        ValueError: if it isn't a hex prefix of at most 48 bits.
+
+    Example:
+        >>> parse_prefix("AC:23:3F"), parse_prefix("AC-23-3F-A/28")
+        ((11281215, 24), (180499450, 28))
+    """
+    text, _, bits = prefix.strip().partition("/")
+    digits = re.sub(r"[:\-.]", "", text)
+    if not re.fullmatch(r"[0-9a-fA-F]+", digits) \
+            or (bits and not bits.isdigit()):
+        raise ValueError(f"bad MAC prefix '{prefix}'")
+    value = int(digits, 16)
+    n_bits = 4 * len(digits)
+    bits = int(bits) if bits else n_bits
+    if not 0 < bits <= MAC_BITS or n_bits > MAC_BITS:
+        raise ValueError(f"bad MAC prefix '{prefix}'")
+    # keep the top `bits` of what was written
+    value = value >> (n_bits - bits) if bits <= n_bits \
+        else value << (bits - n_bits)
+    return value, bits
+
+
+class MacPrefixes():
+    """A set of MAC prefixes of any bit length, matched against 48-bit MAC
+    keys with one set lookup per distinct prefix length."""
+
+    def __init__(self, prefixes: Iterable[str] = ()):
+        by_bits: dict[int, set[int]] = {}
+        for prefix in prefixes:
+            value, bits = parse_prefix(prefix)
+            by_bits.setdefault(bits, set()).add(value)
+        # longest first, they're usually the fewest
+        self._shifts = [(MAC_BITS - bits, frozenset(values))
+                        for bits, values in sorted(by_bits.items(),
+                                                   reverse=True)]
+
+    def __bool__(self):
+        return bool(self._shifts)
+
+    def __contains__(self, key: int):
+        for shift, values in self._shifts:
+            if key >> shift in values:
+                return True
+        return False
+
+
+def is_random(key: int):
+    """Whether a wifi MAC is randomized: locally administered, the
+    second-lowest bit of its first octet set"""
+    return bool(key >> 40 & 0x02)
+
+
+def is_random_ble(key: int):
+    """Whether a bluetooth address looks random, for when the scan doesn't
+    say its address type: top two bits 0b01 (resolvable private) or 0b11
+    (random static).
+
+    It's a guess: public addresses whose OUI starts 0x40-0x7F or 0xC0-0xFF
+    (eg. F4:CE:36, 6C:FC:DE) have the same top bits and look random too,
+    and non-resolvable private addresses (0b00) look public.
+    """
+    return bool(key >> 46 & 0x01)
+
+
+def _names_regex(patterns: Iterable[str]):
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns),
+                      re.IGNORECASE)
+
+
+class DeviceFilter():
+    """Keep devices that match any allow rule (when there are any) and no
+    deny rule. Deny rules win: denied MACs and names, RSSI below
+    `min_rssi` and, with `drop_random`, random MACs: locally administered
+    ones for wifi, or with `is_ble`, random bluetooth addresses. Those are
+    known from the address type if the scan has it, else guessed from the
+    top bits (see is_random_ble), and then allow-listed MACs are kept
+    even if they look random.
+
+    Names are shell-style patterns (`*`, `?`, `[...]`), case-insensitive,
+    matched against the whole name (ssid or bluetooth name).
+    """
+
+    def __init__(self,
+                 allow_macs: Iterable[str] = (),
+                 deny_macs: Iterable[str] = (),
+                 allow_names: Iterable[str] = (),
+                 deny_names: Iterable[str] = (),
+                 min_rssi: int = None,
+                 drop_random: bool = False,
+                 is_ble: bool = False):
+        self.allow_macs = MacPrefixes(allow_macs)
+        self.deny_macs = MacPrefixes(deny_macs)
+        self.allow_names = _names_regex(allow_names)
+        self.deny_names = _names_regex(deny_names)
+        # parsers check this before parsing the MAC, it's cheapest
+        self.min_rssi = NO_MIN_RSSI if min_rssi is None else min_rssi
+        self.drop_random = drop_random
+        self.is_random = is_random_ble if is_ble else is_random
+        self.is_allowlist = bool(self.allow_macs) \
+            or self.allow_names is not None
+        self._kept_random: set[int] = set()  # OUIs logged as kept
+
+    def __bool__(self):
+        return self.is_allowlist or bool(self.deny_macs) \
+            or self.deny_names is not None \
+            or self.min_rssi > NO_MIN_RSSI or self.drop_random
+
+    def _drops_random(self, key: int, is_random: bool = None):
+        if is_random is not None:
+            return is_random
+        if not self.is_random(key):
+            return False
+        if key not in self.allow_macs:
+            return True
+        oui = key >> 24
+        if oui not in self._kept_random:
+            self._kept_random.add(oui)
+            log.info(f"keeping allow-listed {oui:06X}* devices, their MACs \
+                     look random but may be public.")
+        return False
+
+    def keeps(self, key: int, name: str = "", is_random: bool = None):
+        """Whether to keep a device with MAC `key` and `name`. Doesn't
+        check min_rssi. `is_random` is whether its address is random, if
+        the scan says so."""
+        if self.drop_random and self._drops_random(key, is_random):
+            return False
+        if key in self.deny_macs:
+            return False
+        if self.deny_names is not None and self.deny_names.match(name):
+            return False
+        if not self.is_allowlist:
+            return True
+        return key in self.allow_macs or (
+            self.allow_names is not None
+            and self.allow_names.match(name) is not None)
@@ -0,0 +1,263 @@
+"""Every sighting, kept on the router in a fixed-size file.
+
+Each device seen in a scan is one 16-byte record (MAC, time, RSSI, wifi or
+bluetooth) written straight into a memory-mapped ring buffer. Once it's
+full the oldest records are overwritten, so it never grows. It outlives
+runs and doesn't need the API, so the router can tell when a MAC was last
+seen during an outage or while debugging on site (`sniff history`).
+
+Queries scan the mapped file in place, with numpy when it's installed or
+one record at a time with struct otherwise, and only make objects for the
+records that match.
+"""
+import logging as log
+import mmap
+import os
+import struct
+import time
+from typing import Iterable, NamedTuple
+
+import sniff.params as ps
+from sniff.device import Device, int_to_mac
+from sniff.filters import MAC_BITS, MacPrefixes, parse_prefix
+
+np = None  # numpy is optional and slow to import, see _import_numpy()
+
+MAGIC = b"SNFH"
+VERSION = 1
+# magic, version, record size, capacity, records ever appended
+_HEADER = struct.Struct("<4sHHIQ")
+HEADER_BYTES = 64
+# MAC key, unix time, RSSI, source (index in SOURCES)
+_RECORD = struct.Struct("<QIbB2x")
+RECORD_BYTES = _RECORD.size
+_COUNT_OFFSET = 12  # of the count in the header
+SOURCES = ("wifi", "ble")
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+
+def _dtype():
+    return np.dtype({"names": ["key", "t_s", "rssi", "source"],
+                     "formats": ["<u8", "<u4", "i1", "u1"],
+                     "offsets": [0, 8, 12, 13],
+                     "itemsize": RECORD_BYTES})
+
+
+class Sighting(NamedTuple):
+    key: int
+    t_s: int
+    rssi: int
+    source: str
+
+    @property
+    def mac(self):
+        return int_to_mac(self.key)
+
+    def to_dict(self):
+        return {"t_s": self.t_s, "source": self.source, "rssi": self.rssi,
+                "mac": self.mac}
+
+
+class History():
+    """A ring buffer of the last `capacity` sightings in the file at
+    `path`. `capacity` only applies when the file is made; an existing
+    file keeps its own, delete it to change it.
+
+    Example:
+        >>> from sniff.history import History
+        >>> from sniff.device import Device
+        >>> history = History("/tmp/sniff/history.bin").open()
+        >>> history.append("ble", [Device(0xA, -60)], t_s=1700000000)
+        >>> history.query(macs=["00:00:00:00:00:0A"])
+        [Sighting(key=10, t_s=1700000000, rssi=-60, source='ble')]
+        >>> history.close()
+    """
+    DEFAULT_PATH = ps.HISTORY_PATH
+
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 capacity: int = ps.HISTORY_RECORDS,
+                 is_read_only: bool = False):
+        self.path = path
+        self.capacity = max(1, capacity)
+        self.is_read_only = is_read_only
+        self.count = 0  # records ever appended, the next one's index
+        self._mm: mmap.mmap = None
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _read_header(self, mm: mmap.mmap):
+        """(capacity, count) if the header is good, else None"""
+        if len(mm) < HEADER_BYTES:
+            return None
+        magic, version, record_bytes, capacity, count = \
+            _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION \
+                or record_bytes != RECORD_BYTES \
+                or len(mm) != HEADER_BYTES + capacity * RECORD_BYTES:
+            return None
+        return capacity, count
+
+    def open(self):
+        """Map the file, making it (or remaking a bad one) unless read-only.
+
+        Raises:
+            OSError: if the file can't be opened, or is missing read-only.
+            ValueError: if it isn't a history file, read-only.
+        """
+        if self.is_read_only:
+            fd = os.open(self.path, os.O_RDONLY)
+            access = mmap.ACCESS_READ
+        else:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            access = mmap.ACCESS_WRITE
+        try:
+            size = os.fstat(fd).st_size
+            mm = mmap.mmap(fd, size, access=access) if size else None
+            header = self._read_header(mm) if mm is not None else None
+            if header is None and self.is_read_only:
+                raise ValueError(f"'{self.path}' isn't a sniff history file")
+            if header is None:
+                if mm is not None:
+                    log.warning(f"remaking bad history file '{self.path}'.")
+                    mm.close()
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, HEADER_BYTES
+                             + self.capacity * RECORD_BYTES)
+                mm = mmap.mmap(fd, 0, access=access)
+                header = (self.capacity, 0)
+                _HEADER.pack_into(mm, 0, MAGIC, VERSION, RECORD_BYTES,
+                                  *header)
+        finally:
+            os.close(fd)  # the mapping keeps the file open
+        self._mm = mm
+        self.capacity, self.count = header
+        return self
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def append(self,
+               source: str,
+               devices: Iterable[Device],
+               t_s: float = None):
+        """Write one scan's devices straight into the file, as seen at
+        `t_s` (or when each was last seen, for aggregated devices)."""
+        t_s = int(t_s or time.time())
+        code = SOURCES.index(source)
+        mm, capacity, pack_into = self._mm, self.capacity, _RECORD.pack_into
+        i = self.count
+        for d in devices:
+            rssi = int(d.rssi)
+            pack_into(mm, HEADER_BYTES + i % capacity * RECORD_BYTES,
+                      d.key, getattr(d, "last_s", t_s),
+                      -128 if rssi < -128 else 127 if rssi > 127 else rssi,
+                      code)
+            i += 1
+        # count last, so records are in before readers look for them
+        struct.pack_into("<Q", mm, _COUNT_OFFSET, i)
+        self.count = i
+
+    def _refresh(self):
+        # another process may have appended since this one opened it
+        self.count = struct.unpack_from("<Q", self._mm, _COUNT_OFFSET)[0]
+
+    def query(self,
+              macs: Iterable[str] = (),
+              since_s: float = None,
+              until_s: float = None,
+              min_rssi: int = None,
+              max_rssi: int = None,
+              source: str = None,
+              is_numpy: bool = True):
+        """Sightings matching every filter given, oldest first. `macs` are
+        MAC prefixes of any length (see sniff.filters.parse_prefix), a
+        whole MAC matches only itself.
+
+        Raises:
+            ValueError: if a MAC prefix is invalid.
+        """
+        self._refresh()
+        macs = list(macs)
+        prefixes = [parse_prefix(m) for m in macs]
+        filters = (prefixes, since_s, until_s, min_rssi, max_rssi,
+                   None if source is None else SOURCES.index(source))
+        if is_numpy and _import_numpy() is not None:
+            return self._query_numpy(*filters)
+        if is_numpy:
+            log.info("numpy isn't installed, scanning with struct.")
+        return self._query_struct(macs, *filters[1:])
+
+    def _slots(self):
+        """(records in use, slot of the oldest)"""
+        n = len(self)
+        return n, self.count % self.capacity if self.count > n else 0
+
+    def _query_numpy(self, prefixes, since_s, until_s, min_rssi, max_rssi,
+                     code):
+        n, start = self._slots()
+        records = np.frombuffer(self._mm, _dtype(), count=n,
+                                offset=HEADER_BYTES)
+        mask = np.ones(n, dtype=bool)
+        if prefixes:
+            keys = records["key"]
+            by_mac = np.zeros(n, dtype=bool)
+            for value, bits in prefixes:
+                by_mac |= keys >> np.uint64(MAC_BITS - bits) \
+                    == np.uint64(value)
+            mask &= by_mac
+        for field, bound, is_min in (("t_s", since_s, True),
+                                     ("t_s", until_s, False),
+                                     ("rssi", min_rssi, True),
+                                     ("rssi", max_rssi, False)):
+            if bound is not None:
+                mask &= records[field] >= bound if is_min \
+                    else records[field] <= bound
+        if code is not None:
+            mask &= records["source"] == code
+        slots = np.flatnonzero(mask)
+        slots = np.concatenate((slots[slots >= start], slots[slots < start]))
+        return [Sighting(key, t_s, rssi, SOURCES[s])
+                for key, t_s, rssi, s in records[slots].tolist()]
+
+    def _query_struct(self, macs, since_s, until_s, min_rssi, max_rssi,
+                      code):
+        n, start = self._slots()
+        # whole MACs with a set lookup, shorter prefixes the slow way
+        keys = {value for value, bits in map(parse_prefix, macs)
+                if bits == MAC_BITS}
+        prefixes = MacPrefixes(m for m in macs
+                               if parse_prefix(m)[1] < MAC_BITS)
+        is_any_mac = not macs
+        since_s = -1 if since_s is None else since_s
+        until_s = float("inf") if until_s is None else until_s
+        min_rssi = -128 if min_rssi is None else min_rssi
+        max_rssi = 127 if max_rssi is None else max_rssi
+        found = []
+        with memoryview(self._mm) as view:
+            for first, last in ((start, n), (0, start)):
+                with view[HEADER_BYTES + first * RECORD_BYTES:
+                          HEADER_BYTES + last * RECORD_BYTES] as part:
+                    for key, t_s, rssi, s in _RECORD.iter_unpack(part):
+                        if since_s <= t_s <= until_s \
+                                and min_rssi <= rssi <= max_rssi \
+                                and (code is None or s == code) \
+                                and (is_any_mac or key in keys
+                                     or (prefixes and key in prefixes)):
+                            found.append(Sighting(key, t_s, rssi,
+                                                  SOURCES[s]))
+        return found
@@ -0,0 +1,108 @@
+"""One sniff run at a time.
+
+Overlapping runs (eg. a cron run that hung past the next minute) compete
+for the bluetooth radio, which refuses to scan again too soon, and for the
+router's little free memory.
+"""
+import fcntl
+import logging as log
+import os
+import signal
+import time
+
+import sniff.params as ps
+
+OVERLAP_ACTIONS = ("skip", "preempt")
+
+
+class RunLock():
+    """An exclusive lock on the file at `path`, holding the PID of the run
+    that has it.
+
+    A run that finds it taken skips, or with `is_preempt`, stops the other
+    run (SIGTERM, then SIGKILL after `grace_s`) and takes over, for when a
+    fresh scan matters more than a stuck one. The kernel releases the lock
+    when the process exits, however it exits, so it's never left stale.
+
+    Example:
+        >>> from sniff.lock import RunLock
+        >>> lock = RunLock("/tmp/sniff/sniff.lock")
+        >>> lock.acquire()
+        True
+        >>> RunLock("/tmp/sniff/sniff.lock").acquire()
+        False
+    """
+    DEFAULT_PATH = ps.LOCK_PATH
+
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 is_preempt: bool = False,
+                 grace_s: float = ps.LOCK_GRACE_S):
+        self.path = path
+        self.is_preempt = is_preempt
+        self.grace_s = grace_s
+        self._fd: int = None
+
+    def _try_lock(self):
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _wait_lock(self, wait_s: float):
+        until_s = time.monotonic() + wait_s
+        while time.monotonic() < until_s:
+            time.sleep(0.1)
+            if self._try_lock():
+                return True
+        return False
+
+    def _read_pid(self):
+        try:
+            return int(os.pread(self._fd, 32, 0).split()[0])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _stop(self, pid: int):
+        """Stop the run holding the lock, True once the lock is ours"""
+        log.warning(f"another sniff (pid {pid}) is still running, \
+                    stopping it.")
+        for signum in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+            except PermissionError as e:
+                log.error(f"can't stop sniff (pid {pid}): {e}")
+                return False
+            if self._wait_lock(self.grace_s):
+                return True
+        return False
+
+    def acquire(self):
+        """Take the lock, True if this run should go ahead"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        is_locked = self._try_lock()
+        if not is_locked:
+            pid = self._read_pid()
+            if self.is_preempt and pid is not None and pid != os.getpid():
+                is_locked = self._stop(pid)
+            else:
+                log.warning(f"another sniff (pid {pid}) is still running, \
+                            skipping this run.")
+        if not is_locked:
+            os.close(self._fd)
+            self._fd = None
+            return False
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, f"{os.getpid()}\n".encode(), 0)
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
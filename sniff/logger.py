@@ -1,33 +1,158 @@
+"""Logging to a small rotating file, written in batches.
+
+Records are held in memory and written all at once on a WARNING or worse,
+when the buffer fills up, a while after the oldest one, or at exit, so a
+cron run makes one write instead of one per line. The file is rotated by
+size, on tmpfs by default, so flash isn't worn and /tmp doesn't fill up.
+
+Log calls on hot paths pass their arguments separately (`log.debug("x: %s",
+x)`) so nothing is formatted for levels that are off, and big structures
+are wrapped in LazyJSON so they're only encoded if they're written.
+"""
+import json
 import logging
+import re
 import sys
 from logging import StreamHandler
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import MemoryHandler, RotatingFileHandler
+from typing import Any
 
 import sniff.params as ps
 
 LEVELS = ", ".join([k for k in logging._nameToLevel.keys()])
 
+# runs of spaces left inside messages by backslash-continued f-strings
+_SPACES = re.compile(r"(?<=\S) {2,}")
+
+
+class LazyJSON():
+    """Encodes `data` as JSON only when the log record is formatted.
+
+    Example:
+        >>> log.debug("got router info: %s", LazyJSON(router))
+    """
+    __slots__ = ("data", "indent", "_text")
+
+    def __init__(self, data: Any, indent: int = 4):
+        self.data = data
+        self.indent = indent
+        self._text: str = None
+
+    def __str__(self):
+        # each handler formats the record, encode once
+        if self._text is None:
+            self._text = json.dumps(self.data, indent=self.indent,
+                                    default=str)
+        return self._text
+
+
+class CompactFormatter(logging.Formatter):
+    """A Formatter that squeezes runs of spaces inside lines to one, but
+    keeps indentation at the start of lines."""
+
+    def format(self, record: logging.LogRecord):
+        return _SPACES.sub(" ", super().format(record))
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, eg. for a log shipper.
+
+    Example:
+        {"ts":1700000000.1,"level":"INFO","msg":"done.","func":"parse",...}
+    """
+
+    def format(self, record: logging.LogRecord):
+        line = {"ts": round(record.created, 3),
+                "level": record.levelname,
+                "msg": _SPACES.sub(" ", record.getMessage()),
+                "func": record.funcName,
+                "file": record.filename,
+                "line": record.lineno}
+        if record.exc_info:
+            line["exc"] = self.formatException(record.exc_info)
+        return json.dumps(line, separators=(",", ":"), default=str)
+
+
+class BatchFileHandler(RotatingFileHandler):
+    """A RotatingFileHandler that can write a batch of records with one
+    write, instead of flushing after each record."""
+    is_batching = False
+
+    def flush(self):
+        if not self.is_batching:
+            super().flush()
+
+
+class BufferedHandler(MemoryHandler):
+    """Holds up to `capacity` records and writes them to `target` at once:
+    when full, on a record at `flush_level` or worse, `flush_s` after the
+    oldest record held, or when closed (at exit, by logging.shutdown).
+
+    Unlike a plain MemoryHandler, a long-running --daemon doesn't hold
+    quiet INFO lines back for hours.
+    """
+
+    def __init__(self,
+                 target: BatchFileHandler,
+                 capacity: int = ps.LOG_BUFFER_RECORDS,
+                 flush_level: int = logging.WARNING,
+                 flush_s: float = ps.LOG_FLUSH_S):
+        super().__init__(capacity, flushLevel=flush_level, target=target,
+                         flushOnClose=True)
+        self.flush_s = flush_s
+
+    def shouldFlush(self, record: logging.LogRecord):
+        return super().shouldFlush(record) \
+            or record.created - self.buffer[0].created >= self.flush_s
+
+    def flush(self):
+        with self.lock:
+            if self.target is None or not self.buffer:
+                return
+            self.target.is_batching = True
+            try:
+                super().flush()
+            finally:
+                self.target.is_batching = False
+                self.target.flush()
+
+    def close(self):
+        target = self.target
+        super().close()
+        if target is not None:
+            target.close()
+
 
 def init_logger(log_path=ps.LOG_PATH,
                 log_level=ps.LOG_LEVEL,
                 log_format=ps.LOG_FORMAT,
                 is_log_to_console=ps.IS_LOG_TO_CONSOLE,
+                log_max_bytes=ps.LOG_MAX_BYTES,
+                log_backups=ps.LOG_BACKUPS,
+                log_buffer=ps.LOG_BUFFER_RECORDS,
+                log_json=False,
                 **kwargs):
 
+    log_path = log_path or ps.get_log_path(ps.LOG_FILE)
     level = logging._nameToLevel.get(log_level)
-    format = logging.Formatter(log_format)
+    format = CompactFormatter(log_format)
 
     log = logging.getLogger()
-    _ = [log.removeHandler(h) for h in log.handlers]
-    log.setLevel(logging.DEBUG)
+    for handler in list(log.handlers):
+        # writes out what's buffered, eg. when --daemon reloads config
+        log.removeHandler(handler)
+        handler.close()
+    log.setLevel(level)
 
-    file_handler = TimedRotatingFileHandler(
+    file_handler = BatchFileHandler(
         filename=log_path,
-        when=ps.LOG_FILE_SPLIT_WHEN,
-        backupCount=30)
-    file_handler.suffix = ps.LOG_FILE_SUFFIX
+        maxBytes=log_max_bytes,
+        backupCount=log_backups)
     file_handler.setLevel(level)
-    file_handler.setFormatter(format)
+    file_handler.setFormatter(JSONFormatter() if log_json else format)
+    if log_buffer > 1:
+        file_handler = BufferedHandler(file_handler, capacity=log_buffer)
+        file_handler.setLevel(level)
     log.addHandler(file_handler)
 
     # log only errors to console, unless enabled or log level is debug
@@ -39,8 +164,12 @@ def init_logger(log_path=ps.LOG_PATH,
     console_handler.setFormatter(format)
     log.addHandler(console_handler)
 
-    log.debug(f"""set logging properties:
-    log_path={log_path}
-    log_level={log_level}
-    log_format={log_format}
-    is_log_to_console={is_log_to_console}""")
+    log.debug("set logging properties: %s", LazyJSON({
+        "log_path": log_path,
+        "log_level": log_level,
+        "log_format": log_format,
+        "is_log_to_console": is_log_to_console,
+        "log_max_bytes": log_max_bytes,
+        "log_backups": log_backups,
+        "log_buffer": log_buffer,
+        "log_json": log_json}))
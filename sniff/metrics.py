@@ -0,0 +1,282 @@
+"""Per-stage timings, sizes and error counts, written as a Prometheus
+textfile (eg. for node_exporter's textfile collector) on tmpfs.
+
+Instrumented code calls the module functions (inc, set_gauge, observe,
+timer), which do nothing until configure() is called, so they're free
+when metrics are disabled. Counters and histograms accumulate across runs
+through a JSON state file next to the textfile.
+
+Example:
+    >>> from sniff import metrics
+    >>> metrics.configure("/tmp/sniff/metrics.prom")
+    >>> with metrics.timer("sniff_ubus_call_seconds", call="iwinfo scan"):
+    ...     wifi.results()
+    >>> metrics.inc("sniff_upload_errors_total", kind="timeout")
+    >>> metrics.summary()
+    {'ubus_call_ms': {'iwinfo scan': 12.1}, 'upload_errors': {'timeout': 1}}
+    >>> metrics.save()
+"""
+import json
+import logging as log
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any
+
+import sniff.params as ps
+
+BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HELP = {
+    "sniff_cycle_seconds": "scan and upload cycle duration",
+    "sniff_ubus_call_seconds": "ubus call duration",
+    "sniff_ubus_errors_total": "ubus calls that failed or timed out",
+    "sniff_parse_seconds": "time to parse a scan result into devices",
+    "sniff_collector_errors_total": "collectors that failed or timed out",
+    "sniff_devices": "devices in the last scan",
+    "sniff_devices_filtered_total": "devices dropped by device filters",
+    "sniff_churn": "share of devices that came or went since the last scan",
+    "sniff_schedule_interval_seconds": "seconds until the next scan",
+    "sniff_encode_seconds": "time to encode a body as JSON",
+    "sniff_http_connect_seconds": "time to connect to the API",
+    "sniff_http_ttfb_seconds": "time from sending a body to the response",
+    "sniff_http_request_seconds": "time to upload a body, in total",
+    "sniff_upload_bytes": "body size per upload, before and after encoding",
+    "sniff_upload_bytes_total": "bytes uploaded, before and after encoding",
+    "sniff_upload_responses_total": "API responses by HTTP status",
+    "sniff_upload_errors_total": "uploads that got no response",
+    "sniff_target_uploads_total": "uploads to each API, by result",
+    "sniff_target_upload_seconds": "time to upload a body to each API",
+    "sniff_target_queued": "bodies queued for each API after uploading",
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: str = ""):
+    parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _short(name: str):
+    """sniff_ubus_call_seconds -> ubus_call_ms, for the body summary"""
+    name = name[len("sniff_"):] if name.startswith("sniff_") else name
+    for suffix, short in (("_seconds", "_ms"), ("_total", "")):
+        if name.endswith(suffix):
+            return name[:-len(suffix)] + short
+    return name
+
+
+class Metrics():
+    """Counters, gauges and histograms keyed by name and labels.
+
+    `last` keeps each metric's latest value for summary(), a compact view
+    of the current cycle to attach to the upload body.
+    """
+
+    def __init__(self, path: str = ps.METRICS_PATH):
+        self.path = path
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.gauges: dict[str, dict[Labels, float]] = {}
+        # name -> labels -> [count per bucket..., sum, count]
+        self.histograms: dict[str, dict[Labels, list[float]]] = {}
+        self.buckets: dict[str, tuple[float, ...]] = {}
+        self.last: dict[str, dict[Labels, float]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def state_path(self):
+        return f"{self.path}.json"
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            last = self.last.setdefault(name, {})
+            last[key] = last.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+            self.last.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, buckets=BUCKETS_S, **labels):
+        key = _labels(labels)
+        with self._lock:
+            buckets = self.buckets.setdefault(name, tuple(buckets))
+            series = self.histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = [0] * (len(buckets) + 2)
+            for i, le in enumerate(buckets):
+                if value <= le:
+                    h[i] += 1
+                    break
+            h[-2] += value
+            h[-1] += 1
+            self.last.setdefault(name, {})[key] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start_s = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_s, **labels)
+
+    def start_cycle(self, *prefixes: str):
+        """Forget the last cycle's values of metrics starting with any of
+        `prefixes` (all of them by default), keeping the totals"""
+        with self._lock:
+            self.last = {name: series for name, series in self.last.items()
+                         if prefixes and not name.startswith(prefixes)}
+
+    def summary(self):
+        """{short name: {label values: last value}}, seconds in ms"""
+        summary: dict[str, Any] = {}
+        with self._lock:
+            for name, series in self.last.items():
+                is_seconds = name.endswith("_seconds")
+                values = {}
+                for key, value in series.items():
+                    label = " ".join(v for _, v in key) or "value"
+                    values[label] = round(value * 1000, 1) if is_seconds \
+                        else value
+                summary[_short(name)] = values["value"] \
+                    if list(values) == ["value"] else values
+        return summary
+
+    def render(self):
+        """The metrics in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters),
+                                  ("gauge", self.gauges),
+                                  ("histogram", self.histograms)):
+                for name in sorted(metrics):
+                    if name in HELP:
+                        lines.append(f"# HELP {name} {HELP[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(metrics[name].items()):
+                        if kind != "histogram":
+                            lines.append(f"{name}{_fmt_labels(key)} {value}")
+                            continue
+                        cumulative = 0
+                        for le, n in zip(self.buckets[name], value):
+                            cumulative += n
+                            le_label = _fmt_labels(key, f'le="{le}"')
+                            lines.append(
+                                f"{name}_bucket{le_label} {cumulative}")
+                        inf_label = _fmt_labels(key, 'le="+Inf"')
+                        lines.append(f"{name}_bucket{inf_label} {value[-1]}")
+                        lines.append(
+                            f"{name}_sum{_fmt_labels(key)} {value[-2]}")
+                        lines.append(
+                            f"{name}_count{_fmt_labels(key)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def load(self):
+        """Carry counters and histograms over from previous runs"""
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning(f"ignoring bad metrics state '{self.state_path}': "
+                        f"{e}")
+            return
+        with self._lock:
+            for attr in ("counters", "gauges", "histograms", "last"):
+                setattr(self, attr, {
+                    name: {_labels(labels): value
+                           for labels, value in series}
+                    for name, series in state.get(attr, {}).items()})
+            self.buckets = {name: tuple(b) for name, b
+                            in state.get("buckets", {}).items()}
+
+    def save(self):
+        """Write the textfile and the state atomically"""
+        if not self.path:
+            return
+        text = self.render()
+        with self._lock:
+            state = {attr: {name: [[dict(k), v] for k, v in series.items()]
+                            for name, series in getattr(self, attr).items()}
+                     for attr in ("counters", "gauges", "histograms",
+                                  "last")}
+            state["buckets"] = self.buckets
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            for path, data in ((self.state_path, json.dumps(state)),
+                               (self.path, text)):
+                with open(f"{path}.tmp", "w") as f:
+                    f.write(data)
+                os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            log.warning(f"couldn't write metrics '{self.path}': {e}")
+
+
+_METRICS: Metrics = None
+_NULL_TIMER = nullcontext()
+
+
+def configure(path: str = ps.METRICS_PATH, is_loaded=True):
+    """Start recording metrics, to be written to `path` by save()."""
+    global _METRICS
+    _METRICS = Metrics(path)
+    if is_loaded:
+        _METRICS.load()
+    return _METRICS
+
+
+def disable():
+    global _METRICS
+    _METRICS = None
+
+
+def get():
+    return _METRICS
+
+
+def inc(name: str, value: float = 1, **labels):
+    if _METRICS is not None:
+        _METRICS.inc(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if _METRICS is not None:
+        _METRICS.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, buckets=BUCKETS_S, **labels):
+    if _METRICS is not None:
+        _METRICS.observe(name, value, buckets, **labels)
+
+
+def timer(name: str, **labels):
+    if _METRICS is None:
+        return _NULL_TIMER
+    return _METRICS.timer(name, **labels)
+
+
+def start_cycle(*prefixes: str):
+    if _METRICS is not None:
+        _METRICS.start_cycle(*prefixes)
+
+
+def summary():
+    return _METRICS.summary() if _METRICS is not None else {}
+
+
+def save():
+    if _METRICS is not None:
+        _METRICS.save()
@@ -0,0 +1,258 @@
+import json
+import logging as log
+import os
+import random
+import time
+import uuid
+from typing import Any, Callable, Iterable, Union
+
+import sniff.params as ps
+from sniff.stream import JSONFiles, iter_encode
+
+_SUFFIX = ".json"
+_TMP_SUFFIX = ".tmp"
+_STATE_FILE = "state.json"
+_ACKED_FILE = "acked.log"
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path: str, data: Union[bytes, Iterable[bytes]]):
+    tmp_path = path + _TMP_SUFFIX
+    with open(tmp_path, "wb") as f:
+        if isinstance(data, bytes):
+            f.write(data)
+        else:
+            f.writelines(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def is_permanent(error: Exception):
+    """Whether retrying a failed upload can't help, eg. HTTP 400."""
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and 400 <= code < 500 \
+        and code not in (408, 429)
+
+
+class Outbox():
+    """Durable, size-bounded queue of bodies waiting to be uploaded.
+
+    Each body is one file, written atomically, so a crash never leaves a
+    half-written item. drain() uploads the oldest items first in batches and
+    backs off exponentially after a failure. Each item has an id in its
+    file name (the body's "id" if it has one, see --body-id); names of
+    uploaded items are logged before their files are deleted, so an item
+    isn't sent twice if sniff dies between the upload and the delete.
+    Bodies are queued as they are, nothing is added to them.
+
+    Example:
+        >>> from sniff.outbox import Outbox
+        >>> outbox = Outbox("/tmp/sniff/outbox")
+        >>> outbox.put(body)
+        '0f8fad5bd9cb469fa16570867728950e'
+        >>> outbox.drain(lambda data: sender.post_data(data, url, headers))
+        1
+    """
+    DEFAULT_PATH = ps.OUTBOX_PATH
+
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 max_items: int = ps.OUTBOX_MAX_ITEMS,
+                 max_bytes: int = ps.OUTBOX_MAX_BYTES,
+                 batch_size: int = ps.OUTBOX_BATCH_SIZE,
+                 backoff_s: float = ps.OUTBOX_BACKOFF_S,
+                 max_backoff_s: float = ps.OUTBOX_MAX_BACKOFF_S):
+        self.path = path
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.batch_size = max(1, batch_size)
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, name: str):
+        return os.path.join(self.path, name)
+
+    def items(self):
+        """Queued item file names and sizes, oldest first."""
+        items = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(_SUFFIX) and entry.name != _STATE_FILE:
+                try:
+                    items.append((entry.name, entry.stat().st_size))
+                except FileNotFoundError:
+                    continue
+        return sorted(items)
+
+    def __len__(self):
+        return len(self.items())
+
+    def put(self, body: dict[str, Any]):
+        """Queue a body, dropping the oldest items if over the limits.
+
+        Returns its item id (the body's "id", if it has one), or None if
+        the body alone is over `max_bytes` and wasn't queued (the backlog
+        is kept).
+        """
+        item_id = body.get("id") or uuid.uuid4().hex
+        name = f"{time.time_ns():020d}-{item_id}{_SUFFIX}"
+        _write_atomic(self._path(name), iter_encode(body))
+        size = os.path.getsize(self._path(name))
+        if size > self.max_bytes:
+            self._unlink(name)
+            log.error(f"not queueing a {size} byte body, over the outbox's \
+                      {self.max_bytes} bytes.")
+            return None
+        _fsync_dir(self.path)
+        self._trim()
+        return item_id
+
+    def _trim(self):
+        items = self.items()
+        total_bytes = sum(size for _, size in items)
+        dropped = 0
+        while items and (len(items) > self.max_items
+                         or total_bytes > self.max_bytes):
+            name, size = items.pop(0)
+            self._unlink(name)
+            total_bytes -= size
+            dropped += 1
+        if dropped:
+            log.warning(f"outbox full, dropped {dropped} oldest item(s).")
+
+    def _unlink(self, name: str):
+        try:
+            os.unlink(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def _read_state(self):
+        try:
+            with open(self._path(_STATE_FILE), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"failures": 0, "next_s": 0}
+
+    def _write_state(self, failures: int, next_s: float):
+        _write_atomic(self._path(_STATE_FILE),
+                      json.dumps({"failures": failures,
+                                  "next_s": next_s}).encode())
+
+    def _read_acked(self):
+        try:
+            with open(self._path(_ACKED_FILE), "r") as f:
+                return set(f.read().split())
+        except OSError:
+            return set()
+
+    def _ack(self, names: list[str]):
+        """Log names as delivered, then delete their files."""
+        with open(self._path(_ACKED_FILE), "a") as f:
+            f.write("".join(f"{name}\n" for name in names))
+            f.flush()
+            os.fsync(f.fileno())
+        for name in names:
+            self._unlink(name)
+
+    def _is_readable(self, name: str):
+        """Whether an item can be sent, else drop it"""
+        try:
+            if os.path.getsize(self._path(name)):
+                return True
+            error = "empty file"
+        except OSError as e:
+            error = e
+        log.error(f"dropping unreadable outbox item {name}: {error}")
+        self._unlink(name)
+        return False
+
+    def _backoff(self, failures: int):
+        delay_s = min(self.max_backoff_s,
+                      self.backoff_s * 2 ** (failures - 1))
+        return delay_s * random.uniform(0.5, 1)
+
+    def drain(self,
+              post: Callable[[Any], tuple[Exception, Any]],
+              is_out_of_time: Callable[[], bool] = None):
+        """Upload queued items oldest first, `batch_size` per call to
+        post(data), until empty, a post fails or is_out_of_time() before a
+        batch (those wait for the next drain). A batch of one is posted
+        as the body itself, otherwise as a list of bodies. Bodies are
+        posted as JSONFiles, read from disk as they're sent.
+
+        An item the API rejects for good (eg. 400) is dropped. A rejected
+        batch is retried one item at a time first, since the API may only
+        object to the list or its size, not the bodies.
+
+        Returns the number of items delivered.
+        """
+        state = self._read_state()
+        if time.time() < state["next_s"]:
+            log.info(f"outbox backing off for \
+                     {round(state['next_s'] - time.time())}s more.")
+            return 0
+
+        # drop items that were delivered just before a crash
+        acked = self._read_acked()
+        items = []
+        for name, _ in self.items():
+            if name in acked:
+                self._unlink(name)
+            else:
+                items.append(name)
+        self._unlink(_ACKED_FILE)
+
+        sent = 0
+        alone = 0  # items to post one at a time, from a rejected batch
+        while items:
+            if is_out_of_time is not None and is_out_of_time():
+                log.warning(f"out of time, {len(items)} outbox item(s) \
+                            left for the next run.")
+                break
+            size = 1 if alone else self.batch_size
+            batch, items = items[:size], items[size:]
+            alone = max(0, alone - len(batch))
+            batch = [name for name in batch if self._is_readable(name)]
+            if not batch:
+                continue
+
+            error, _ = post(JSONFiles([self._path(name) for name in batch]))
+            if error is not None and not is_permanent(error):
+                failures = state["failures"] + 1
+                delay_s = self._backoff(failures)
+                self._write_state(failures, time.time() + delay_s)
+                log.warning(f"upload failed ({error}), \
+                            {len(items) + len(batch)} item(s) queued, \
+                            retrying in {round(delay_s)}s.")
+                return sent
+            if error is not None and len(batch) > 1:
+                log.warning(f"API rejected a batch of {len(batch)} outbox \
+                            items ({error}), retrying them one at a time.")
+                items = batch + items
+                alone = len(batch)
+                continue
+            if error is not None:
+                log.error(f"dropping outbox item {batch[0]} rejected by \
+                          the API: {error}")
+            else:
+                sent += len(batch)
+            self._ack(batch)
+
+        if state["failures"] and (sent or not items):
+            self._write_state(0, 0)
+        if sent:
+            log.info(f"delivered {sent} outbox item(s).")
+        return sent
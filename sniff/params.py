@@ -2,37 +2,108 @@ import os
 # from ubus import reader
 # from typing import Any
 
+# nothing here may touch the filesystem, since every run imports it
 
-def make_file(file: str, dir="/var/log", dir_backup="/tmp/log"):
-    """try default logging location or create one if not exists."""
-    try:
-        path = os.path.join(dir, file)
-        open(path, "w").close()
-        return path
-    except PermissionError:
-        path = make_file(file, dir=dir_backup)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        return path
 
+def get_log_path(file: str, dirs=("/tmp/log", "/var/log")):
+    """first of `dirs` that is (or can be made) writable, joined with file"""
+    for dir in dirs:
+        try:
+            os.makedirs(dir, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(dir, os.W_OK):
+            return os.path.join(dir, file)
+    return os.path.join(dirs[-1], file)
 
-LOG_PATH = make_file(f"{__package__}.log")
+
+LOG_FILE = f"{__package__}.log"
+LOG_PATH = ""  # get_log_path(LOG_FILE) when the logger starts
 LOG_LEVEL = "INFO"
 
 PATH_ETC_CONFIG_SYSTEM = "/etc/config/system"
+CONFIG_PATH = "/etc/sniff/config.ini"  # written only with --write-config
+PATH_FW_VERSION = "/etc/version"
+PATH_BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+ROUTER_CACHE_PATH = "/tmp/sniff/router.json"
+ROUTER_CACHE_TTLS_S = {
+    "mnf": 7 * 24 * 3600,
+    "fw": 24 * 3600,
+    "hostname": 3600,
+    "timezone": 3600,
+}
 
 IS_LOG_TO_CONSOLE = False
 
+DAEMON_INTERVAL_S = 60
+CYCLE_BUDGET_S = 50  # a cron run should be done before the next minute
+CYCLE_GRACE_S = 5  # past the budget, before the watchdog exits
+UPLOAD_RESERVE_S = 10  # of the budget, kept for uploading
+MIN_UPLOAD_TIMEOUT_S = 1  # even out of budget, an upload gets this long
+LOCK_PATH = "/tmp/sniff/sniff.lock"
+LOCK_GRACE_S = 5  # for a preempted run to exit
+
+UBUS_TRANSPORT = "auto"
+UBUS_SOCKET_PATHS = ("/var/run/ubus/ubus.sock", "/var/run/ubus.sock")
+UBUS_TIMEOUT_S = 30
+COLLECTOR_TIMEOUT_S = 20
+STREAM_CHUNK_BYTES = 16384  # read from ubus and sent to the API at once
+
 LOG_FORMAT = r"%(asctime)s %(levelname)s - %(message)s [%(funcName)s() %(filename)s:%(lineno)d]"  # noqa
-LOG_FILE_SPLIT_WHEN = "midnight"
-LOG_FILE_SUFFIX = "%Y-%m-%d"
+LOG_MAX_BYTES = 262144  # rotated at this size
+LOG_BACKUPS = 2  # rotated files kept
+LOG_BUFFER_RECORDS = 200  # held in memory before writing
+LOG_FLUSH_S = 60  # most a record is held before writing, eg. in --daemon
 
 # DATA_SENDER_CONFIG = reader.parse_config_file(DATA_SENDER_CONFIG_PATH)
 # DATA_SENDER: dict[str, Any] = DATA_SENDER_CONFIG.get("output 2", {})
 
+OUTBOX_PATH = "/tmp/sniff/outbox"
+OUTBOX_MAX_ITEMS = 1440  # a day of scans, once a minute
+OUTBOX_MAX_BYTES = 4 * 1024 * 1024
+OUTBOX_BATCH_SIZE = 1  # more posts a JSON list, if the API accepts it
+OUTBOX_BACKOFF_S = 30
+OUTBOX_MAX_BACKOFF_S = 30 * 60
+
+PRESENCE_PATH = "/tmp/sniff/presence.json"
+PRESENCE_EXIT_MISSES = 3
+PRESENCE_RSSI_DELTA = 10
+PRESENCE_KEYFRAME_S = 15 * 60
+
+METRICS_PATH = "/tmp/sniff/metrics.prom"
+
+HISTORY_PATH = "/tmp/sniff/history.bin"
+HISTORY_RECORDS = 131072  # 16 bytes each, 2 MiB
+
+SCHEDULE_PATH = "/tmp/sniff/schedule.json"
+SCHEDULE_MIN_INTERVAL_S = 60
+SCHEDULE_MAX_INTERVAL_S = 15 * 60
+SCHEDULE_MIN_BLE_WAIT_S = 3
+SCHEDULE_CHURN_THRESHOLD = 0.2  # share of devices that came or went
+SCHEDULE_GROWTH = 1.5
+SCHEDULE_EARLY_S = 5  # cron starts a little late or early
+
+# sniff-receiver, the server end
+RECEIVER_HOST = "127.0.0.1"
+RECEIVER_PORT = 8080
+RECEIVER_DB_PATH = "sniff.db"
+RECEIVER_MAX_PENDING = 1000  # requests waiting to be written, then 503
+RECEIVER_MAX_BATCH = 500  # requests per transaction
+RECEIVER_MAX_BODY_BYTES = 16 * 1024 * 1024
+RECEIVER_RETRY_AFTER_S = 30
+
 DATA_SENDER_CONFIG_PATH = "/etc/config/data_sender"
+UCI_CACHE_DIR = "/tmp/sniff/uci"  # parsed config files
 DEFAULT_API_HEADERS = "content-type: text/plain; charset=utf-8"
 DEFAULT_QUERY_API_URL = "**/http_host"
 DEFAULT_QUERY_API_HEADERS = "**/http_header"
+API_TIMEOUT_S = 30
+API_CONNECT_TIMEOUT_S = 10
+API_COMPRESSION = "none"
+API_COMPRESS_LEVEL = 6
+API_COMPRESS_MIN_BYTES = 1024
+API_MAX_IDLE_S = 50  # reconnect rather than reuse a connection idle this long
 API_URL = os.environ.get("BLE_API_URL")
 API_HEADER = os.environ.get("BLE_API_HEADER")
 # data_header = DATA_SENDER.get("http_header")
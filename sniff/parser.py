@@ -1,40 +1,114 @@
-from typing import Any
+import logging as log
+from typing import Any, Callable, Iterable
+
+from sniff import metrics
+from sniff.device import Device, dedupe, mac_to_int
+from sniff.filters import DeviceFilter
+
+# of bluetooth devices, "public"/"random" (or 0/1) where it's reported
+ADDRESS_TYPE_KEYS = ("address_type", "addr_type")
 
 
 def default_scan_parser(scan_results_obj: Any, **kwargs):
     return scan_results_obj
 
 
-def wifi_device_parser(ubus_iwinfo_device_obj: dict[str, Any]):
+def wifi_band(channel: int, mhz: int = 0):
+    """OpenWrt's name for a channel's band ('2g', '5g' or '6g'), from its
+    frequency if iwinfo reported one"""
+    if mhz:
+        return "2g" if mhz < 3000 else "5g" if mhz < 5925 else "6g"
+    return "2g" if channel <= 14 else "5g"
+
+
+def wifi_device_parser(ubus_iwinfo_device_obj: dict[str, Any],
+                       keep: DeviceFilter = None):
     """Defines how to handle a single wifi device in a list of results from:
     ubus call iwinfo scan '{"device": "wlan1"}'
+    None if `keep` filters it out.
     """
     d = ubus_iwinfo_device_obj
-    return {
-        "quality": round(d.get("quality", 0)/d.get("quality_max", 70), 2),
-        "rssi": d.get("signal", -99),
-        "host": d.get("ssid", ""),
-        "mac": d["bssid"],    # required, else Exception
-    }
+    rssi = d.get("signal", -99)
+    if keep is not None and rssi < keep.min_rssi:
+        return None
+    key = mac_to_int(d["bssid"])  # required, else Exception
+    host = d.get("ssid", "")
+    if keep is not None and not keep.keeps(key, host):
+        return None
+    channel = d.get("channel")
+    return Device(
+        key,
+        rssi,
+        host,
+        round(d.get("quality", 0)/d.get("quality_max", 70), 2),
+        (channel,) if channel else None,
+        (wifi_band(channel, d.get("mhz", 0)),) if channel else None,
+    )
+
 
+def _is_random(ubus_ble_device_obj: dict[str, Any]):
+    """Whether a bluetooth address is random by its address type, or None
+    if the scan doesn't say (blesem's scan.result doesn't, so far)."""
+    for key in ADDRESS_TYPE_KEYS:
+        address_type = ubus_ble_device_obj.get(key)
+        if address_type is not None:
+            return str(address_type).lower() in ("random", "1", "true")
+    return None
 
-def ble_device_parser(ubus_ble_device_obj: dict[str, Any]):
+
+def ble_device_parser(ubus_ble_device_obj: dict[str, Any],
+                      keep: DeviceFilter = None):
     """Defines how to handle a single bluetooth device in a results list from:
    ubus call blesem scan.start
    ubus call blesem scan.result
+   None if `keep` filters it out.
     """
     d = ubus_ble_device_obj
-    return {
-        "rssi": d.get("rssi", -99),
-        "host": d.get("name", ""),
-        "mac": d["address"],  # required, else Exception
-    }
+    rssi = d.get("rssi", -99)
+    if keep is not None and rssi < keep.min_rssi:
+        return None
+    key = mac_to_int(d["address"])  # required, else Exception
+    host = d.get("name", "")
+    if keep is not None and not keep.keeps(key, host, _is_random(d)):
+        return None
+    return Device(key, rssi, host)
+
+
+def parse_devices(device_objs: Iterable[dict[str, Any]],
+                  device_parser: Callable[..., Device],
+                  keep: DeviceFilter = None):
+    """Parse each device, skipping ones without a valid MAC or filtered out
+    by `keep`, and keep one per MAC."""
+    devices = []
+    name = device_parser.__name__
+    with metrics.timer("sniff_parse_seconds", parser=name):
+        n_filtered = 0
+        for obj in device_objs:
+            try:
+                device = device_parser(obj, keep) if keep \
+                    else device_parser(obj)
+            except (KeyError, ValueError) as e:
+                log.debug("skipping device without a valid MAC (%s): %s",
+                          e, obj)
+                continue
+            if device is None:
+                n_filtered += 1
+                continue
+            devices.append(device)
+        if n_filtered:
+            log.debug("%s filtered out %d devices.", name, n_filtered)
+            metrics.inc("sniff_devices_filtered_total", n_filtered,
+                        parser=name)
+        return dedupe(devices)
 
 
 def wifi_scan_parser(scan_result_obj: dict[str, list[dict[str, Any]]],
-                     device_parser=wifi_device_parser):
+                     device_parser=wifi_device_parser,
+                     keep: DeviceFilter = None):
     """Defines how to handle results of command:
     ubus call iwinfo scan '{"device": "wlan1"}'
+    or of several radios' scans, concatenated. A BSSID seen by more than
+    one radio keeps its best signal and every channel it was seen on.
 
     Example:
         >>> from sniff.parser import wifi_scan_parser
@@ -57,13 +131,17 @@ def wifi_scan_parser(scan_result_obj: dict[str, list[dict[str, Any]]],
         ...             'authentication': ['psk', 'sae', 'none'],
         ...             'ciphers': ['tkip', 'ccmp', 'gcmp', 'wrap', 'ckip']}}]}
         >>> wifi_scan_parser(scan_result_obj)
-
+        [Device({'quality': 1.0, 'rssi': -27, 'host': 'My Internet',
+                 'mac': '02:BD:89:0F:A1:75', 'channels': [149],
+                 'bands': ['5g']})]
     """
-    return [device_parser(d) for d in scan_result_obj.get("results", [])]
+    return parse_devices(scan_result_obj.get("results", []), device_parser,
+                         keep)
 
 
 def ble_scan_parser(scan_result_obj: dict[str, list[dict[str, Any]]],
-                    device_parser=ble_device_parser):
+                    device_parser=ble_device_parser,
+                    keep: DeviceFilter = None):
     """Defines how to handle results of command:
     ubus call blesem scan.result
 
@@ -78,10 +156,12 @@ def ble_scan_parser(scan_result_obj: dict[str, list[dict[str, Any]]],
         ...              'rssi': -74,
         ...              'address': 'F4:CE:36:AD:62:91'}]}
         >>> ble_scan_parser(scan_result_obj)
-        [{'rssi': -61, 'host': '', 'mac': '6C:FC:DE:B0:EE:16'},
-         {'rssi': -74, 'host': 'Front Door', 'mac': 'F4:CE:36:AD:62:91'}]
+        [Device({'rssi': -61, 'host': '', 'mac': '6C:FC:DE:B0:EE:16'}),
+         Device({'rssi': -74, 'host': 'Front Door',
+                 'mac': 'F4:CE:36:AD:62:91'})]
     """
-    return [device_parser(d) for d in scan_result_obj.get("devices", [])]
+    return parse_devices(scan_result_obj.get("devices", []), device_parser,
+                         keep)
 
 
 def fw_scan_parser(scan_result_obj: dict[str, str], **kwargs):
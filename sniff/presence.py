@@ -0,0 +1,144 @@
+import json
+import logging as log
+import os
+import time
+from typing import Any
+
+import sniff.params as ps
+from sniff.device import Device, int_to_mac, mac_to_int
+
+ENTER = "enter"
+UPDATE = "update"
+EXIT = "exit"
+
+
+class PresenceTracker():
+    """Track which devices are present across scans and report only what
+    changed: enter, update and exit events per device, keyed by its MAC
+    as a 48-bit int (see sniff.device).
+
+    A device exits after missing `exit_after_misses` scans in a row, and
+    updates only when its RSSI moved at least `rssi_delta` since the last
+    event. Every `keyframe_s` the full device lists are sent as well.
+    State is kept in memory, and in a compact file at `path` between runs
+    (path=None for memory only, eg. in --daemon mode).
+
+    Example:
+        >>> from sniff.presence import PresenceTracker
+        >>> from sniff.device import Device
+        >>> tracker = PresenceTracker(path=None, exit_after_misses=2)
+        >>> tracker.update("ble", [Device(0xA, -60)])
+        [{'event': 'enter', 'rssi': -60, 'host': '',
+          'mac': '00:00:00:00:00:0A'}]
+        >>> tracker.update("ble", [])
+        []
+        >>> tracker.update("ble", [])
+        [{'event': 'exit', 'mac': '00:00:00:00:00:0A',
+          'last_seen_s': 1708650100}]
+    """
+    DEFAULT_PATH = ps.PRESENCE_PATH
+    SECTIONS = ("wifi", "ble")
+
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 exit_after_misses: int = ps.PRESENCE_EXIT_MISSES,
+                 rssi_delta: int = ps.PRESENCE_RSSI_DELTA,
+                 keyframe_s: float = ps.PRESENCE_KEYFRAME_S):
+        self.path = path
+        self.exit_after_misses = max(1, exit_after_misses)
+        self.rssi_delta = rssi_delta
+        self.keyframe_s = keyframe_s
+        # section -> key -> [rssi last sent, scans missed, last seen]
+        self.devices: dict[str, dict[int, list]] = \
+            {s: {} for s in self.SECTIONS}
+        self.keyframe_at_s = 0.0
+        self.load()
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            self.keyframe_at_s = state["keyframe_at_s"]
+            for section in self.SECTIONS:
+                self.devices[section] = {
+                    mac_to_int(mac): s
+                    for mac, s in state.get(section, {}).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            log.warning(f"ignoring bad presence state '{self.path}': {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"keyframe_at_s": self.keyframe_at_s,
+                           **{section: {int_to_mac(key): s
+                                        for key, s in known.items()}
+                              for section, known in self.devices.items()}},
+                          f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"couldn't write presence state '{self.path}': {e}")
+
+    def is_keyframe_due(self, now_s: float = None):
+        now_s = now_s or time.time()
+        return now_s - self.keyframe_at_s >= self.keyframe_s
+
+    def update(self,
+               section: str,
+               devices: list[Device],
+               now_s: float = None):
+        """Record one scan's devices and return the events it caused."""
+        now_s = int(now_s or time.time())
+        known = self.devices[section]
+        events = []
+        seen = set()
+        for d in devices:
+            seen.add(d.key)
+            state = known.get(d.key)
+            if state is None:
+                known[d.key] = [d.rssi, 0, now_s]
+                events.append({"event": ENTER, **d.to_dict()})
+                continue
+            state[1], state[2] = 0, now_s
+            if abs(d.rssi - state[0]) >= self.rssi_delta:
+                state[0] = d.rssi
+                events.append({"event": UPDATE, **d.to_dict()})
+
+        for key in [k for k in known if k not in seen]:
+            state = known[key]
+            state[1] += 1
+            if state[1] >= self.exit_after_misses:
+                del known[key]
+                events.append({"event": EXIT,
+                               "mac": int_to_mac(key),
+                               "last_seen_s": state[2]})
+        return events
+
+    def apply(self, body: dict[str, Any], skip: tuple[str, ...] = ()):
+        """Replace the body's device lists with presence events, except on
+        keyframes, which keep the full lists too.
+
+        Sections in `skip` (eg. a scan that failed) don't count as misses.
+        """
+        now_s = time.time()
+        is_keyframe = self.is_keyframe_due(now_s)
+        presence = {"keyframe": is_keyframe}
+        for section in self.SECTIONS:
+            presence[section] = [] if section in skip \
+                else self.update(section, body[section], now_s)
+            if not is_keyframe:
+                body[section] = []
+        if is_keyframe:
+            self.keyframe_at_s = now_s
+        body["presence"] = presence
+        log.info(f"presence: keyframe={is_keyframe}, " + ", ".join(
+            f"{s}={len(presence[s])} events" for s in self.SECTIONS))
+        self.save()
+        return body
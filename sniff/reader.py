@@ -1,23 +1,102 @@
-import logging as log
 import json
-from typing import Any
-from dpath import util
+import logging as log
+import os
+import shlex
+from typing import Any, Iterable
 
 import sniff.params as ps
+from sniff.logger import LazyJSON
+
+Config = dict[str, dict[str, Any]]
+# key -> [(section, key), ...] in file order
+Index = dict[str, list[tuple[str, str]]]
+
+
+def parse_uci(lines: Iterable[str]):
+    """Parse UCI config lines into {"<type> <name>": {option: value}}.
+
+    Values may be quoted with ' or " (or not at all), `#` starts a comment,
+    and `list` options collect into lists. Anonymous sections are named
+    like uci does, eg. "@output[0]".
+
+    Example:
+        >>> from sniff.reader import parse_uci
+        >>> parse_uci(["config output '2'  # comment",
+        ...            "  option http_host 'https://a.com/#x'",
+        ...            "  list http_header 'x-api-key: abc'"])
+        {'output 2': {'__type__': 'output', '__name__': '2',
+                      'http_host': 'https://a.com/#x',
+                      'http_header': ['x-api-key: abc']}}
+    """
+    config: Config = {}
+    section = None
+    anonymous: dict[str, int] = {}
+    for n, line in enumerate(lines, 1):
+        try:
+            words = shlex.split(line, comments=True)
+        except ValueError as e:
+            log.warning(f"skipping bad UCI line {n} ({e}): {line.strip()}")
+            continue
+        if not words:
+            continue
+        keyword, args = words[0], words[1:]
+        if keyword == "config" and args:
+            block_type = args[0]
+            if len(args) > 1:
+                block_name = args[1]
+            else:
+                i = anonymous[block_type] = anonymous.get(block_type, -1) + 1
+                block_name = f"@{block_type}[{i}]"
+            section = config[f"{block_type} {block_name}"] = {
+                "__type__": block_type, "__name__": block_name}
+        elif keyword in ("option", "list") and section is not None \
+                and args:
+            key, value = args[0], " ".join(args[1:])
+            if keyword == "option":
+                section[key] = value
+            else:
+                section.setdefault(key, []).append(value)
+    return config
+
+
+def index_uci(config: Config):
+    """Map each option key to the sections it's in, for direct lookups"""
+    index: Index = {}
+    for section, options in config.items():
+        for key in options:
+            index.setdefault(key, []).append((section, key))
+    return index
+
+
+def _cache_path(path: str):
+    name = os.path.abspath(path).strip("/").replace("/", "_")
+    return os.path.join(ps.UCI_CACHE_DIR, f"{name}.json")
 
 
 class DataSenderReader():
-    """Parse and search Teltonika Data to Server config file"""
+    """Parse and search Teltonika Data to Server config file.
+
+    The parsed config is cached in memory and on tmpfs, keyed by the file's
+    path, mtime and size, so it's only parsed again after it changes.
+    Searches for a key anywhere ("**/key") or in one section are direct
+    lookups; other dpath globs fall back to searching the whole tree.
+    """
     DEFAULT_PATH = ps.DATA_SENDER_CONFIG_PATH  # eg. /etc/config/data_sender
     DEFAULT_HTTP_HOST_KEY = ps.DEFAULT_QUERY_API_URL  # eg. **/http_host
+    # path -> (mtime and size, config, index), shared by readers
+    _parsed: dict[str, tuple[list[int], Config, Index]] = {}
 
-    def __init__(self, filepath=DEFAULT_PATH):
+    def __init__(self, filepath=DEFAULT_PATH, is_cached=True):
         err = None
         self.path = filepath
-        self.config = None
+        self.config: Config = None
+        self.index: Index = {}
+        self.is_cached = is_cached
         log.info(f"reading config file '{filepath}'...")
         try:
-            open(filepath, 'r')
+            os.stat(filepath)
+            if not os.access(filepath, os.R_OK):
+                raise PermissionError("permission denied")
         except FileNotFoundError:
             err = f"no such Data To Server config file '{filepath}'"
         except IOError as e:
@@ -26,14 +105,45 @@ class DataSenderReader():
         if err:
             raise FileNotFoundError(err)
 
+    def _load_cache(self, path: str, stat_key: list[int]):
+        parsed = self._parsed.get(path)
+        if parsed is not None and parsed[0] == stat_key:
+            return parsed[1], parsed[2]
+        try:
+            with open(_cache_path(path), "r") as f:
+                cached = json.load(f)
+            if cached["path"] == os.path.abspath(path) \
+                    and cached["stat"] == stat_key:
+                index = {k: [tuple(loc) for loc in locs]
+                         for k, locs in cached["index"].items()}
+                return cached["config"], index
+        except (OSError, ValueError, KeyError):
+            pass
+        return None, None
+
+    def _save_cache(self, path: str, stat_key: list[int]):
+        self._parsed[path] = (stat_key, self.config, self.index)
+        cache_path = _cache_path(path)
+        tmp_path = f"{cache_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"path": os.path.abspath(path),
+                           "stat": stat_key,
+                           "config": self.config,
+                           "index": self.index}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            log.debug("couldn't cache parsed '%s': %s", path, e)
+
     def parse(self, path=None):
-        """_summary_
+        """Parse the config file, or reuse it parsed if it hasn't changed.
 
         Args:
-            filepath (_type_): _description_
+            path (str, optional): file to parse instead of self.path.
 
         Returns:
-            _type_: _description_
+            dict: {"<type> <name>": {option: value}} for each section.
 
         Example:
             >>> from sniff.reader import DataSenderReader
@@ -99,50 +209,63 @@ class DataSenderReader():
                 }
             }
         """  # noqa
-        config_data: dict[str, Any] = {}
-        current_block = None
         filepath = path or self.path
+        st = os.stat(filepath)
+        stat_key = [st.st_mtime_ns, st.st_size]
+        if self.is_cached:
+            config, index = self._load_cache(filepath, stat_key)
+            if config is not None:
+                log.debug("using cached parse of '%s'.", filepath)
+                self.config, self.index = config, index
+                return config
 
-        log.info(f"parsing Data to Server config: {self.path}")
+        log.info(f"parsing Data to Server config: {filepath}")
         with open(filepath, 'r') as file:
-            for line in file:
-                line = line.strip()
-                if line.startswith('config'):
-                    parts = line.split()
-                    # Handles cases like "config settings 'settings'"
-                    block_type, block_name = parts[1], parts[2].strip("'")
-                    current_block = f"{block_type} {block_name}"
-                    config_data[current_block] = {
-                        '__type__': block_type, '__name__': block_name}
-                elif line.startswith('option'):
-                    if current_block is not None:
-                        parts = line.split()
-                        option_key = parts[1]
-                        option_value = ' '.join(parts[2:]).strip("'")
-                        config_data[current_block][option_key] = option_value
-                elif line.startswith('list'):
-                    if current_block is not None:
-                        parts = line.split()
-                        list_key = parts[1]
-                        list_value = ' '.join(parts[2:]).strip("'")
-                        if list_key not in config_data[current_block]:
-                            config_data[current_block][list_key] = []
-                        config_data[current_block][list_key].append(list_value)
-
-        log.debug(f"got config file:\n{json.dumps(config_data, indent=4)}")
+            config_data = parse_uci(file)
+
+        log.debug("got config file:\n%s", LazyJSON(config_data))
         log.info("done.")
         self.config = config_data
+        self.index = index_uci(config_data)
+        if self.is_cached:
+            self._save_cache(filepath, stat_key)
 
         return config_data
 
+    def _lookup(self, query: str):
+        """Matches for "**/key", "*/key", "<type> */key" and
+        "<section>/key" from the index, or None if the query needs a glob
+        search."""
+        parts = query.strip("/").split("/")
+        if len(parts) != 2 or any(c in parts[1] for c in "*?[]"):
+            return None
+        section, key = parts
+        if section in self.config:
+            options = self.config[section]
+            return [(query, options[key])] if key in options else []
+        if section in ("**", "*"):
+            return [(f"{s}/{k}", self.config[s][k])
+                    for s, k in self.index.get(key, [])]
+        block_type, _, name = section.partition(" ")
+        if name == "*" and not any(c in block_type for c in "*?[]"):
+            return [(f"{s}/{k}", self.config[s][k])
+                    for s, k in self.index.get(key, [])
+                    if self.config[s]["__type__"] == block_type]
+        if not any(c in section for c in "*?[]"):
+            return []
+        return None
+
     def search(self, dpath_query=DEFAULT_HTTP_HOST_KEY):
         """Search the Teltonika Data to Server for a specific key
 
         Args:
-            dpath_query (_type_, optional): _description_. Defaults to DEFAULT_HTTP_HOST_KEY.
+            dpath_query (str, optional): eg. "**/http_host" for the key in
+                any section, "output 2/http_host" for one section, or any
+                dpath glob. Defaults to DEFAULT_HTTP_HOST_KEY.
 
         Returns:
-            _type_: _description_
+            The value of the last match (str, or list for `list` options),
+            or "" if there's none.
 
         Example:
             >>> from sniff.reader import DataSenderReader
@@ -153,21 +276,34 @@ class DataSenderReader():
             'https://nfo0uh35ye.execute-api.us-east-2.amazonaws.com/'
 
         """  # noqa
-        value = ""
+        values = self.search_all(dpath_query)
+        if len(values) > 1:
+            log.warning(f"{len(values)}>1 occurences of {dpath_query}: \
+                        {values}")
+        return values[-1][1] if values else ""
+
+    def search_all(self, dpath_query=DEFAULT_HTTP_HOST_KEY):
+        """Like search(), but every match as (path, value), in file order.
+
+        Example:
+            >>> dsr.search_all("**/http_host")
+            [('output 2/http_host', 'https://a.com/'),
+             ('output 3/http_host', 'http://10.0.0.2:8080/')]
+        """
         query = dpath_query
-        log.debug(f"searching '{self.path}' for key '{query}'...")
+        log.debug("searching '%s' for key '%s'...", self.path, query)
         if not self.config:
             self.parse()
+        values = self._lookup(query)
+        if values is None:
+            values = self._glob(query)
+        for path, value in values:
+            log.debug("Found %s='%s' at %s", query, value, path)
+        return values
+
+    def _glob(self, query: str):
+        from dpath import util  # slow to import, only needed here
         try:
-            values = list(util.search(self.config, query, yielded=True))
-            if len(values) > 1:
-                log.warning(f"{len(values)}>1 occurences of {query}: {values}")
-            for path, value in values:
-                log.debug(f"Found {query}='{value}' at {path}")
-            return value
+            return list(util.search(self.config, query, yielded=True))
         except KeyError:
-            log.error(f"KeyError: couldn't find {query} in {self.path}")
-        except FileNotFoundError:
-            log.error(f"FileNotFound: couldn't find {query} in {self.path}")
-
-        return value
+            return []
@@ -0,0 +1,378 @@
+"""An HTTP server that accepts what sniff uploads and stores it in SQLite.
+
+For testing and for small fleets without an API Gateway/Lambda. Accepts
+the bodies sniff POSTs: one JSON body, or a JSON list of bodies from the
+outbox, raw or with Content-Encoding gzip or deflate. Columnar bodies
+(--wire-format columnar) are decoded and stored like the others.
+
+Requests are parsed on one asyncio event loop. Bodies go to a single writer
+thread, which commits whatever has queued up in one transaction (SQLite in
+WAL mode), so many routers posting at once share each commit. A request is
+answered once its bodies are committed. When more requests are waiting to
+be written than `max_pending`, new ones get 503 with Retry-After, and
+sniff's outbox retries them later.
+
+Example:
+    $ sniff-receiver --port 8080 --db-path sniff.db &
+    $ sniff --api-url http://127.0.0.1:8080/ --api-headers \\
+        "content-type: application/json"
+    $ sqlite3 sniff.db "select count(*) from devices"
+"""
+import asyncio
+import json
+import logging as log
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Callable
+
+import sniff.params as ps
+from sniff import columnar
+from sniff.device import mac_to_int
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    received_s INTEGER NOT NULL,
+    router_mac TEXT,
+    router_serial TEXT,
+    hostname TEXT,
+    fw TEXT,
+    scan_s INTEGER,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    scan INTEGER NOT NULL REFERENCES scans (rowid),
+    section TEXT NOT NULL,
+    mac INTEGER NOT NULL,
+    rssi INTEGER,
+    host TEXT
+);
+CREATE INDEX IF NOT EXISTS devices_mac ON devices (mac);
+"""
+SECTIONS = ("wifi", "ble")
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 411: "Length Required",
+            413: "Payload Too Large", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+
+
+class BadRequest(ValueError):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_bodies(wire: bytes, encoding: str = "",
+                  max_bytes: int = ps.RECEIVER_MAX_BODY_BYTES):
+    """The bodies in a request: one JSON body or a list of them.
+
+    Raises:
+        BadRequest: if it isn't (compressed) JSON objects, decompresses
+            to more than `max_bytes`, or a columnar body is malformed.
+    """
+    wbits = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+    if encoding in wbits:
+        decompressor = zlib.decompressobj(wbits[encoding])
+        try:
+            raw = decompressor.decompress(wire, max_bytes)
+        except zlib.error as e:
+            raise BadRequest(f"bad {encoding} body: {e}")
+        if decompressor.unconsumed_tail:
+            raise BadRequest("body too large", 413)
+    elif encoding in ("", "identity"):
+        raw = wire
+    else:
+        raise BadRequest(f"unsupported Content-Encoding '{encoding}'")
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise BadRequest(f"bad JSON body: {e}")
+    bodies = data if isinstance(data, list) else [data]
+    if not all(isinstance(b, dict) for b in bodies):
+        raise BadRequest("bodies must be JSON objects")
+    try:
+        return [columnar.decode(b) for b in bodies]
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+
+def _scan_s(body: dict[str, Any]):
+    scan = body.get("scan") or {}
+    times = [scan.get(k) for k in ("ble_start_s", "wifi_start_s")]
+    times = [t for t in times if isinstance(t, (int, float)) and t > 0]
+    return int(min(times)) if times else None
+
+
+def _device_rows(scan: int, body: dict[str, Any]):
+    for section in SECTIONS:
+        for d in body.get(section) or ():
+            try:
+                yield (scan, section, mac_to_int(d["mac"]), d.get("rssi"),
+                       d.get("host"))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+
+class Store():
+    """SQLite database written by one thread, in batched transactions.
+
+    submit() queues bodies and returns at once; `on_done(error)` is called
+    from the writer thread after they're committed (error is None) or if
+    the write failed. Bodies with an "id" already stored (an outbox retry)
+    are skipped.
+    """
+
+    def __init__(self,
+                 path: str = ps.RECEIVER_DB_PATH,
+                 max_pending: int = ps.RECEIVER_MAX_PENDING,
+                 max_batch: int = ps.RECEIVER_MAX_BATCH):
+        self.path = path
+        self.max_batch = max_batch
+        self.pending: queue.Queue = queue.Queue(max_pending)
+        self.stats = {"bodies": 0, "duplicates": 0, "devices": 0,
+                      "batches": 0, "errors": 0}
+        self._db = self._connect()
+        self._thread = threading.Thread(target=self._run, name="store",
+                                        daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False,
+                             isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # with WAL, only a power loss can lose the last commits
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.executescript(SCHEMA)
+        return db
+
+    def submit(self, bodies: list[dict[str, Any]],
+               on_done: Callable[[Exception], None]):
+        """Queue bodies to write. False if too many are already waiting."""
+        try:
+            self.pending.put_nowait((bodies, on_done))
+            return True
+        except queue.Full:
+            return False
+
+    def _write(self, batch: list[tuple[list[dict[str, Any]], Any]]):
+        received_s = int(time.time())
+        n_bodies = n_duplicates = n_devices = 0
+        self._db.execute("BEGIN")
+        try:
+            for bodies, _ in batch:
+                for body in bodies:
+                    router = body.get("router") or {}
+                    cursor = self._db.execute(
+                        "INSERT OR IGNORE INTO scans (id, received_s, "
+                        "router_mac, router_serial, hostname, fw, scan_s, "
+                        "body) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (str(body.get("id") or uuid.uuid4().hex), received_s,
+                         router.get("mac"), router.get("serial"),
+                         router.get("hostname"), router.get("fw"),
+                         _scan_s(body),
+                         json.dumps(body, separators=(",", ":"))))
+                    if not cursor.rowcount:
+                        n_duplicates += 1
+                        continue
+                    cursor = self._db.executemany(
+                        "INSERT INTO devices (scan, section, mac, rssi, host)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        _device_rows(cursor.lastrowid, body))
+                    n_bodies += 1
+                    n_devices += max(0, cursor.rowcount)
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        self.stats["bodies"] += n_bodies
+        self.stats["duplicates"] += n_duplicates
+        self.stats["devices"] += n_devices
+        self.stats["batches"] += 1
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            # everything that queued up during the last commit
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.pending.put(None)  # stop after this batch
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+                error = None
+            except Exception as e:
+                log.exception(f"couldn't store {len(batch)} requests: {e}")
+                self.stats["errors"] += 1
+                error = e
+            for _, on_done in batch:
+                on_done(error)
+
+    def close(self):
+        """Write what's queued, then stop"""
+        self.pending.put(None)
+        self._thread.join()
+        self._db.close()
+
+
+async def _read_chunked(reader: asyncio.StreamReader, max_bytes: int):
+    body = b""
+    while True:
+        size = int((await reader.readline()).split(b";")[0], 16)
+        if not size:
+            await reader.readline()
+            return body
+        if len(body) + size > max_bytes:
+            raise BadRequest("body too large", 413)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+class Receiver():
+    """Accept sniff's uploads on `host`:`port` and store them in `store`.
+
+    POST to any path stores bodies. GET /stats returns counts as JSON.
+
+    Example:
+        >>> from sniff.receiver import Receiver, Store
+        >>> asyncio.run(Receiver(Store("sniff.db"), port=8080).serve())
+    """
+
+    def __init__(self,
+                 store: Store,
+                 host: str = ps.RECEIVER_HOST,
+                 port: int = ps.RECEIVER_PORT,
+                 max_body_bytes: int = ps.RECEIVER_MAX_BODY_BYTES,
+                 retry_after_s: int = ps.RECEIVER_RETRY_AFTER_S):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.retry_after_s = retry_after_s
+        self.stats = {"requests": 0, "rejected": 0, "bad": 0,
+                      "connections": 0}
+        self.server: asyncio.AbstractServer = None
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """(method, path, headers, body), or None when the client is done"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise BadRequest("headers too large", 413)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise BadRequest(f"bad request line '{lines[0]}'")
+        headers = {"_version": version}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await _read_chunked(reader, self.max_body_bytes)
+        else:
+            length = int(headers.get("content-length", 0))
+            if length > self.max_body_bytes:
+                raise BadRequest("body too large", 413)
+            body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    async def _handle_post(self, headers: dict[str, str], body: bytes):
+        bodies = decode_bodies(body,
+                               headers.get("content-encoding", "").lower(),
+                               self.max_body_bytes)
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def on_done(error):
+            loop.call_soon_threadsafe(done.set_result, error)
+
+        if not self.store.submit(bodies, on_done):
+            self.stats["rejected"] += 1
+            return 503, b"busy, retry later"
+        error = await done
+        if error is not None:
+            return 500, b"couldn't store body"
+        return 200, b"ok"
+
+    async def _respond(self, request):
+        method, path, headers, body = request
+        if method == "POST":
+            self.stats["requests"] += 1
+            return await self._handle_post(headers, body)
+        if method == "GET" and path == "/stats":
+            stats = {**self.stats, **self.store.stats,
+                     "pending": self.store.pending.qsize()}
+            return 200, json.dumps(stats).encode()
+        if method == "GET":
+            return 404, b"not found"
+        return 405, b"method not allowed"
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                is_kept_alive = True
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    status, reply = await self._respond(request)
+                    headers = request[2]
+                    is_kept_alive = headers["_version"] == "HTTP/1.1" \
+                        and headers.get("connection", "").lower() != "close"
+                except BadRequest as e:
+                    self.stats["bad"] += 1
+                    status, reply = e.status, str(e).encode()
+                    is_kept_alive = False
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    self.stats["bad"] += 1
+                    status, reply = 400, f"bad request: {e}".encode()
+                    is_kept_alive = False
+                head = f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n" \
+                    f"Content-Length: {len(reply)}\r\n" \
+                    "Content-Type: text/plain\r\n"
+                if status == 503:
+                    head += f"Retry-After: {self.retry_after_s}\r\n"
+                if not is_kept_alive:
+                    head += "Connection: close\r\n"
+                writer.write(head.encode() + b"\r\n" + reply)
+                await writer.drain()
+                if not is_kept_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self._handle, self.host, self.port,
+            limit=64 * 1024, backlog=1024)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.info(f"receiving on http://{self.host}:{self.port}/, storing "
+                 f"in '{self.store.path}'.")
+        return self.server
+
+    async def serve(self):
+        """Serve until cancelled"""
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
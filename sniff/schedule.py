@@ -0,0 +1,145 @@
+import json
+import logging as log
+import os
+import time
+from typing import Iterable
+
+import sniff.params as ps
+from sniff.device import int_to_mac, mac_to_int
+
+
+def churn(before: set[int], after: set[int]):
+    """The share of devices that came or went, from 0 (same devices) to 1
+    (all different). (new, gone, churn)"""
+    new = len(after - before)
+    gone = len(before - after)
+    seen = len(before | after)
+    return new, gone, (new + gone) / seen if seen else 0.0
+
+
+class ChurnScheduler():
+    """Pick the next scan interval and bluetooth wait from device churn.
+
+    After each scan, compares the devices found to the previous scan's.
+    When at least `threshold` of them came or went, the interval drops to
+    `min_interval_s` and bluetooth waits `max_ble_wait_s` again, to catch
+    what's happening. When churn stays under half the threshold, the
+    interval grows and the bluetooth wait shrinks by `growth` per scan, up
+    to `max_interval_s` and down to `min_ble_wait_s`. In between, they're
+    kept.
+
+    State is kept in a small file at `path` between runs, so cron runs
+    that aren't due yet can exit without scanning (path=None for memory
+    only, eg. in --daemon mode).
+
+    Example:
+        >>> from sniff.schedule import ChurnScheduler
+        >>> s = ChurnScheduler(path=None, min_interval_s=60,
+        ...                    max_interval_s=600)
+        >>> s.update({"ble": [0xA, 0xB]}), s.interval_s
+        (1.0, 60)
+        >>> s.update({"ble": [0xA, 0xB]}), s.interval_s
+        (0.0, 90.0)
+    """
+    DEFAULT_PATH = ps.SCHEDULE_PATH
+    SECTIONS = ("wifi", "ble")
+
+    def __init__(self,
+                 path: str = DEFAULT_PATH,
+                 min_interval_s: float = ps.SCHEDULE_MIN_INTERVAL_S,
+                 max_interval_s: float = ps.SCHEDULE_MAX_INTERVAL_S,
+                 min_ble_wait_s: float = ps.SCHEDULE_MIN_BLE_WAIT_S,
+                 max_ble_wait_s: float = 10,
+                 threshold: float = ps.SCHEDULE_CHURN_THRESHOLD,
+                 growth: float = ps.SCHEDULE_GROWTH):
+        self.path = path
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max(min_interval_s, max_interval_s)
+        self.min_ble_wait_s = min(min_ble_wait_s, max_ble_wait_s)
+        self.max_ble_wait_s = max_ble_wait_s
+        self.threshold = threshold
+        self.growth = max(1.0, growth)
+        self.interval_s = min_interval_s
+        self.ble_wait_s = max_ble_wait_s
+        self.next_s = 0.0
+        self.churn = 1.0
+        self.devices: dict[str, set[int]] = {}
+        self.load()
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            self.interval_s = min(self.max_interval_s,
+                                  max(self.min_interval_s,
+                                      state["interval_s"]))
+            self.ble_wait_s = min(self.max_ble_wait_s,
+                                  max(self.min_ble_wait_s,
+                                      state["ble_wait_s"]))
+            self.next_s = state["next_s"]
+            self.churn = state.get("churn", 1.0)
+            self.devices = {section: {mac_to_int(mac) for mac in macs}
+                            for section, macs
+                            in state.get("devices", {}).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning(f"ignoring bad schedule state '{self.path}': {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"interval_s": self.interval_s,
+                           "ble_wait_s": self.ble_wait_s,
+                           "next_s": self.next_s,
+                           "churn": self.churn,
+                           "devices": {section: [int_to_mac(k) for k in keys]
+                                       for section, keys
+                                       in self.devices.items()}},
+                          f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"couldn't write schedule state '{self.path}': {e}")
+
+    def is_due(self, now_s: float = None):
+        """Whether it's time to scan again. Allows a little early, since
+        cron doesn't start exactly on time."""
+        now_s = now_s or time.time()
+        return now_s >= self.next_s - ps.SCHEDULE_EARLY_S
+
+    def update(self,
+               devices: dict[str, Iterable[int]],
+               started_s: float = None):
+        """Record the device keys of a scan that started at `started_s`,
+        per section, and pick the next interval and bluetooth wait. Sections
+        that are missing (eg. a failed scan) don't count. Returns churn."""
+        started_s = started_s or time.time()
+        new = gone = seen = 0
+        for section, keys in devices.items():
+            keys = set(keys)
+            n, g, _ = churn(self.devices.get(section, set()), keys)
+            new, gone = new + n, gone + g
+            seen += len(keys | self.devices.get(section, set()))
+            self.devices[section] = keys
+        self.churn = (new + gone) / seen if seen else 0.0
+
+        if self.churn >= self.threshold:
+            self.interval_s = self.min_interval_s
+            self.ble_wait_s = self.max_ble_wait_s
+        elif self.churn < self.threshold / 2:
+            self.interval_s = min(self.max_interval_s,
+                                  self.interval_s * self.growth)
+            self.ble_wait_s = max(self.min_ble_wait_s,
+                                  self.ble_wait_s / self.growth)
+        self.next_s = started_s + self.interval_s
+        log.info(f"churn {round(self.churn, 2)} ({new} new, {gone} gone of \
+                 {seen}): next scan in {round(self.interval_s)}s, \
+                 bluetooth wait {round(self.ble_wait_s, 1)}s.")
+        self.save()
+        return self.churn
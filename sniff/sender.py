@@ -1,40 +1,337 @@
-from urllib.request import urlopen, Request
+import http.client
+import itertools
+import socket
+import ssl
+import time
+import zlib
 from urllib.error import HTTPError
+from urllib.parse import urlsplit
 import logging as log
-import json
-from typing import Any, MutableMapping, Union
+from typing import Any, Iterator, MutableMapping, Union
 
-from sniff import params as ps
+from sniff import metrics, params as ps, stream
+from sniff.stream import JSONFiles
 from sniff.ubus import Ubus
 
 
 def get_timezone(path_etc_config_system=ps.PATH_ETC_CONFIG_SYSTEM):
-    c = f"cat {path_etc_config_system}"
     try:
-        return Ubus.run_cmd(c).stdout.split("timezone '")[1].split("'")[0]
+        with open(path_etc_config_system, "r") as f:
+            return f.read().split("timezone '")[1].split("'")[0]
     except Exception:
         try:
             return Ubus.run_cmd("date +%Z%z").stdout.strip()
         except Exception:
-            log.error(f"couldn't get timezone from '{c}' or 'date +%Z%z'!")
+            log.error(f"couldn't get timezone from \
+                      '{path_etc_config_system}' or 'date +%Z%z'!")
             return ""
 
 
-def post_data(data: Union[dict[str, Any], list[Any]],
-              url: str,
-              headers: MutableMapping[str, str]):
-    httprequest = Request(
-        url=url,
-        headers=headers,
-        data=json.dumps(data).encode(),
-        method="POST")
+COMPRESSIONS = ("none", "gzip", "deflate")
 
-    try:
-        with urlopen(httprequest) as response:
-            log.debug(f"API response status: {response.status}")
-            result = response.read().decode()
-            log.debug(f"API response: {result}")
+
+def compress(body: bytes, compression: str, level: int):
+    if compression == "gzip":
+        import gzip
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if compression == "deflate":
+        return zlib.compress(body, level)
+    return body
+
+
+def _compressor(compression: str, level: int):
+    """zlib compressor making the same format as compress()"""
+    wbits = 31 if compression == "gzip" else zlib.MAX_WBITS
+    return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection with separate connect and read timeouts"""
+
+    def __init__(self, host, port=None, connect_timeout_s=None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.connect_timeout_s = connect_timeout_s
+
+    def _connect_sock(self):
+        sock = socket.create_connection((self.host, self.port),
+                                        self.connect_timeout_s,
+                                        self.source_address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        return sock
+
+    def connect(self):
+        self.sock = self._connect_sock()
+
+
+class _HTTPSConnection(_HTTPConnection, http.client.HTTPSConnection):
+    """HTTPSConnection that resumes the previous TLS session on reconnect,
+    skipping the full handshake"""
+
+    def __init__(self, host, port=None, connect_timeout_s=None, **kwargs):
+        super().__init__(host, port, connect_timeout_s, **kwargs)
+        self.tls_session = None
+
+    def connect(self):
+        sock = self._connect_sock()
+        self.sock = self._context.wrap_socket(sock,
+                                              server_hostname=self.host,
+                                              session=self.tls_session)
+        if self.sock.session_reused:
+            log.debug("resumed TLS session with %s.", self.host)
+        self.save_session()
+
+    def save_session(self):
+        # TLS 1.3 session tickets arrive after the handshake, so this is
+        # also called after each response
+        if self.sock is not None:
+            self.tls_session = self.sock.session
+
+
+class Sender():
+    """POST JSON to HTTP(S) URLs over kept-alive connections.
+
+    Keeps one connection per host and reuses it for every POST, resuming the
+    TLS session when it has to reconnect. A connection the server closed
+    while idle is reopened transparently. Bodies of at least
+    `compress_min_bytes` are sent with Content-Encoding `compression`.
+
+    With `is_streaming`, bodies of at least `compress_min_bytes` are
+    encoded (and compressed) while they're sent, with chunked transfer
+    encoding, instead of whole in memory first. Hosts that refuse chunked
+    bodies (411) get a Content-Length from then on.
+
+    Example:
+        >>> from sniff.sender import Sender
+        >>> s = Sender(connect_timeout_s=10, read_timeout_s=30)
+        >>> s.post({"scan": {}}, "https://example.com/", {"x-api-key": "..."})
+        (None, 'ok')
+    """
+
+    def __init__(self,
+                 connect_timeout_s: float = ps.API_CONNECT_TIMEOUT_S,
+                 read_timeout_s: float = ps.API_TIMEOUT_S,
+                 max_idle_s: float = ps.API_MAX_IDLE_S,
+                 compression: str = ps.API_COMPRESSION,
+                 compress_level: int = ps.API_COMPRESS_LEVEL,
+                 compress_min_bytes: int = ps.API_COMPRESS_MIN_BYTES,
+                 is_streaming: bool = True,
+                 chunk_bytes: int = ps.STREAM_CHUNK_BYTES):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression '{compression}', \
+                             options: {', '.join(COMPRESSIONS)}")
+        self.connect_timeout_s = connect_timeout_s
+        self.read_timeout_s = read_timeout_s
+        self.max_idle_s = max_idle_s
+        self.compression = compression
+        self.compress_level = compress_level
+        self.compress_min_bytes = compress_min_bytes
+        self.is_streaming = is_streaming
+        self.chunk_bytes = chunk_bytes
+        self._unchunked: set[tuple[str, str, int]] = set()
+        self._conns: dict[tuple[str, str, int], _HTTPConnection] = {}
+        self._used_s: dict[tuple[str, str, int], float] = {}
+        self._ssl_context = None
+
+    def _connection(self, url: str):
+        u = urlsplit(url)
+        https = u.scheme == "https"
+        key = (u.scheme, u.hostname, u.port)
+        conn = self._conns.get(key)
+        if conn is not None and conn.sock is not None \
+                and time.monotonic() - self._used_s[key] > self.max_idle_s:
+            # the server has likely dropped it, reconnect before sending
+            conn.close()
+        if conn is None:
+            if https:
+                self._ssl_context = self._ssl_context \
+                    or ssl.create_default_context()
+                conn = _HTTPSConnection(u.hostname, u.port,
+                                        self.connect_timeout_s,
+                                        timeout=self.read_timeout_s,
+                                        context=self._ssl_context)
+            else:
+                conn = _HTTPConnection(u.hostname, u.port,
+                                       self.connect_timeout_s,
+                                       timeout=self.read_timeout_s)
+            self._conns[key] = conn
+        self._used_s[key] = time.monotonic()
+        path = u.path or "/"
+        return conn, f"{path}?{u.query}" if u.query else path, key
+
+    def _is_compressed(self, raw_bytes: int = None):
+        """Whether a body of `raw_bytes` (None if streamed) is compressed"""
+        return self.compression != "none" and (
+            raw_bytes is None or raw_bytes >= self.compress_min_bytes)
+
+    def _whole(self, body: bytes, sizes: dict[str, float]):
+        raw_bytes = len(body)
+        if self._is_compressed(raw_bytes):
+            body = compress(body, self.compression, self.compress_level)
+        sizes.update(raw=raw_bytes, wire=len(body))
+        return body
+
+    def _body(self, data: Any, is_chunked: bool, sizes: dict[str, float]):
+        """(body, is_compressed) to send data as: bytes, or with
+        `is_chunked` and a big enough body, an iterator of wire chunks.
+        `sizes` gets the raw and wire bytes and the encoding time, for
+        chunks once they're all sent."""
+        start_s = time.perf_counter()
+        if not is_chunked:
+            body = self._whole(stream.encode(data), sizes)
+            sizes["encode_s"] = time.perf_counter() - start_s
+            return body, self._is_compressed(int(sizes["raw"]))
+
+        chunks = stream.iter_encode(data, self.chunk_bytes)
+        head, raw_bytes = [], 0
+        for chunk in chunks:
+            head.append(chunk)
+            raw_bytes += len(chunk)
+            if raw_bytes >= self.compress_min_bytes:
+                break
+        after = next(chunks, None)
+        if after is None:
+            # it all fit in the head, send it whole
+            body = self._whole(b"".join(head), sizes)
+            sizes["encode_s"] = time.perf_counter() - start_s
+            return body, self._is_compressed(raw_bytes)
+        head.append(after)
+        sizes["encode_s"] = time.perf_counter() - start_s
+        return self._iter_wire(itertools.chain(head, chunks), sizes), \
+            self._is_compressed()
+
+    def _iter_wire(self, chunks: Iterator[bytes], sizes: dict[str, float]):
+        compressor = _compressor(self.compression, self.compress_level) \
+            if self._is_compressed() else None
+        while True:
+            start_s = time.perf_counter()
+            chunk = next(chunks, None)
+            if chunk is None:
+                wire = compressor.flush() if compressor else b""
+            else:
+                sizes["raw"] += len(chunk)
+                wire = compressor.compress(chunk) if compressor else chunk
+            sizes["wire"] += len(wire)
+            sizes["encode_s"] += time.perf_counter() - start_s
+            if wire:
+                yield wire
+            if chunk is None:
+                return
+
+    def post(self,
+             data: Union[dict[str, Any], list[Any], JSONFiles],
+             url: str,
+             headers: MutableMapping[str, str],
+             timeout_s: float = None):
+        """POST data as JSON. Returns (error, None) or (None, response).
+        `timeout_s` caps the connect and read timeouts, eg. to what's left
+        of a Deadline."""
+        for attempt in range(3):
+            conn, path, key = self._connection(url)
+            self._set_timeouts(conn, timeout_s)
+            is_reused = conn.sock is not None
+            is_chunked = self.is_streaming and key not in self._unchunked
+            sizes = {"raw": 0, "wire": 0, "encode_s": 0.0}
+            start_s = time.perf_counter()
+            try:
+                body, is_compressed = self._body(data, is_chunked, sizes)
+                if not is_reused:
+                    # connect separately, to time it apart from the upload
+                    with metrics.timer("sniff_http_connect_seconds"):
+                        conn.connect()
+                sent_s = time.perf_counter()
+                is_cut = False
+                try:
+                    conn.request("POST", path, body=body,
+                                 headers={**headers, "Content-Encoding":
+                                          self.compression}
+                                 if is_compressed else headers,
+                                 encode_chunked=not isinstance(body, bytes))
+                    self._record(sizes, is_compressed)
+                except (ConnectionResetError, BrokenPipeError):
+                    if isinstance(body, bytes):
+                        raise
+                    # it may have answered before reading it all, eg. 411
+                    # to a chunked body. If not, getresponse() raises
+                    is_cut = True
+                response = conn.getresponse()
+                metrics.observe("sniff_http_ttfb_seconds",
+                                time.perf_counter() - sent_s)
+                result = response.read().decode()
+                metrics.observe("sniff_http_request_seconds",
+                                time.perf_counter() - start_s)
+            except (http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError) as e:
+                conn.close()
+                if is_reused and attempt < 2:
+                    log.debug("kept-alive connection closed (%s), "
+                              "reconnecting...", e)
+                    continue
+                metrics.inc("sniff_upload_errors_total", kind=type(e).__name__)
+                log.error(f"ERROR: couldn't reach {url}: {e}")
+                return e, None
+            except (OSError, http.client.HTTPException) as e:
+                # OSError for DNS/connection errors and timeouts
+                conn.close()
+                metrics.inc("sniff_upload_errors_total", kind=type(e).__name__)
+                log.error(f"ERROR: couldn't reach {url}: {e}")
+                return e, None
+            metrics.inc("sniff_upload_responses_total", status=response.status)
+
+            if isinstance(conn, _HTTPSConnection):
+                conn.save_session()
+            if response.will_close or is_cut:
+                conn.close()
+            if response.status == 411 and not isinstance(body, bytes):
+                log.warning(f"{url} refused a chunked body, sending with \
+                            Content-Length from now on.")
+                self._unchunked.add(key)
+                continue
+            log.debug("API response status: %s", response.status)
+            if response.status >= 400:
+                e = HTTPError(url, response.status, response.reason,
+                              response.headers, None)
+                log.error(f"ERROR: {e}")
+                return e, None
+            log.debug("API response: %s", result)
             return None, result
-    except HTTPError as e:
-        log.error(f"ERROR: {e}")
-        return e, None
+
+    def _set_timeouts(self, conn: _HTTPConnection, timeout_s: float = None):
+        cap_s = float("inf") if timeout_s is None else timeout_s
+        conn.connect_timeout_s = min(self.connect_timeout_s, cap_s)
+        conn.timeout = min(self.read_timeout_s, cap_s)
+        if conn.sock is not None:
+            conn.sock.settimeout(conn.timeout)
+
+    def _record(self, sizes: dict[str, float], is_compressed: bool):
+        raw_bytes, wire_bytes = int(sizes["raw"]), int(sizes["wire"])
+        metrics.observe("sniff_encode_seconds", sizes["encode_s"])
+        for encoding, n in (("raw", raw_bytes), ("wire", wire_bytes)):
+            metrics.observe("sniff_upload_bytes", n, metrics.BUCKETS_BYTES,
+                            encoding=encoding)
+            metrics.inc("sniff_upload_bytes_total", n, encoding=encoding)
+        if is_compressed:
+            log.info(f"compressed body with {self.compression}: \
+                     {raw_bytes} -> {wire_bytes} bytes \
+                     ({round(100 * wire_bytes / raw_bytes)}%).")
+        else:
+            log.info(f"sent {raw_bytes} byte body uncompressed.")
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns = {}
+
+
+_SENDER: Sender = None
+
+
+def post_data(data: Union[dict[str, Any], list[Any]],
+              url: str,
+              headers: MutableMapping[str, str],
+              timeout_s: float = None):
+    """POST data as JSON with a shared Sender, reusing its connection."""
+    global _SENDER
+    _SENDER = _SENDER or Sender()
+    return _SENDER.post(data, url, headers, timeout_s)
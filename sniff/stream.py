@@ -0,0 +1,181 @@
+"""Decode and encode JSON a piece at a time, so large scans don't need the
+whole document in memory.
+
+iter_array() yields the items of one array in a JSON object as they're read
+(eg. from a pipe), and iter_encode() encodes a body in chunks as it's sent.
+
+Example:
+    >>> from sniff.stream import iter_array, iter_encode
+    >>> chunks = ['{"scanning": 1, "devi', 'ces": [{"rssi": -61}, {"rs',
+    ...           'si": -74}]}']
+    >>> list(iter_array(chunks, "devices"))
+    [{'rssi': -61}, {'rssi': -74}]
+    >>> b"".join(iter_encode({"ble": [{"rssi": -61}]}))
+    b'{"ble": [{"rssi": -61}]}'
+"""
+import json
+import re
+from typing import Any, Iterable, Iterator
+
+import sniff.params as ps
+
+_WS = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = "0123456789.eE+-"
+_DECODER = json.JSONDecoder()
+# objects with a to_dict(), eg. Devices, are encoded as their dicts
+_ENCODER = json.JSONEncoder(default=lambda o: o.to_dict())
+_ITEMS_PER_PART = 64  # list items encoded at once, at C speed
+
+
+def iter_array(chunks: Iterable[str], key: str) -> Iterator[Any]:
+    """Yield each item of the array at `key` in a JSON object read from
+    text `chunks`, as soon as it's complete.
+
+    Only the item being decoded is kept, plus what's left of the last
+    chunk. Other keys before it are decoded and dropped, the rest of the
+    object isn't read. Yields nothing if there's no array at `key`.
+
+    Raises:
+        ValueError: if the JSON is invalid or ends early.
+    """
+    chunks = iter(chunks)
+    buf, pos = "", 0
+
+    def more():
+        nonlocal buf, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError(f"JSON ended early, at '{buf[pos:pos + 20]}'")
+        buf, pos = buf[pos:] + chunk, 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _WS.match(buf, pos).end()
+            if pos < len(buf):
+                return buf[pos]
+            more()
+
+    def expect(chars: str):
+        nonlocal pos
+        c = peek()
+        if c not in chars:
+            raise ValueError(f"bad JSON, expected one of '{chars}' at "
+                             f"'{buf[pos:pos + 20]}'")
+        pos += 1
+        return c
+
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more()
+                continue
+            if isinstance(obj, (int, float)) and not isinstance(obj, bool) \
+                    and not buf[end:].lstrip(_NUMBER_CHARS):
+                # a number could go on in the next chunk, eg. "3." + "25"
+                try:
+                    more()
+                    continue
+                except ValueError:
+                    pass
+            pos = end
+            return obj
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        name = value()
+        expect(":")
+        if name == key and peek() == "[":
+            pos += 1
+            if peek() == "]":
+                return
+            while True:
+                yield value()
+                if expect(",]") == "]":
+                    return
+        value()
+        if expect(",}") == "}":
+            return
+
+
+def _iter_parts(data: Any) -> Iterator[str]:
+    # objects are opened up and lists are encoded a slice at a time, so
+    # no part is much bigger than one device
+    if isinstance(data, dict) and all(isinstance(k, str) for k in data):
+        yield "{"
+        sep = ""
+        for k, v in data.items():
+            yield f"{sep}{_ENCODER.encode(k)}: "
+            yield from _iter_parts(v)
+            sep = ", "
+        yield "}"
+    elif isinstance(data, (list, tuple)) and len(data) > _ITEMS_PER_PART:
+        yield "["
+        for i in range(0, len(data), _ITEMS_PER_PART):
+            part = _ENCODER.encode(data[i:i + _ITEMS_PER_PART])[1:-1]
+            yield f", {part}" if i else part
+        yield "]"
+    else:
+        yield _ENCODER.encode(data)
+
+
+class JSONFiles():
+    """JSON values already encoded in files, eg. queued bodies, to send
+    without decoding them: the one value, or a list of them.
+
+    Example:
+        >>> from sniff.stream import JSONFiles, iter_encode
+        >>> b"".join(iter_encode(JSONFiles(["/tmp/a.json", "/tmp/b.json"])))
+        b'[{"id": "a"},{"id": "b"}]'
+    """
+
+    def __init__(self, paths: list[str]):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def chunks(self, chunk_bytes: int = ps.STREAM_CHUNK_BYTES):
+        is_list = len(self.paths) != 1
+        if is_list:
+            yield b"["
+        for i, path in enumerate(self.paths):
+            if i:
+                yield b","
+            with open(path, "rb") as f:
+                yield from iter(lambda: f.read(chunk_bytes), b"")
+        if is_list:
+            yield b"]"
+
+
+def iter_encode(data: Any,
+                chunk_bytes: int = ps.STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Encode data as JSON (like json.dumps, with objects that have a
+    to_dict() as their dicts) in chunks of about `chunk_bytes`, without
+    the whole encoding in memory."""
+    if isinstance(data, JSONFiles):
+        yield from data.chunks(chunk_bytes)
+        return
+    parts: list[str] = []
+    size = 0
+    for part in _iter_parts(data):
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_bytes:
+            yield "".join(parts).encode()
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts).encode()
+
+
+def encode(data: Any):
+    """Encode data like iter_encode(), in one piece."""
+    if isinstance(data, JSONFiles):
+        return b"".join(data.chunks())
+    return _ENCODER.encode(data).encode()
@@ -0,0 +1,143 @@
+"""Upload each body to several APIs at once, eg. a cloud API and a
+site-local collector.
+
+Each Target has its own connection, outbox (queue and backoff) and time
+limit, and uploads in its own thread, so a slow or failing API never holds
+back the others or gets their bodies dropped.
+"""
+import logging as log
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, MutableMapping, Union
+
+import sniff.params as ps
+from sniff import metrics
+from sniff.deadline import Deadline
+from sniff.outbox import Outbox
+from sniff.sender import Sender
+
+
+def parse_headers(headers: Union[str, list[str]]):
+    """Parse "key: value" headers, comma-separated or one per item (eg.
+    `list http_header` options), into a dict.
+
+    Example:
+        >>> parse_headers("content-type: application/json,x-api-key: abc")
+        {'content-type': 'application/json', 'x-api-key': 'abc'}
+    """
+    if isinstance(headers, str):
+        headers = headers.split(",")
+    pairs = [h.partition(":") for h in headers if h.strip()]
+    return {k.strip(): v.strip() for k, _, v in pairs}
+
+
+def slug(name: str):
+    """A name safe to use as a file name, eg. for a target's outbox"""
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or "api"
+
+
+class Target():
+    """An API to upload to, with its own Sender (kept-alive connection),
+    Outbox and `timeout_s` for all of its uploads in one run.
+
+    Example:
+        >>> from sniff.target import Target, send_all
+        >>> cloud = Target("cloud", "https://a.com/", {"x-api-key": "abc"},
+        ...                outbox=Outbox("/tmp/sniff/outbox"))
+        >>> site = Target("site", "http://10.0.0.2:8080/", {}, timeout_s=5,
+        ...               outbox=Outbox("/tmp/sniff/outbox/site"))
+        >>> send_all(body, [cloud, site])
+        {'cloud': 1, 'site': 0}
+    """
+
+    def __init__(self,
+                 name: str,
+                 url: str,
+                 headers: MutableMapping[str, str],
+                 outbox: Outbox = None,
+                 client: Sender = None,
+                 timeout_s: float = ps.API_TIMEOUT_S):
+        self.name = name
+        self.url = url
+        self.headers = headers
+        self.outbox = outbox
+        self.client = client or Sender(read_timeout_s=timeout_s)
+        self.timeout_s = timeout_s
+
+    def __repr__(self):
+        return f"Target({self.name!r}, {self.url!r})"
+
+    def send(self, body: dict[str, Any], deadline: Deadline = None):
+        """Post body, or with an outbox, queue it and upload everything
+        queued. Takes at most `timeout_s`, or what's left of `deadline`.
+
+        Returns (error, response) without an outbox, else the number of
+        items delivered.
+        """
+        budget_s = (deadline or Deadline(None)).clip(self.timeout_s)
+        if budget_s is not None:
+            budget_s = max(ps.MIN_UPLOAD_TIMEOUT_S, budget_s)
+        limit = Deadline(budget_s)
+
+        def post(data):
+            timeout_s = limit.clip()
+            if timeout_s is not None:
+                timeout_s = max(ps.MIN_UPLOAD_TIMEOUT_S, timeout_s)
+            start_s = time.perf_counter()
+            error, result = self.client.post(data, self.url, self.headers,
+                                             timeout_s)
+            metrics.observe("sniff_target_upload_seconds",
+                            time.perf_counter() - start_s, target=self.name)
+            metrics.inc("sniff_target_uploads_total", target=self.name,
+                        result="ok" if error is None else "error")
+            return error, result
+
+        if self.outbox is None:
+            return post(body)
+        is_queued = self.outbox.put(body) is not None
+        sent = self.outbox.drain(post, lambda: limit.expired)
+        if not is_queued:
+            # too big to queue, so it gets one try
+            error, _ = post(body)
+            sent += error is None
+        metrics.set_gauge("sniff_target_queued", len(self.outbox),
+                          target=self.name)
+        return sent
+
+    def close(self):
+        self.client.close()
+
+
+def send_all(body: dict[str, Any],
+             targets: list[Target],
+             deadline: Deadline = None):
+    """Send body to every target at once, each in its own thread and
+    within its own time limit. Returns {name: what Target.send returned},
+    or the error it raised."""
+    if len(targets) == 1:
+        return {targets[0].name: targets[0].send(body, deadline)}
+
+    results: dict[str, Any] = {}
+    with ThreadPoolExecutor(max_workers=len(targets),
+                            thread_name_prefix="upload") as pool:
+        futures = {t.name: pool.submit(t.send, body, deadline)
+                   for t in targets}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                log.exception(f"upload to '{name}' failed: {e}")
+                results[name] = e
+    log.info("uploads: " + ", ".join(
+        f"{name}={_outcome(result)}" for name, result in results.items()))
+    return results
+
+
+def _outcome(result: Any):
+    if isinstance(result, int):
+        return f"{result} delivered"
+    if isinstance(result, Exception):
+        return type(result).__name__
+    error, _ = result
+    return "ok" if error is None else type(error).__name__
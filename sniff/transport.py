@@ -0,0 +1,384 @@
+import json
+import logging as log
+import os
+import shlex
+import socket
+import struct
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Iterator
+
+from sniff import blobmsg, stream
+import sniff.params as ps
+
+# libubus message types and attributes (ubusmsg.h)
+UBUS_MSG_HELLO = 0
+UBUS_MSG_STATUS = 1
+UBUS_MSG_DATA = 2
+UBUS_MSG_LOOKUP = 4
+UBUS_MSG_INVOKE = 5
+
+UBUS_ATTR_STATUS = 1
+UBUS_ATTR_OBJPATH = 2
+UBUS_ATTR_OBJID = 3
+UBUS_ATTR_METHOD = 4
+UBUS_ATTR_OBJTYPE = 5
+UBUS_ATTR_SIGNATURE = 6
+UBUS_ATTR_DATA = 7
+
+UBUS_STATUS_OK = 0
+UBUS_STATUS_NOT_FOUND = 4
+UBUS_STATUS_CONNECTION_FAILED = 10
+
+UBUS_MAX_MSGLEN = 1048576
+
+_MSG_HDR = struct.Struct(">BBHI")  # version, type, seq, peer
+_BLOB_HDR = struct.Struct(">I")
+
+
+def parse_cmd(cmd_str: str):
+    """Split `ubus call <path> <method> [json]` into (path, method, args).
+
+    Returns None if cmd_str is not a `ubus call`.
+
+    Example:
+        >>> parse_cmd(\"\"\"ubus call iwinfo scan '{"device": "wlan1"}'\"\"\")
+        ('iwinfo', 'scan', {'device': 'wlan1'})
+    """
+    argv = shlex.split(cmd_str)
+    if len(argv) < 4 or argv[:2] != ["ubus", "call"]:
+        return None
+    args = json.loads(argv[4]) if len(argv) > 4 else {}
+    return argv[2], argv[3], args
+
+
+def _status_error(cmd_str: str, status: int, output=""):
+    # same exception as a failed `ubus` subprocess, so callers can keep
+    # checking e.g. "returned non-zero exit status 6"
+    return subprocess.CalledProcessError(status, shlex.split(cmd_str), output)
+
+
+class Transport(ABC):
+    """How Ubus objects talk to ubusd."""
+    name = "transport"
+
+    @abstractmethod
+    def call(self, cmd_str: str, timeout_s: float = None) -> Any:
+        """Run a `ubus call ...` command string and return its decoded
+        result. Raises subprocess.CalledProcessError on non-zero status."""
+
+    def stream(self, cmd_str: str, key: str,
+               timeout_s: float = None) -> Iterator[Any]:
+        """Like call(), but yield the items of the list at `key` in its
+        result as they're decoded, eg. devices straight into a parser.
+        Errors are raised when iterating. By default, the result is decoded
+        whole first."""
+        result = self.call(cmd_str, timeout_s)
+        if isinstance(result, dict):
+            yield from result.get(key, [])
+
+    def close(self):
+        pass
+
+
+class SubprocessTransport(Transport):
+    """Fork the `ubus` CLI for every call and decode its JSON stdout."""
+    name = "subprocess"
+
+    @staticmethod
+    def run_cmd(cmd_str: str, timeout_s: float = None):
+        log.debug("running command '%s'...", cmd_str)
+        r = subprocess.run(shlex.split(cmd_str),
+                           check=True,
+                           text=True,
+                           capture_output=True,
+                           timeout=timeout_s)
+        log.debug("command success.")
+        return r
+
+    @staticmethod
+    def read_stdout(result: subprocess.CompletedProcess[str]):
+        log.debug("decoding %d chars of stdout...", len(result.stdout))
+        try:
+            obj = json.loads(result.stdout)
+        except json.decoder.JSONDecodeError as e:
+            log.debug("stdout is not JSON: %s", e)
+            obj = result.stdout
+        log.debug("done.")
+        return obj
+
+    def call(self, cmd_str: str, timeout_s: float = None):
+        return self.read_stdout(self.run_cmd(cmd_str, timeout_s))
+
+    def stream(self, cmd_str: str, key: str, timeout_s: float = None):
+        """Decode the list at `key` from the command's stdout while it's
+        still being written, a chunk at a time."""
+        log.debug("streaming command '%s'...", cmd_str)
+        argv = shlex.split(cmd_str)
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True)
+        killed = threading.Event()
+
+        def kill():
+            killed.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout_s, kill) if timeout_s else None
+        if timer is not None:
+            timer.start()
+        chunks = iter(lambda: proc.stdout.read(ps.STREAM_CHUNK_BYTES), "")
+        try:
+            try:
+                yield from stream.iter_array(chunks, key)
+            except ValueError as e:
+                log.debug("stdout is not JSON: %s", e)
+            for _ in chunks:
+                pass  # let it finish
+            stderr = proc.stderr.read()
+            proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if proc.poll() is None:
+                proc.kill()  # stopped iterating early
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+        if killed.is_set():
+            raise subprocess.TimeoutExpired(argv, timeout_s)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, argv,
+                                                stderr=stderr)
+        log.debug("command success.")
+
+
+class _Connection():
+    """One client connection to ubusd. Not thread-safe; see SocketTransport.
+    """
+
+    def __init__(self, path: str, timeout_s: float = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout_s)
+        self.sock.connect(path)
+        self.seq = 0
+        self.objects: dict[str, int] = {}  # object path -> id
+        msg_type, _, self.peer, _ = self.recv()
+        if msg_type != UBUS_MSG_HELLO:
+            raise ConnectionError(f"expected HELLO from ubusd, "
+                                  f"got message type {msg_type}")
+
+    def close(self):
+        self.sock.close()
+
+    def _recv_exact(self, n: int):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("ubusd closed the connection")
+            buf += chunk
+        return bytes(buf)
+
+    def recv(self):
+        """Read one message: (type, seq, peer, {attr id: payload})"""
+        head = self._recv_exact(_MSG_HDR.size + _BLOB_HDR.size)
+        _, msg_type, seq, peer = _MSG_HDR.unpack_from(head)
+        id_len, = _BLOB_HDR.unpack_from(head, _MSG_HDR.size)
+        length = id_len & blobmsg.BLOB_ATTR_LEN_MASK
+        if not _BLOB_HDR.size <= length <= UBUS_MAX_MSGLEN:
+            raise ConnectionError(f"bad ubus message length {length}")
+        body = self._recv_exact(length - _BLOB_HDR.size)
+        attrs = {i: bytes(p) for i, _, p in blobmsg.iter_attrs(body)}
+        return msg_type, seq, peer, attrs
+
+    def send(self, msg_type: int, peer: int, attrs: bytes):
+        self.seq = (self.seq + 1) & 0xffff
+        self.sock.sendall(_MSG_HDR.pack(0, msg_type, self.seq, peer)
+                          + blobmsg.blob_attr(0, attrs))
+        return self.seq
+
+    def request(self, msg_type: int, peer: int, attrs: bytes):
+        """Send a request and collect its DATA replies until STATUS."""
+        seq = self.send(msg_type, peer, attrs)
+        replies = []
+        while True:
+            r_type, r_seq, _, r_attrs = self.recv()
+            if r_seq != seq:
+                continue  # not ours, eg. a notification
+            if r_type == UBUS_MSG_DATA:
+                replies.append(r_attrs)
+            elif r_type == UBUS_MSG_STATUS:
+                status, = struct.unpack(">i", r_attrs[UBUS_ATTR_STATUS][:4])
+                return status, replies
+
+    def lookup(self, path: str):
+        if path not in self.objects:
+            attrs = blobmsg.blob_attr(UBUS_ATTR_OBJPATH,
+                                      path.encode() + b"\0")
+            status, replies = self.request(UBUS_MSG_LOOKUP, 0, attrs)
+            for r in replies:
+                if UBUS_ATTR_OBJID in r:
+                    obj_id, = struct.unpack(">I", r[UBUS_ATTR_OBJID][:4])
+                    self.objects[path] = obj_id
+            if path not in self.objects:
+                return status or UBUS_STATUS_NOT_FOUND, None
+        return UBUS_STATUS_OK, self.objects[path]
+
+    def invoke(self, path: str, method: str, args: dict[str, Any],
+               is_raw=False):
+        """(status, result) of a method call. With `is_raw`, result is the
+        undecoded blobmsg table of each reply instead of a dict."""
+        for _ in range(2):
+            is_cached = path in self.objects
+            status, obj_id = self.lookup(path)
+            if obj_id is None:
+                return status, None
+            attrs = (blobmsg.blob_attr(UBUS_ATTR_OBJID,
+                                       struct.pack(">I", obj_id))
+                     + blobmsg.blob_attr(UBUS_ATTR_METHOD,
+                                         method.encode() + b"\0")
+                     + blobmsg.blob_attr(UBUS_ATTR_DATA,
+                                         blobmsg.encode(args)))
+            status, replies = self.request(UBUS_MSG_INVOKE, obj_id, attrs)
+            if status == UBUS_STATUS_NOT_FOUND and is_cached:
+                # object was re-registered with a new id, look it up again
+                del self.objects[path]
+                continue
+            break
+        if is_raw:
+            return status, [r[UBUS_ATTR_DATA] for r in replies
+                            if UBUS_ATTR_DATA in r]
+        result = {}
+        for r in replies:
+            if UBUS_ATTR_DATA in r:
+                result.update(blobmsg.decode(r[UBUS_ATTR_DATA]))
+        return status, result
+
+
+class SocketTransport(Transport):
+    """Talk the ubus protocol directly to ubusd over its unix socket.
+
+    Connections are kept open and reused across calls (one per concurrent
+    caller). Commands that aren't `ubus call`s, or any call when ubusd
+    can't be reached, go through the fallback transport instead.
+    """
+    name = "socket"
+
+    def __init__(self,
+                 path: str = None,
+                 fallback: Transport = None,
+                 timeout_s: float = ps.UBUS_TIMEOUT_S):
+        self.path = path or find_socket() or ps.UBUS_SOCKET_PATHS[0]
+        self.fallback = fallback or SubprocessTransport()
+        self.timeout_s = timeout_s
+        self._idle: list[_Connection] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self, timeout_s: float):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            log.debug("connecting to ubusd at '%s'...", self.path)
+            conn = _Connection(self.path, timeout_s)
+        conn.sock.settimeout(timeout_s)
+        return conn
+
+    def _release(self, conn: _Connection):
+        with self._lock:
+            self._idle.append(conn)
+
+    def _invoke(self, cmd_str: str, parsed: tuple[str, str, dict],
+                timeout_s: float, is_raw=False):
+        """The result of a `ubus call`, or None if ubusd can't be reached.
+        """
+        path, method, args = parsed
+        log.debug("calling ubus %s %s over '%s'...", path, method,
+                  self.path)
+        for attempt in range(2):  # retry once if a reused conn went stale
+            try:
+                conn = self._acquire(timeout_s)
+            except OSError as e:
+                log.warning(f"can't connect to ubusd at '{self.path}' "
+                            f"({e}), using {self.fallback.name}.")
+                return None
+            try:
+                status, result = conn.invoke(path, method, args, is_raw)
+            except socket.timeout:
+                conn.close()
+                raise subprocess.TimeoutExpired(shlex.split(cmd_str),
+                                                timeout_s)
+            except (OSError, ValueError) as e:
+                conn.close()
+                if attempt:
+                    raise _status_error(
+                        cmd_str, UBUS_STATUS_CONNECTION_FAILED, str(e))
+                log.debug("ubusd connection failed (%s), reconnecting...",
+                          e)
+                continue
+            self._release(conn)
+            break
+
+        if status != UBUS_STATUS_OK:
+            raise _status_error(cmd_str, status)
+        return result
+
+    def call(self, cmd_str: str, timeout_s: float = None):
+        parsed = parse_cmd(cmd_str)
+        result = None if parsed is None \
+            else self._invoke(cmd_str, parsed, timeout_s or self.timeout_s)
+        if result is None:
+            return self.fallback.call(cmd_str, timeout_s)
+        return result
+
+    def stream(self, cmd_str: str, key: str, timeout_s: float = None):
+        """Decode the list at `key` from ubusd's reply one item at a time,
+        instead of the whole reply at once."""
+        parsed = parse_cmd(cmd_str)
+        tables = None if parsed is None \
+            else self._invoke(cmd_str, parsed, timeout_s or self.timeout_s,
+                              is_raw=True)
+        if tables is None:
+            yield from self.fallback.stream(cmd_str, key, timeout_s)
+            return
+        for table in tables:
+            yield from blobmsg.iter_array(table, key)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def find_socket(paths=ps.UBUS_SOCKET_PATHS):
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+_TRANSPORTS: dict[tuple[str, str], Transport] = {}
+TRANSPORT_NAMES = ("auto", SocketTransport.name, SubprocessTransport.name)
+
+
+def get_transport(name: str = ps.UBUS_TRANSPORT, socket_path: str = None):
+    """Return a shared transport by name, so connections are reused.
+
+    "auto" picks the socket transport if a ubusd socket exists.
+    """
+    socket_path = socket_path or find_socket()
+    if name == "auto":
+        name = SocketTransport.name if socket_path \
+            else SubprocessTransport.name
+    key = (name, socket_path or "")
+    if key not in _TRANSPORTS:
+        if name == SocketTransport.name:
+            _TRANSPORTS[key] = SocketTransport(socket_path)
+        elif name == SubprocessTransport.name:
+            _TRANSPORTS[key] = SubprocessTransport()
+        else:
+            raise ValueError(f"unknown ubus transport '{name}', "
+                             f"options: {', '.join(TRANSPORT_NAMES)}")
+        log.debug("using %s ubus transport.", name)
+    return _TRANSPORTS[key]
@@ -1,12 +1,16 @@
 import subprocess
-import json
 from typing import Any, Callable
 import time
 import logging as log
-import shlex
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 
+import sniff.params as ps
 import sniff.parser
+from sniff import metrics
+from sniff.filters import DeviceFilter
+from sniff.logger import LazyJSON
+from sniff.transport import SubprocessTransport, Transport, get_transport
 
 _PRIMS = (bool, str, int, float, type(None))
 _NO_UBUS_EXC = "'['which', 'ubus']' returned non-zero exit status 1"
@@ -16,16 +20,25 @@ _REPLACE_EXC = " 'ubus' is not installed here. are you in OpenWRT?"
 class Ubus(ABC):
     DEFAULT_RESULT_CMD = "which ubus"
     DEFAULT_SCAN_PARSER = sniff.parser.default_scan_parser
+    DEVICES_KEY: str = None  # list of devices in results, to stream
 
     def __init__(self,
                  result_cmd=DEFAULT_RESULT_CMD,
                  scan_parser=DEFAULT_SCAN_PARSER,
                  device_parser: Callable = None,
+                 transport: Transport = None,
+                 timeout_s: float = None,
+                 device_filter: DeviceFilter = None,
+                 is_streaming: bool = True,
                  **kwargs):
         self.name = type(self).__name__
+        self.transport = transport or get_transport()
+        self.timeout_s = timeout_s
         self.result_cmd = result_cmd
         self.scan_parser = scan_parser
         self.device_parser = device_parser
+        self.device_filter = device_filter
+        self.is_streaming = is_streaming
         self.result: dict[str, Any] = {}
         self.start_s = 0
         self.end_s = 0
@@ -33,38 +46,53 @@ class Ubus(ABC):
         self.__debug_self__()
 
     def __debug_self__(self):
-        log.debug(f"init'ing {type(self).__name__} with properties:")
+        if not log.getLogger().isEnabledFor(log.DEBUG):
+            return
         _td = {k: v for k, v in vars(self).items() if isinstance(v, _PRIMS)}
-        log.debug(json.dumps(_td, indent=4))
+        log.debug("init'ing %s with properties: %s", type(self).__name__,
+                  LazyJSON(_td))
 
     @staticmethod
-    def run_cmd(cmd_str: str):
-        log.debug(f"running command '{cmd_str}'...")
-        r = subprocess.run(shlex.split(cmd_str),
-                           check=True,
-                           text=True,
-                           capture_output=True)
-        log.debug("command success.")
-        return r
+    def run_cmd(cmd_str: str, timeout_s: float = ps.UBUS_TIMEOUT_S):
+        return SubprocessTransport.run_cmd(cmd_str, timeout_s)
 
     @staticmethod
     def read_stdout(result: subprocess.CompletedProcess[str]):
-        log.debug("decoding stdout from command...")
+        return SubprocessTransport.read_stdout(result)
+
+    def _call(self, cmd_str: str):
+        """transport.call, timed and counted in sniff.metrics"""
+        call = " ".join(cmd_str.split()[2:4]) or cmd_str
+        start_s = time.perf_counter()
+        try:
+            return self.transport.call(cmd_str, self.timeout_s)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            metrics.inc("sniff_ubus_errors_total", call=call)
+            raise
+        finally:
+            metrics.observe("sniff_ubus_call_seconds",
+                            time.perf_counter() - start_s, call=call)
+
+    def _stream(self, cmd_str: str, key: str):
+        """transport.stream, timed (with the parsing it feeds) and counted
+        in sniff.metrics like _call"""
+        call = " ".join(cmd_str.split()[2:4]) or cmd_str
+        start_s = time.perf_counter()
         try:
-            obj = json.loads(result.stdout)
-            log.debug(f"got results:\n{json.dumps(obj, indent=4)}")
-        except json.decoder.JSONDecodeError as e:
-            log.debug(f"stdout is not JSON: {e}")
-            obj = result.stdout
-        log.debug("done.")
-        return obj
+            yield from self.transport.stream(cmd_str, key, self.timeout_s)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            metrics.inc("sniff_ubus_errors_total", call=call)
+            raise
+        finally:
+            metrics.observe("sniff_ubus_call_seconds",
+                            time.perf_counter() - start_s, call=call)
 
     def _get_results(self):
         self.start_s = self.start_s or time.time()
-        results = Ubus.run_cmd(self.result_cmd)
+        results = self._call(self.result_cmd)
         self.end_s = time.time()
         self.elapsed_s = self.end_s - self.start_s
-        self.result = Ubus.read_stdout(results)
+        self.result = results
         self.start_s = 0  # reset after running
         return self.result
 
@@ -78,6 +106,27 @@ class Ubus(ABC):
             log.error(e)
             return {}
 
+    def devices(self):
+        """Results parsed into devices, filtered. With `is_streaming`, each
+        device goes from ubus straight into the device parser, so the whole
+        results are never in memory at once."""
+        if not self.is_streaming or self.DEVICES_KEY is None:
+            return self.filtered(self.results())
+        self.start_s = self.start_s or time.time()
+        try:
+            devices = self.filtered(
+                {self.DEVICES_KEY: self._stream(self.result_cmd,
+                                                self.DEVICES_KEY)})
+        except subprocess.CalledProcessError as e:
+            log.error(e)
+            devices = self.filtered({})
+        self.end_s = time.time()
+        self.elapsed_s = self.end_s - self.start_s
+        self.start_s = 0
+        log.info(f"got {self.name} scan results after \
+                  {round(self.elapsed_s, 1)}s.")
+        return devices
+
     def filtered(self,
                  data: Any,
                  scan_parser: Callable = None,
@@ -85,11 +134,26 @@ class Ubus(ABC):
         scan_parser = scan_parser or self.scan_parser
         device_parser = device_parser or self.device_parser
 
+        if self.device_filter:
+            return scan_parser(data, device_parser=device_parser,
+                               keep=self.device_filter)
         return scan_parser(data, device_parser=device_parser)
 
 
 class UbusWifi(Ubus):
-    RESULT_CMD = """ubus call iwinfo scan '{"device": "wlan1"}'"""
+    """Wifi scans with iwinfo, on every radio at once.
+
+    Scans `radios` (interface names), or the ones found by discover() if
+    not given, concurrently, so a cycle takes as long as the slowest radio.
+    Results are concatenated for wifi_scan_parser, which merges BSSIDs seen
+    by several radios. `radio_timings` has each radio's timing from the
+    last results().
+    """
+    DEFAULT_RADIO = "wlan1"
+    DEVICES_CMD = "ubus call iwinfo devices"
+    INFO_CMD = """ubus call iwinfo info '{{"device": "{radio}"}}'"""
+    SCAN_CMD = """ubus call iwinfo scan '{{"device": "{radio}"}}'"""
+    RESULT_CMD = SCAN_CMD.format(radio=DEFAULT_RADIO)
     DEFAULT_SCAN_PARSER = sniff.parser.wifi_scan_parser
     DEFAULT_DEVICE_PARSER = sniff.parser.wifi_device_parser
 
@@ -97,15 +161,100 @@ class UbusWifi(Ubus):
                  result_cmd=RESULT_CMD,
                  scan_parser=DEFAULT_SCAN_PARSER,
                  device_parser=DEFAULT_DEVICE_PARSER,
+                 radios: list[str] = None,
                  **kwargs):
+        self.radios = list(radios or [])
+        self.radio_timings: dict[str, dict[str, Any]] = {}
         super().__init__(result_cmd, scan_parser, device_parser, **kwargs)
 
+    def _phy(self, radio: str):
+        try:
+            return self._call(self.INFO_CMD.format(radio=radio)).get("phy")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return None
+
+    def discover(self):
+        """Find the radios to scan with `iwinfo devices`, one interface per
+        phy since more interfaces on the same radio would scan it again.
+        Falls back to DEFAULT_RADIO if there are none."""
+        try:
+            found = self._call(self.DEVICES_CMD).get("devices", [])
+        except (subprocess.CalledProcessError,
+                subprocess.TimeoutExpired) as e:
+            log.warning(f"couldn't list wifi radios ({e}), scanning \
+                        {self.DEFAULT_RADIO}.")
+            return [self.DEFAULT_RADIO]
+        with ThreadPoolExecutor(max_workers=max(1, len(found)),
+                                thread_name_prefix="wifi") as pool:
+            phys = list(pool.map(self._phy, found))
+        by_phy: dict[str, str] = {}
+        for radio, phy in zip(found, phys):
+            by_phy.setdefault(phy or radio, radio)
+        self.radios = list(by_phy.values()) or [self.DEFAULT_RADIO]
+        log.info(f"found wifi radios: {', '.join(self.radios)}.")
+        return self.radios
+
+    def _scan_radio(self, radio: str):
+        start_s = time.time()
+        try:
+            result, error = self._call(self.SCAN_CMD.format(radio=radio)), None
+        except (subprocess.CalledProcessError,
+                subprocess.TimeoutExpired) as e:
+            log.error(f"wifi scan on {radio} failed: {e}")
+            result, error = {}, e
+        return start_s, time.time(), result, error
+
+    def _get_results(self):
+        radios = self.radios or self.discover()
+        self.start_s = time.time()
+        if len(radios) == 1:
+            scans = [self._scan_radio(radios[0])]
+        else:
+            # a pool per scan, so nothing is left running when the daemon
+            # replaces its collectors
+            with ThreadPoolExecutor(max_workers=len(radios),
+                                    thread_name_prefix="wifi") as pool:
+                scans = list(pool.map(self._scan_radio, radios))
+        self.end_s = time.time()
+        self.elapsed_s = self.end_s - self.start_s
+        self.start_s = 0
+
+        results = []
+        timings = {}
+        for radio, (start_s, end_s, result, error) in zip(radios, scans):
+            found = result.get("results", [])
+            results.extend(found)
+            timings[radio] = {"start_s": int(start_s),
+                              "elapsed_ms": round(1000 * (end_s - start_s), 1),
+                              "results": len(found)}
+            if error is not None:
+                timings[radio]["error"] = type(error).__name__
+        self.radio_timings = timings
+        if all(error is not None for *_, error in scans):
+            raise scans[-1][3]
+        log.debug("wifi radios: %s", LazyJSON(timings, indent=None))
+        self.result = {"results": results}
+        return self.result
+
 
 class UbusBLE(Ubus):
+    """Bluetooth scans with blesem.
+
+    By default results() waits `wait_s` after scan() and reads the results
+    once. With `is_adaptive`, it polls them every `poll_s` instead and stops
+    once no new device was found for `stable_s`, but never before
+    `min_wait_s` or after `max_wait_s`.
+    """
     DEFAULT_BLE_WAIT_S = 10  # seconds to wait after scanning
+    DEFAULT_POLL_S = 1
+    DEFAULT_STABLE_S = 3
+    DEFAULT_MIN_WAIT_S = 2
+    DEFAULT_MAX_WAIT_S = 20
+    TOO_SOON_STATUS = 6  # blesem: scanned too recently, wait and retry
 
     SCAN_CMD = "ubus call blesem scan.start"
     RESULT_CMD = "ubus call blesem scan.result"
+    DEVICES_KEY = "devices"
     DEFAULT_SCAN_PARSER = sniff.parser.ble_scan_parser
     DEFAULT_DEVICE_PARSER = sniff.parser.ble_device_parser
 
@@ -115,32 +264,120 @@ class UbusBLE(Ubus):
                  device_parser=DEFAULT_DEVICE_PARSER,
                  wait_s=DEFAULT_BLE_WAIT_S,
                  scan_cmd=SCAN_CMD,
+                 is_adaptive=False,
+                 poll_s=DEFAULT_POLL_S,
+                 stable_s=DEFAULT_STABLE_S,
+                 min_wait_s=DEFAULT_MIN_WAIT_S,
+                 max_wait_s=DEFAULT_MAX_WAIT_S,
                  **kwargs):
         self.wait_s = wait_s
         self._scan_s = -1
         self.scan_cmd = scan_cmd
+        self.is_adaptive = is_adaptive
+        self.poll_s = max(0.1, poll_s)
+        self.stable_s = stable_s
+        self.min_wait_s = min_wait_s
+        self.max_wait_s = max(min_wait_s, max_wait_s)
         super().__init__(result_cmd, scan_parser, device_parser, **kwargs)
 
+    @property
+    def max_scan_s(self):
+        """Longest a scan() and results() can wait for devices"""
+        return self.max_wait_s if self.is_adaptive else self.wait_s
+
+    @classmethod
+    def _is_too_soon(cls, e: subprocess.CalledProcessError):
+        return e.returncode == cls.TOO_SOON_STATUS \
+            or f"non-zero exit status {cls.TOO_SOON_STATUS}" in str(e)
+
     def scan(self):
         log.info("scanning...")
         self.start_s = time.time()
-        try:
-            _ = Ubus.run_cmd(self.scan_cmd)
-        except subprocess.CalledProcessError as e:
-            if "returned non-zero exit status 6" not in str(e):
-                raise e
-            log.warn("ble scan failed (too soon, wait before scanning)")
+        while True:
+            try:
+                _ = self._call(self.scan_cmd)
+                break
+            except subprocess.CalledProcessError as e:
+                if not self._is_too_soon(e):
+                    raise e
+                # a fixed wait reads whatever the last scan found, but
+                # polling needs a fresh scan, so retry while there's time
+                if not self.is_adaptive \
+                        or time.time() - self.start_s >= self.min_wait_s:
+                    log.warning("ble scan failed (too soon, \
+                                wait before scanning)")
+                    break
+                log.debug("ble scan too soon, retrying in %ss", self.poll_s)
+                time.sleep(self.poll_s)
         self._scan_s = time.time()
 
     def results(self):
         if self._scan_s == -1:
             self.scan()
-        log.debug(f"waiting up to {self.wait_s}s for BLE results...")
+        if self.is_adaptive:
+            return self._poll_results()
+        self._wait()
+        return super().results()
+
+    def devices(self):
+        # polling reads results several times, only the last ones are kept
+        if self.is_adaptive or not self.is_streaming:
+            return self.filtered(self.results())
+        if self._scan_s == -1:
+            self.scan()
+        self._wait()
+        return super().devices()
+
+    def _wait(self):
+        log.debug("waiting up to %ss for BLE results...", self.wait_s)
         while (time.time() - self._scan_s) < self.wait_s:
             time.sleep(0.25)
         self._scan_s = -1
 
-        return super().results()
+    def _poll_results(self):
+        """Read results every poll_s until no new devices for stable_s."""
+        log.debug("polling BLE results every %ss for %s-%ss...",
+                  self.poll_s, self.min_wait_s, self.max_wait_s)
+        scan_s, self._scan_s = self._scan_s, -1
+        seen = set()
+        result = {}
+        last_new_s = scan_s
+        polls = 0
+        while True:
+            time.sleep(max(0, min(self.poll_s,
+                                  scan_s + self.max_wait_s - time.time())))
+            now_s = time.time()
+            try:
+                result = self._call(self.result_cmd)
+            except subprocess.CalledProcessError as e:
+                if not self._is_too_soon(e):
+                    log.error(e)
+                    break
+                result = result or {}
+            polls += 1
+            macs = {d.get("address") for d in result.get("devices", [])}
+            new = len(macs - seen)
+            seen |= macs
+            if new:
+                last_new_s = now_s
+                log.debug("BLE poll %d: %d new, %d total (%.1f devices/s)",
+                          polls, new, len(seen), new / self.poll_s)
+            waited_s = now_s - scan_s
+            if waited_s >= self.max_wait_s:
+                break
+            if waited_s >= self.min_wait_s \
+                    and now_s - last_new_s >= self.stable_s:
+                break
+
+        self.end_s = time.time()
+        self.elapsed_s = self.end_s - self.start_s
+        self.start_s = 0
+        self.result = result
+        log.info(f"got {self.name} scan results after \
+                 {round(self.end_s - scan_s, 1)}s ({polls} polls, \
+                 {len(seen)} devices, stable for \
+                 {round(self.end_s - last_new_s, 1)}s).")
+        return self.result
 
 
 class UbusFW(Ubus):
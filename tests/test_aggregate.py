@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from sniff import cycle
+from sniff.aggregate import (Aggregator, NumpyAggregator, aggregate,
+                             windowed)
+from sniff.bench.__main__ import make_args
+from sniff.bench.transports import FakeTransport
+from sniff.deadline import Deadline
+from sniff.device import Device
+from sniff.bench.fakeubusd import synthetic_objects
+from sniff.ubus import UbusBLE
+
+
+def _stats(records):
+    return sorted((r.key, r.rssi, r.count, r.first_s, r.last_s, r.rssi_min,
+                   r.rssi_max, r.rssi_mean) for r in records)
+
+
+def _add_scans(agg):
+    agg.add([Device(0xA, -60), Device(0xB, -80)], now_s=100)
+    agg.add([Device(0xA, -70)], now_s=110)
+    agg.add([Device(0xA, -71), Device(0xB, -90)], now_s=120)
+    return agg
+
+
+def test_aggregator_stats():
+    agg = _add_scans(Aggregator())
+    assert agg.scans == 3
+    assert _stats(agg.records()) == [
+        (0xA, -71, 3, 100, 120, -71, -60, -67.0),
+        (0xB, -90, 2, 100, 120, -90, -80, -85.0)]
+
+
+def test_numpy_aggregator_matches():
+    pytest.importorskip("numpy")
+    from sniff import aggregate as module
+    module._import_numpy()
+    assert _stats(_add_scans(NumpyAggregator()).records()) \
+        == _stats(_add_scans(Aggregator()).records())
+    assert NumpyAggregator().records() == []
+
+
+def test_aggregate_rounds():
+    records = aggregate([(100, [Device(0xA, -60)]),
+                         (110, [Device(0xA, -70)])])
+    assert _stats(records) == [(0xA, -70, 2, 100, 110, -70, -60, -65.0)]
+
+
+def test_one_round_is_a_plain_scan():
+    devices = [Device(0xA, -60)]
+    assert windowed(lambda: devices, 1, 10) is devices
+
+
+def test_windowed_records_rounds_as_they_finish():
+    done = []
+    records = windowed(lambda: [Device(0xA, -60 - len(done))], 3, 0,
+                       done=done)
+    assert len(done) == 3
+    assert records[0].count == 3 and records[0].rssi_min == -62
+
+
+def test_windowed_skips_rounds_that_wont_finish():
+    done = []
+
+    def scan_once():
+        time.sleep(0.05)
+        return [Device(0xA, -60)]
+
+    start_s = time.monotonic()
+    records = windowed(scan_once, 10, 0.1, done=done,
+                       until_s=time.monotonic() + 0.25)
+    assert time.monotonic() - start_s < 0.3
+    assert 1 <= len(done) < 10
+    assert records[0].count == len(done)
+
+
+def test_rounds_are_clamped_to_the_budget():
+    ble = UbusBLE(wait_s=10, transport=FakeTransport())
+    assert cycle._fit_rounds(3, ble) == 3
+    assert cycle._fit_rounds(3, ble, Deadline(0)) == 3  # no budget
+    # 50s, 10s kept for the upload: rounds start at 0, 10, 20 and 30s
+    assert cycle._fit_rounds(6, ble, Deadline(50)) == 3
+    assert cycle._fit_rounds(6, ble, Deadline(5)) == 1
+    assert cycle._fit_rounds(0, ble, Deadline(50)) == 1
+
+
+def _collectors(args, fail_after, hang=False):
+    """Collectors whose wifi scans fail (or hang) after `fail_after`"""
+    collectors = cycle.make_collectors(args, FakeTransport(
+        synthetic_objects(n_wifi=3, n_ble=2)))
+    wifi, calls = collectors["wifi"], []
+    devices = wifi.devices
+
+    def failing_devices():
+        calls.append(1)
+        if len(calls) > fail_after:
+            if not hang:
+                raise ValueError("radio went away")
+            time.sleep(1)
+        return devices()
+
+    wifi.devices = failing_devices
+    return collectors
+
+
+@pytest.mark.parametrize("hang", [False, True])
+def test_cut_short_window_sends_the_scans_done(hang):
+    args = make_args("http://127.0.0.1:9/", [
+        "--scans-per-window", "3", "--collector-timeout-s", "0.3",
+        "--no-mnf", "--no-fw", "--no-system", "--no-timezone",
+        "--no-metrics"])
+    body = cycle.scan(args, _collectors(args, 2, hang))
+    assert body["scan"]["rounds"] == {"wifi": 2, "ble": 3}
+    assert len(body["wifi"]) == 3
+    assert {d.count for d in body["wifi"]} == {2}
+    assert {d.count for d in body["ble"]} == {3}
@@ -0,0 +1,72 @@
+import struct
+
+import pytest
+
+from sniff import blobmsg
+
+
+def test_round_trip():
+    table = {
+        "string": "wlan0",
+        "empty": "",
+        "int32": -61,
+        "int64": 2**40,
+        "bool": True,
+        "double": 0.25,
+        "none": None,
+        "table": {"nested": {"deeper": 1}},
+        "array": [1, "two", {"three": 3}, [4]],
+        "unicode": "café ☕",
+    }
+    assert blobmsg.decode(blobmsg.encode(table)) == table
+
+
+def test_attributes_are_padded_to_4_bytes():
+    for name in ("", "a", "ab", "abc", "abcd"):
+        for value in ("", "x", "xyz", 7, [1, 2]):
+            assert len(blobmsg.blobmsg_attr(name, value)) % 4 == 0
+
+
+def test_header_holds_id_and_length():
+    attr = blobmsg.blob_attr(5, b"abc")
+    id_len, = struct.unpack(">I", attr[:4])
+    assert id_len >> blobmsg.BLOB_ATTR_ID_SHIFT == 5
+    assert id_len & blobmsg.BLOB_ATTR_LEN_MASK == 7
+    assert attr[4:] == b"abc\0"
+
+
+def test_int16_and_int8_decode():
+    # encode() never writes int16, but ubusd replies can have it
+    data = (blobmsg.blob_attr(blobmsg.BLOBMSG_TYPE_INT16,
+                              b"\0\4word\0\0" + b"\xff\xc3",
+                              extended=True)
+            + blobmsg.blob_attr(blobmsg.BLOBMSG_TYPE_INT8,
+                                b"\0\1" + b"b\0" + b"\0",
+                                extended=True))
+    assert blobmsg.decode(data) == {"word": -61, "b": False}
+
+
+def test_iter_array_yields_items_of_named_array_only():
+    buf = blobmsg.encode({"scanning": 1,
+                          "other": [0],
+                          "devices": [{"address": "a"}, {"address": "b"}]})
+    assert list(blobmsg.iter_array(buf, "devices")) == [
+        {"address": "a"}, {"address": "b"}]
+    assert list(blobmsg.iter_array(buf, "missing")) == []
+
+
+def test_plain_blob_attributes_are_skipped():
+    buf = blobmsg.blob_attr(1, b"\0\0\0\1") + blobmsg.encode({"a": 1})
+    assert blobmsg.decode(buf) == {"a": 1}
+
+
+@pytest.mark.parametrize("length", [0, 3, 64])
+def test_bad_length_raises(length):
+    buf = struct.pack(">I", length) + b"\0" * 8
+    with pytest.raises(ValueError):
+        list(blobmsg.iter_attrs(buf))
+
+
+def test_unencodable_value_raises():
+    with pytest.raises(TypeError):
+        blobmsg.encode({"x": object()})
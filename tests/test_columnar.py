@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from sniff import columnar
+from sniff.device import Device, DeviceStats, to_dicts
+
+
+def make_body():
+    wifi = [Device(0x001E42000001, -61, "ap", quality=0.43,
+                   channels=(1, 36), bands=("2.4", "5")),
+            Device(0x001E42000002, -80, "ap"),
+            Device(0xFFFFFFFFFFFF, -40, "guest", channels=(6,),
+                   bands=("2.4",))]
+    ble = [Device(0x6CFCDEB0EE16, -61),
+           Device(0x000000000001, -100, "ap")]
+    return {"scan": {"rounds": 1}, "wifi": wifi, "ble": ble}
+
+
+def test_round_trip():
+    body = make_body()
+    encoded = columnar.encode(body)
+    assert isinstance(body["ble"][0], Device)  # not changed
+    assert encoded["strings"] == ["", "ap", "guest", "2.4", "5"]
+    decoded = columnar.decode(json.loads(json.dumps(encoded)))
+    assert decoded == {"scan": {"rounds": 1},
+                       "wifi": to_dicts(body["wifi"]),
+                       "ble": to_dicts(body["ble"])}
+
+
+def test_round_trip_stats():
+    stats = [DeviceStats(Device(0x6CFCDEB0EE16, -61), 3, 100, 160, -70,
+                         -55, -61.5)]
+    decoded = columnar.decode(columnar.encode({"ble": stats}))
+    assert decoded["ble"] == to_dicts(stats)
+
+
+def test_empty_and_rows_bodies():
+    assert columnar.decode(columnar.encode({"ble": []})) == {"ble": []}
+    assert columnar.decode({"ble": [{"mac": "x"}]}) == {"ble": [{"mac": "x"}]}
+
+
+def test_rssi_is_clamped():
+    decoded = columnar.decode(columnar.encode(
+        {"ble": [Device(1, -200), Device(2, 300)]}))
+    assert [d["rssi"] for d in decoded["ble"]] == [-128, 127]
+
+
+@pytest.mark.parametrize("change", [
+    {"format_version": 2},
+    {"ble": {"n": 3, "mac": "AAAAAAAB", "rssi": "ww==", "host": [0]}},
+    {"ble": {"n": 1, "mac": "AAAAAAAB", "rssi": "ww", "host": [0]}},
+    {"ble": {"n": 1, "mac": "AAAAAAAB", "rssi": "ww==", "host": []}},
+    {"ble": {"n": 1, "mac": "AAAAAAAB", "rssi": "ww==", "host": [7]}},
+    {"ble": {"n": 1, "mac": "AAAAAAAB", "rssi": "ww=="}},
+])
+def test_bad_bodies(change):
+    body = {**columnar.encode({"ble": [Device(1, -61)]}), **change}
+    with pytest.raises(ValueError):
+        columnar.decode(body)
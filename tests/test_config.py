@@ -0,0 +1,78 @@
+import logging
+
+import pytest
+
+from sniff.cli import config
+from sniff.cli.sniff import create_parser
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    """(new path, legacy path), neither written yet, run from tmp_path"""
+    new = tmp_path / "etc" / "config.ini"
+    monkeypatch.setattr(config, "DEFAULT_CONFIG_FILE", str(new))
+    monkeypatch.setattr(config, "_warned", set())
+    monkeypatch.chdir(tmp_path)
+    return new, tmp_path / "config.ini"
+
+
+def _write(path, **options):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("[DEFAULT]\n" + "".join(f"{k} = {v}\n"
+                                            for k, v in options.items()))
+
+
+def test_nothing_written_without_flag(paths):
+    new, legacy = paths
+    args = config.get_or_write_config(create_parser(), argv=[])
+    assert args["api_url"] == ""
+    assert not new.exists() and not legacy.exists()
+
+
+def test_write_config_then_read_it(paths):
+    new, _ = paths
+    config.get_or_write_config(create_parser(), argv=[
+        "--write-config", "--api-url", "https://a.example.com/"])
+    assert "write_config" not in new.read_text()
+    args = config.get_or_write_config(create_parser(), argv=[])
+    assert args["api_url"] == "https://a.example.com/"
+    assert args["write_config"] is False
+    # flags still win over the file
+    args = config.get_or_write_config(create_parser(), argv=[
+        "--api-url", "https://b.example.com/"])
+    assert args["api_url"] == "https://b.example.com/"
+
+
+def test_legacy_config_is_read_with_a_warning(paths, caplog):
+    new, legacy = paths
+    _write(legacy, api_url="https://old.example.com/")
+    with caplog.at_level(logging.WARNING):
+        args = config.get_or_write_config(create_parser(), argv=[])
+        assert config.find_config() == str(legacy)
+    assert args["api_url"] == "https://old.example.com/"
+    assert len([r for r in caplog.records
+                if "deprecated" in r.message]) == 1
+
+    # --write-config moves its settings to the new path
+    config.get_or_write_config(create_parser(), argv=["--write-config"])
+    assert "https://old.example.com/" in new.read_text()
+    assert config.find_config() == str(new)
+
+
+def test_new_config_wins_over_legacy(paths, caplog):
+    new, legacy = paths
+    _write(legacy, api_url="https://old.example.com/")
+    _write(new, api_url="https://new.example.com/")
+    with caplog.at_level(logging.WARNING):
+        args = config.get_or_write_config(create_parser(), argv=[])
+    assert args["api_url"] == "https://new.example.com/"
+    assert not caplog.records
+
+
+def test_bad_choice_in_config_is_a_usage_error(paths, capsys):
+    new, _ = paths
+    _write(new, compression="zstd")
+    with pytest.raises(SystemExit) as e:
+        config.get_or_write_config(create_parser(), argv=[])
+    assert e.value.code == 2
+    assert "invalid choice 'zstd'" in capsys.readouterr().err
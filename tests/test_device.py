@@ -0,0 +1,76 @@
+import pytest
+
+from sniff.device import (Device, DeviceStats, dedupe, int_to_mac,
+                          mac_to_int, to_dicts)
+
+KEY = 0x02BD890FA175
+
+
+@pytest.mark.parametrize("mac", [
+    "02:BD:89:0F:A1:75",
+    "02:bd:89:0f:a1:75",
+    "2:BD:89:F:A1:75",
+    "02-BD-89-0F-A1-75",
+    "02BD890FA175",
+])
+def test_mac_to_int(mac):
+    assert mac_to_int(mac) == KEY
+
+
+@pytest.mark.parametrize("mac", [
+    "",
+    "02:BD:89:0F:A1",
+    "02:BD:89:0F:A1:75:00",
+    "02:BD:89:0F:A1:",
+    "02:BD:89:0F:A1:175",
+    "02:BD:89:0F:A1:7G",
+    "+2:BD:89:0F:A1:75",
+    " 2:BD:89:0F:A1:75",
+    "02:BD:89:0F:A1: 5",
+    "02:BD:89:0F:A1:+f",
+    "0x:BD:89:0F:A1:75",
+    "0x02BD890FA1",
+    "+02BD890FA175",
+    " 02BD890FA17",
+    "02BD890FA175\n",
+    "02_BD_89_0F_A1_75",
+])
+def test_mac_to_int_rejects(mac):
+    with pytest.raises(ValueError):
+        mac_to_int(mac)
+
+
+def test_int_to_mac_round_trip():
+    assert int_to_mac(KEY) == "02:BD:89:0F:A1:75"
+    assert int_to_mac(0xA) == "00:00:00:00:00:0A"
+    assert mac_to_int(int_to_mac(KEY)) == KEY
+
+
+def test_to_dict():
+    assert Device(KEY, -61).to_dict() == {
+        "rssi": -61, "host": "", "mac": "02:BD:89:0F:A1:75"}
+    wifi = Device(KEY, -61, "ssid", quality=0.5, channels=(1, 36),
+                  bands=("2g", "5g"))
+    assert wifi.to_dict() == {
+        "quality": 0.5, "rssi": -61, "host": "ssid",
+        "mac": "02:BD:89:0F:A1:75", "channels": [1, 36],
+        "bands": ["2g", "5g"]}
+    assert to_dicts([wifi]) == [wifi.to_dict()]
+
+
+def test_device_stats_to_dict():
+    stats = DeviceStats(Device(KEY, -61), 2, 100, 110, -70, -60, -65.0)
+    assert stats.to_dict() == {
+        "rssi": -61, "host": "", "mac": "02:BD:89:0F:A1:75", "count": 2,
+        "first_s": 100, "last_s": 110, "rssi_min": -70, "rssi_max": -60,
+        "rssi_mean": -65.0}
+
+
+def test_dedupe_keeps_the_strongest_and_every_channel():
+    weak = Device(KEY, -80, channels=(1,), bands=("2g",))
+    strong = Device(KEY, -50, channels=(36,), bands=("5g",))
+    other = Device(0xA, -70)
+    deduped = dedupe([weak, other, strong])
+    assert deduped == [strong, other]
+    assert strong.channels == (1, 36)
+    assert strong.bands == ("2g", "5g")
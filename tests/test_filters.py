@@ -0,0 +1,119 @@
+import logging
+
+import pytest
+
+from sniff.device import mac_to_int
+from sniff.filters import (DeviceFilter, MacPrefixes, is_random,
+                           is_random_ble, parse_prefix)
+from sniff.parser import ble_device_parser
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    ("AC:23:3F", (0xAC233F, 24)),
+    ("ac-23-3f", (0xAC233F, 24)),
+    ("AC233F", (0xAC233F, 24)),
+    ("AC-23-3F-A/28", (0xAC233FA, 28)),
+    ("C3:00:00/20", (0xC3000, 20)),
+    ("C3/12", (0xC30, 12)),
+    ("AC:23:3F:01:02:03", (0xAC233F010203, 48)),
+])
+def test_parse_prefix(prefix, expected):
+    assert parse_prefix(prefix) == expected
+
+
+@pytest.mark.parametrize("prefix", [
+    "", "AC:23:3G", "AC/x", "AC/0", "AC/49", "AC:23:3F:01:02:03:04",
+])
+def test_parse_prefix_rejects(prefix):
+    with pytest.raises(ValueError):
+        parse_prefix(prefix)
+
+
+def test_mac_prefixes_of_any_length():
+    prefixes = MacPrefixes(["AC:23:3F", "C3:00:00/20", "11:22:33:44:55:66"])
+    assert prefixes
+    assert mac_to_int("AC:23:3F:01:02:03") in prefixes
+    assert mac_to_int("C3:00:0F:FF:FF:FF") in prefixes
+    assert mac_to_int("C3:00:10:00:00:00") not in prefixes
+    assert mac_to_int("11:22:33:44:55:66") in prefixes
+    assert mac_to_int("11:22:33:44:55:67") not in prefixes
+    assert not MacPrefixes()
+    assert 0 not in MacPrefixes()
+
+
+def test_is_random():
+    assert is_random(mac_to_int("02:00:00:00:00:01"))
+    assert is_random(mac_to_int("DA:A1:19:00:00:01"))
+    assert not is_random(mac_to_int("AC:23:3F:00:00:01"))
+
+
+@pytest.mark.parametrize("mac, expected", [
+    ("40:00:00:00:00:01", True),   # 0b01, resolvable private
+    ("C0:00:00:00:00:01", True),   # 0b11, random static
+    ("00:00:00:00:00:01", False),  # 0b00, public or non-resolvable
+    ("80:00:00:00:00:01", False),  # 0b10, reserved
+    ("6C:FC:DE:00:00:01", True),   # a public OUI, but it looks random
+])
+def test_is_random_ble(mac, expected):
+    assert is_random_ble(mac_to_int(mac)) is expected
+
+
+def test_no_rules_keeps_everything():
+    keep = DeviceFilter()
+    assert not keep
+    assert keep.keeps(mac_to_int("02:00:00:00:00:01"), "anything")
+
+
+def test_allow_and_deny():
+    keep = DeviceFilter(allow_macs=["AC:23:3F"], allow_names=["Tile*"],
+                        deny_macs=["AC:23:3F:FF"], deny_names=["*TV*"])
+    assert keep
+    assert keep.keeps(mac_to_int("AC:23:3F:01:02:03"))
+    assert keep.keeps(mac_to_int("00:11:22:33:44:55"), "tile mate")
+    assert not keep.keeps(mac_to_int("00:11:22:33:44:55"), "phone")
+    # deny rules win over allow rules
+    assert not keep.keeps(mac_to_int("AC:23:3F:FF:02:03"))
+    assert not keep.keeps(mac_to_int("AC:23:3F:01:02:03"), "Tile TV")
+
+
+def test_drop_random_wifi():
+    keep = DeviceFilter(drop_random=True)
+    assert not keep.keeps(mac_to_int("DA:A1:19:00:00:01"))
+    assert keep.keeps(mac_to_int("6C:FC:DE:00:00:01"))
+
+
+def test_drop_random_ble_keeps_allowed_public_looking(caplog):
+    keep = DeviceFilter(allow_macs=["6C:FC:DE"], allow_names=["Tag*"],
+                        drop_random=True, is_ble=True)
+    with caplog.at_level(logging.INFO):
+        assert keep.keeps(mac_to_int("6C:FC:DE:00:00:01"))
+        assert keep.keeps(mac_to_int("6C:FC:DE:00:00:02"))
+    # logged once per OUI
+    assert len([r for r in caplog.records if "6CFCDE*" in r.message]) == 1
+    # allowed by name only, it still goes by the top bits
+    assert not keep.keeps(mac_to_int("4A:00:00:00:00:01"), "Tag 1")
+    assert keep.keeps(mac_to_int("0A:00:00:00:00:01"), "Tag 1")
+
+
+def test_drop_random_ble_by_address_type():
+    keep = DeviceFilter(drop_random=True, is_ble=True)
+    public = mac_to_int("F4:CE:36:00:00:01")
+    assert not keep.keeps(public)
+    assert keep.keeps(public, is_random=False)
+    assert not keep.keeps(mac_to_int("0A:00:00:00:00:01"), is_random=True)
+
+
+def test_ble_parser_reads_the_address_type():
+    keep = DeviceFilter(drop_random=True, is_ble=True)
+    public = {"address": "F4:CE:36:00:00:01", "rssi": -60}
+    assert ble_device_parser(public, keep) is None
+    assert ble_device_parser({**public, "address_type": "public"}, keep)
+    assert ble_device_parser({**public, "addr_type": 1}, keep) is None
+
+
+def test_min_rssi_is_checked_by_the_parser():
+    keep = DeviceFilter(min_rssi=-80)
+    assert keep
+    device = {"address": "AC:23:3F:01:02:03", "rssi": -90}
+    assert ble_device_parser(device, keep) is None
+    assert ble_device_parser({**device, "rssi": -70}, keep).rssi == -70
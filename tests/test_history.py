@@ -0,0 +1,98 @@
+import argparse
+import json
+
+import pytest
+
+from sniff.cli import history as cli
+from sniff.device import Device, mac_to_int
+from sniff.history import History, HEADER_BYTES, RECORD_BYTES
+
+A = mac_to_int("AC:23:3F:00:00:01")
+B = mac_to_int("AC:23:3F:00:00:02")
+C = mac_to_int("00:1E:42:00:00:03")
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = History(str(tmp_path / "history.bin"), capacity=4).open()
+    yield history
+    history.close()
+
+
+def times(sightings):
+    return [s.t_s for s in sightings]
+
+
+@pytest.mark.parametrize("is_numpy", [True, False])
+def test_ring_wraps_around(history, is_numpy):
+    for t_s in range(1, 7):
+        history.append("ble", [Device(A, -60)], t_s=t_s)
+    assert (history.count, len(history)) == (6, 4)
+    assert times(history.query(is_numpy=is_numpy)) == [3, 4, 5, 6]
+
+
+@pytest.mark.parametrize("is_numpy", [True, False])
+def test_query_filters(history, is_numpy):
+    history.append("wifi", [Device(A, -50), Device(C, -90)], t_s=100)
+    history.append("ble", [Device(B, -70), Device(A, -200)], t_s=200)
+
+    def query(**kwargs):
+        return [(s.mac, s.t_s, s.rssi, s.source)
+                for s in history.query(is_numpy=is_numpy, **kwargs)]
+
+    assert query(macs=["AC:23:3F"], source="ble") == \
+        [("AC:23:3F:00:00:02", 200, -70, "ble"),
+         ("AC:23:3F:00:00:01", 200, -128, "ble")]
+    assert query(macs=["00:1E:42:00:00:03", "AC:23:3F:00:00:02"]) == \
+        [("00:1E:42:00:00:03", 100, -90, "wifi"),
+         ("AC:23:3F:00:00:02", 200, -70, "ble")]
+    assert query(since_s=150, min_rssi=-80) == \
+        [("AC:23:3F:00:00:02", 200, -70, "ble")]
+    assert query(until_s=150, max_rssi=-60) == \
+        [("00:1E:42:00:00:03", 100, -90, "wifi")]
+    with pytest.raises(ValueError):
+        query(macs=["not a mac"])
+
+
+def test_kept_between_runs(history):
+    history.append("ble", [Device(A, -60)], t_s=1)
+    reader = History(history.path, capacity=100, is_read_only=True).open()
+    history.append("ble", [Device(B, -60)], t_s=2)
+    assert times(reader.query()) == [1, 2]  # sees later appends
+    assert reader.capacity == 4
+    reader.close()
+
+
+def test_bad_files(tmp_path):
+    path = tmp_path / "history.bin"
+    with pytest.raises(OSError):
+        History(str(path), is_read_only=True).open()
+    path.write_bytes(b"not a history file")
+    with pytest.raises(ValueError):
+        History(str(path), is_read_only=True).open()
+    history = History(str(path), capacity=2).open()  # remade
+    assert len(history) == 0
+    history.close()
+    assert path.stat().st_size == HEADER_BYTES + 2 * RECORD_BYTES
+
+
+def test_cli(tmp_path, history, capsys):
+    history.append("wifi", [Device(A, -50)], t_s=100)
+    history.append("ble", [Device(A, -60), Device(B, -70)], t_s=200)
+    cli.main(["--history-path", history.path, "--json", "--last"])
+    out, err = capsys.readouterr()
+    assert [json.loads(line) for line in out.splitlines()] == [
+        {"t_s": 200, "source": "ble", "rssi": -60,
+         "mac": "AC:23:3F:00:00:01"},
+        {"t_s": 200, "source": "ble", "rssi": -70,
+         "mac": "AC:23:3F:00:00:02"}]
+    assert err.startswith("2 of 3 sightings")
+    with pytest.raises(SystemExit):
+        cli.main(["--history-path", str(tmp_path / "missing.bin")])
+
+
+def test_parse_time():
+    assert cli.parse_time("15m", now_s=1000) == 100
+    assert cli.parse_time("1700000000") == 1700000000
+    with pytest.raises(argparse.ArgumentTypeError):
+        cli.parse_time("yesterday")
@@ -0,0 +1,102 @@
+import json
+import logging
+
+import pytest
+
+from sniff.logger import (BatchFileHandler, BufferedHandler, LazyJSON,
+                          JSONFormatter, init_logger)
+
+
+def record(msg, level=logging.INFO, created=1000.0):
+    r = logging.LogRecord("sniff", level, "cycle.py", 1, msg, None, None)
+    r.created = created
+    return r
+
+
+def make_handler(tmp_path, **kwargs):
+    target = BatchFileHandler(str(tmp_path / "sniff.log"), maxBytes=200,
+                              backupCount=1)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    return BufferedHandler(target, **{"capacity": 10, "flush_s": 60,
+                                      **kwargs})
+
+
+def read(tmp_path, name="sniff.log"):
+    return (tmp_path / name).read_text().splitlines()
+
+
+def test_buffers_until_warning(tmp_path):
+    handler = make_handler(tmp_path)
+    handler.handle(record("a"))
+    handler.handle(record("b"))
+    assert read(tmp_path) == []
+    handler.handle(record("oops", logging.WARNING))
+    assert read(tmp_path) == ["a", "b", "oops"]
+    handler.handle(record("c"))
+    handler.close()
+    assert read(tmp_path) == ["a", "b", "oops", "c"]
+
+
+def test_flushes_when_full_or_old(tmp_path):
+    handler = make_handler(tmp_path, capacity=3)
+    for msg in "abc":
+        handler.handle(record(msg))
+    assert read(tmp_path) == ["a", "b", "c"]
+    handler.handle(record("d", created=1000))
+    handler.handle(record("e", created=1059))
+    assert read(tmp_path) == ["a", "b", "c"]
+    handler.handle(record("f", created=1060))
+    assert read(tmp_path) == ["a", "b", "c", "d", "e", "f"]
+    handler.close()
+
+
+def test_rotates_by_size(tmp_path):
+    handler = make_handler(tmp_path)
+    for i in range(30):
+        handler.handle(record(f"line {i:02d} " + "x" * 20))
+    handler.close()
+    assert read(tmp_path)[-1].startswith("line 29")
+    assert read(tmp_path, "sniff.log.1")
+    assert not (tmp_path / "sniff.log.2").exists()
+
+
+def test_json_lines():
+    r = record("found   %s", logging.WARNING)
+    r.args = (LazyJSON({"n": 2}, indent=None),)
+    line = json.loads(JSONFormatter().format(r))
+    assert line["msg"] == 'found {"n": 2}'
+    assert (line["level"], line["ts"], line["line"]) == ("WARNING", 1000.0, 1)
+
+
+def test_lazy_json_is_encoded_once():
+    data = {"n": 1}
+    lazy = LazyJSON(data)
+    assert str(lazy) == '{\n    "n": 1\n}'
+    data["n"] = 2
+    assert str(lazy) == '{\n    "n": 1\n}'
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_init_logger(tmp_path, root_logger):
+    path = str(tmp_path / "sniff.log")
+    init_logger(log_path=path, log_level="INFO", log_json=True,
+                is_log_to_console=False, log_buffer=10)
+    logging.info("scanned   %d devices", 3)
+    assert read(tmp_path) == []
+    init_logger(log_path=path, log_level="INFO", log_buffer=1,
+                log_format="%(levelname)s %(message)s")
+    logging.info("scanned   %d devices", 4)
+    lines = read(tmp_path)
+    assert json.loads(lines[0])["msg"] == "scanned 3 devices"
+    assert lines[1] == "INFO scanned 4 devices"
@@ -0,0 +1,86 @@
+import pytest
+
+from sniff import metrics
+from sniff.metrics import Metrics
+
+
+@pytest.fixture(autouse=True)
+def no_global_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "_METRICS", None)
+
+
+def test_disabled_does_nothing():
+    metrics.inc("sniff_x_total")
+    with metrics.timer("sniff_x_seconds"):
+        pass
+    metrics.save()
+    assert metrics.summary() == {}
+
+
+def test_counters_gauges_and_summary():
+    m = Metrics(None)
+    m.inc("sniff_upload_errors_total", kind="timeout")
+    m.inc("sniff_upload_errors_total", 2, kind="timeout")
+    m.set_gauge("sniff_devices", 5, section="wifi")
+    m.set_gauge("sniff_churn", 0.25)
+    m.observe("sniff_ubus_call_seconds", 0.0121, call="iwinfo scan")
+    assert m.summary() == {"upload_errors": {"timeout": 3},
+                           "devices": {"wifi": 5},
+                           "churn": 0.25,
+                           "ubus_call_ms": {"iwinfo scan": 12.1}}
+
+
+def test_histogram_buckets_are_cumulative():
+    m = Metrics(None)
+    for value in (0.003, 0.02, 0.02, 100):
+        m.observe("sniff_cycle_seconds", value)
+    lines = m.render().splitlines()
+    assert "# TYPE sniff_cycle_seconds histogram" in lines
+    assert 'sniff_cycle_seconds_bucket{le="0.005"} 1' in lines
+    assert 'sniff_cycle_seconds_bucket{le="0.025"} 3' in lines
+    assert 'sniff_cycle_seconds_bucket{le="30"} 3' in lines
+    assert 'sniff_cycle_seconds_bucket{le="+Inf"} 4' in lines
+    assert "sniff_cycle_seconds_count 4" in lines
+
+
+def test_render_labels_and_help():
+    m = Metrics(None)
+    m.inc("sniff_target_uploads_total", target="cloud", result="ok")
+    text = m.render()
+    assert "# HELP sniff_target_uploads_total" in text
+    assert 'sniff_target_uploads_total{result="ok",target="cloud"} 1' \
+        in text
+
+
+def test_start_cycle_keeps_totals():
+    m = Metrics(None)
+    m.inc("sniff_upload_errors_total")
+    m.set_gauge("sniff_devices", 5)
+    m.start_cycle("sniff_upload")
+    assert m.summary() == {"devices": 5}
+    m.start_cycle()
+    assert m.summary() == {}
+    assert m.counters["sniff_upload_errors_total"] == {(): 1}
+
+
+def test_totals_carry_over_between_runs(tmp_path):
+    path = str(tmp_path / "metrics.prom")
+    m = metrics.configure(path)
+    metrics.inc("sniff_upload_errors_total", kind="timeout")
+    metrics.observe("sniff_cycle_seconds", 0.02)
+    metrics.save()
+    assert "sniff_upload_errors_total" in open(path).read()
+
+    m = metrics.configure(path)
+    metrics.inc("sniff_upload_errors_total", kind="timeout")
+    metrics.observe("sniff_cycle_seconds", 0.02)
+    assert m.counters["sniff_upload_errors_total"] \
+        == {(("kind", "timeout"),): 2}
+    assert m.histograms["sniff_cycle_seconds"][()][-1] == 2
+
+
+def test_bad_state_is_ignored(tmp_path):
+    path = tmp_path / "metrics.prom"
+    (tmp_path / "metrics.prom.json").write_text("{not json")
+    m = metrics.configure(str(path))
+    assert m.counters == {}
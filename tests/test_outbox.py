@@ -0,0 +1,180 @@
+import json
+import os
+
+import pytest
+
+from sniff import outbox as module
+from sniff.outbox import Outbox, is_permanent
+from sniff.stream import iter_encode
+
+
+class Status(Exception):
+    """An HTTP error status, like urllib's HTTPError"""
+
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class API():
+    """Records what's posted and answers with `errors`, in turn, then ok"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.posts = []
+
+    def __call__(self, data):
+        self.posts.append(json.loads(b"".join(iter_encode(data))))
+        return (self.errors.pop(0) if self.errors else None), None
+
+    @property
+    def bodies(self):
+        """Every body posted, in order, whether in a list or alone"""
+        return [b for p in self.posts
+                for b in (p if isinstance(p, list) else [p])]
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / "outbox"), backoff_s=60)
+
+
+def test_bodies_are_queued_as_they_are(outbox):
+    body = {"scan": 1}
+    item_id = outbox.put(body)
+    assert body == {"scan": 1}
+    assert len(outbox) == 1
+    [(name, _)] = outbox.items()
+    assert item_id in name
+    # a body with an id (--body-id) keeps it
+    assert outbox.put({"id": "abc", "scan": 2}) == "abc"
+
+
+def test_drain_sends_oldest_first_one_at_a_time(outbox):
+    for i in range(3):
+        outbox.put({"n": i})
+    api = API()
+    assert outbox.drain(api) == 3
+    assert api.posts == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert len(outbox) == 0
+
+
+def test_drain_in_batches(tmp_path):
+    outbox = Outbox(str(tmp_path), batch_size=2)
+    for i in range(3):
+        outbox.put({"n": i})
+    api = API()
+    assert outbox.drain(api) == 3
+    assert api.posts == [[{"n": 0}, {"n": 1}], {"n": 2}]
+
+
+def test_failure_backs_off_and_keeps_items(outbox):
+    outbox.put({"n": 0})
+    outbox.put({"n": 1})
+    api = API(Status(503))
+    assert outbox.drain(api) == 0
+    assert len(outbox) == 2
+    state = outbox._read_state()
+    assert state["failures"] == 1 and state["next_s"] > 0
+    # still backing off, nothing is posted
+    assert outbox.drain(api) == 0
+    assert len(api.posts) == 1
+
+
+def test_backoff_grows_and_resets(outbox, monkeypatch):
+    monkeypatch.setattr(module.random, "uniform", lambda a, b: 1)
+    assert [outbox._backoff(n) for n in (1, 2, 3)] == [60, 120, 240]
+    assert outbox._backoff(100) == outbox.max_backoff_s
+
+    outbox.put({"n": 0})
+    outbox._write_state(3, 0)  # failed before, but due now
+    assert outbox.drain(API()) == 1
+    assert outbox._read_state() == {"failures": 0, "next_s": 0}
+
+
+def test_replayed_in_a_later_run(outbox):
+    outbox.put({"n": 0})
+    assert outbox.drain(API(Status(500))) == 0
+    outbox._write_state(1, 0)
+    # a new process, same directory
+    later = Outbox(outbox.path)
+    api = API()
+    assert later.drain(api) == 1
+    assert api.posts == [{"n": 0}]
+
+
+def test_acked_items_are_not_sent_twice(outbox):
+    outbox.put({"n": 0})
+    outbox.put({"n": 1})
+    [(first, _), _] = outbox.items()
+    # delivered, then sniff died before deleting the file
+    with open(os.path.join(outbox.path, "acked.log"), "w") as f:
+        f.write(f"{first}\n")
+    api = API()
+    assert outbox.drain(api) == 1
+    assert api.posts == [{"n": 1}]
+    # the log only keeps this drain's items
+    assert first not in outbox._read_acked()
+
+
+def test_rejected_item_is_dropped(outbox):
+    outbox.put({"n": 0})
+    outbox.put({"n": 1})
+    api = API(Status(400))
+    assert outbox.drain(api) == 1
+    assert api.posts == [{"n": 0}, {"n": 1}]
+    assert len(outbox) == 0
+
+
+def test_rejected_batch_is_retried_one_at_a_time(tmp_path):
+    outbox = Outbox(str(tmp_path), batch_size=3)
+    for i in range(4):
+        outbox.put({"n": i})
+    # the list is too big for the API, then body 1 is bad
+    api = API(Status(413), None, Status(400))
+    assert outbox.drain(api) == 3
+    assert [len(p) if isinstance(p, list) else 1 for p in api.posts] \
+        == [3, 1, 1, 1, 1]
+    assert api.bodies[3:] == [{"n": i} for i in range(4)]
+    assert len(outbox) == 0
+
+
+def test_unreadable_item_is_dropped_and_not_counted(outbox):
+    outbox.put({"n": 0})
+    outbox.put({"n": 1})
+    [(first, _), _] = outbox.items()
+    open(os.path.join(outbox.path, first), "w").close()
+    api = API()
+    assert outbox.drain(api) == 1
+    assert api.posts == [{"n": 1}]
+
+
+def test_out_of_time_leaves_items(outbox):
+    outbox.put({"n": 0})
+    assert outbox.drain(API(), is_out_of_time=lambda: True) == 0
+    assert len(outbox) == 1
+
+
+def test_oldest_are_dropped_over_the_limits(tmp_path):
+    outbox = Outbox(str(tmp_path), max_items=2)
+    for i in range(3):
+        outbox.put({"n": i})
+    api = API()
+    outbox.drain(api)
+    assert api.posts == [{"n": 1}, {"n": 2}]
+
+
+def test_body_over_max_bytes_isnt_queued(tmp_path):
+    outbox = Outbox(str(tmp_path), max_bytes=100)
+    outbox.put({"n": 0})
+    assert outbox.put({"big": "x" * 200}) is None
+    # the backlog is kept
+    assert len(outbox) == 1
+
+
+@pytest.mark.parametrize("code, expected", [
+    (400, True), (404, True), (413, True), (408, False), (429, False),
+    (500, False), (None, False),
+])
+def test_is_permanent(code, expected):
+    assert is_permanent(Status(code)) is expected
@@ -0,0 +1,94 @@
+from sniff.device import Device
+from sniff.presence import ENTER, EXIT, UPDATE, PresenceTracker
+
+
+def _events(events):
+    return [(e["event"], e["mac"][-2:]) for e in events]
+
+
+def test_enter_once():
+    tracker = PresenceTracker(path=None)
+    events = tracker.update("ble", [Device(0xA, -60)], now_s=100)
+    assert events == [{"event": ENTER, "rssi": -60, "host": "",
+                       "mac": "00:00:00:00:00:0A"}]
+    assert tracker.update("ble", [Device(0xA, -60)], now_s=110) == []
+
+
+def test_exit_after_misses_in_a_row():
+    tracker = PresenceTracker(path=None, exit_after_misses=3)
+    tracker.update("ble", [Device(0xA, -60)], now_s=100)
+    assert tracker.update("ble", [], now_s=110) == []
+    assert tracker.update("ble", [], now_s=120) == []
+    assert tracker.update("ble", [], now_s=130) == [
+        {"event": EXIT, "mac": "00:00:00:00:00:0A", "last_seen_s": 100}]
+    assert tracker.devices["ble"] == {}
+
+
+def test_a_sighting_resets_the_misses():
+    tracker = PresenceTracker(path=None, exit_after_misses=2)
+    tracker.update("ble", [Device(0xA, -60)], now_s=100)
+    tracker.update("ble", [], now_s=110)
+    tracker.update("ble", [Device(0xA, -60)], now_s=120)
+    assert tracker.update("ble", [], now_s=130) == []
+    assert _events(tracker.update("ble", [], now_s=140)) == [(EXIT, "0A")]
+
+
+def test_update_only_past_the_rssi_delta():
+    tracker = PresenceTracker(path=None, rssi_delta=5)
+    tracker.update("wifi", [Device(0xA, -60)])
+    assert tracker.update("wifi", [Device(0xA, -64)]) == []
+    assert _events(tracker.update("wifi", [Device(0xA, -65)])) \
+        == [(UPDATE, "0A")]
+    # compared to the last RSSI sent, not the last seen
+    assert tracker.update("wifi", [Device(0xA, -61)]) == []
+    assert _events(tracker.update("wifi", [Device(0xA, -70)])) \
+        == [(UPDATE, "0A")]
+
+
+def test_sections_are_separate():
+    tracker = PresenceTracker(path=None, exit_after_misses=1)
+    tracker.update("wifi", [Device(0xA, -60)])
+    assert _events(tracker.update("ble", [Device(0xA, -60)])) \
+        == [(ENTER, "0A")]
+    assert _events(tracker.update("wifi", [])) == [(EXIT, "0A")]
+
+
+def test_state_is_kept_between_runs(tmp_path):
+    path = str(tmp_path / "presence.json")
+    tracker = PresenceTracker(path=path, exit_after_misses=2)
+    tracker.apply({"wifi": [], "ble": [Device(0xA, -60)]})
+    tracker = PresenceTracker(path=path, exit_after_misses=2)
+    assert tracker.update("ble", [Device(0xA, -60)]) == []
+    tracker.save()
+    tracker = PresenceTracker(path=path, exit_after_misses=2)
+    tracker.update("ble", [])
+    assert _events(tracker.update("ble", [])) == [(EXIT, "0A")]
+
+
+def test_bad_state_is_ignored(tmp_path):
+    path = tmp_path / "presence.json"
+    path.write_text("{not json")
+    tracker = PresenceTracker(path=str(path))
+    assert _events(tracker.update("ble", [Device(0xA, -60)])) \
+        == [(ENTER, "0A")]
+
+
+def test_apply_keyframes_keep_the_lists():
+    tracker = PresenceTracker(path=None, keyframe_s=3600)
+    body = tracker.apply({"wifi": [], "ble": [Device(0xA, -60)]})
+    assert body["presence"]["keyframe"] is True
+    assert len(body["ble"]) == 1
+    assert _events(body["presence"]["ble"]) == [(ENTER, "0A")]
+
+    body = tracker.apply({"wifi": [], "ble": [Device(0xB, -60)]})
+    assert body["presence"]["keyframe"] is False
+    assert body["ble"] == []
+    assert _events(body["presence"]["ble"]) == [(ENTER, "0B")]
+
+
+def test_skipped_sections_dont_count_as_misses():
+    tracker = PresenceTracker(path=None, exit_after_misses=1)
+    tracker.update("ble", [Device(0xA, -60)])
+    body = tracker.apply({"wifi": [], "ble": []}, skip=("ble",))
+    assert body["presence"]["ble"] == []
+    assert 0xA in tracker.devices["ble"]
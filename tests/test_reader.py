@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import sniff.params as ps
+from sniff.reader import DataSenderReader, index_uci, parse_uci
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "data_sender")
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """A copy of the fixture, with the parse cache in tmp_path"""
+    monkeypatch.setattr(ps, "UCI_CACHE_DIR", str(tmp_path / "uci"))
+    monkeypatch.setattr(DataSenderReader, "_parsed", {})
+    path = tmp_path / "data_sender"
+    shutil.copy(FIXTURE, path)
+    return str(path)
+
+
+def _parse():
+    with open(FIXTURE) as f:
+        return parse_uci(f)
+
+
+def test_quoting():
+    outputs = _parse()
+    cloud = outputs["output 2"]
+    # '#' and quotes inside quotes are values, not comments
+    assert cloud["http_host"] == "https://a.example.com/#frag"
+    assert cloud["http_header"][1] == "x-api-key: a'b#c"
+    # double quotes and no quotes
+    assert outputs["output @output[0]"]["name"] == "site collector"
+    assert outputs["output @output[0]"]["http_host"] \
+        == "http://10.0.0.2:8080/"
+
+
+def test_sections_have_type_and_name():
+    assert _parse()["collection 1"] == {
+        "__type__": "collection", "__name__": "1", "name": "aws_wifi",
+        "output": "2", "input": ["3", "4"], "enabled": "0"}
+
+
+def test_anonymous_sections_are_numbered_per_type():
+    config = _parse()
+    assert [s for s in config if s.startswith("output")] == [
+        "output 2", "output @output[0]", "output @output[1]"]
+    assert config["output @output[1]"]["name"] == "disabled"
+    assert config["output @output[1]"]["__name__"] == "@output[1]"
+
+
+def test_list_options():
+    config = _parse()
+    assert config["output 2"]["http_header"] == [
+        "content-type: application/json", "x-api-key: a'b#c"]
+    # an option stays a string, even if another section has it as a list
+    assert config["output @output[0]"]["http_header"] \
+        == "content-type: application/json"
+
+
+def test_bad_lines_are_skipped():
+    config = parse_uci(["option before_any_section 1",
+                        "config output 'x'",
+                        "  option http_host 'unterminated",
+                        "  option name ok"])
+    assert config == {"output x": {"__type__": "output", "__name__": "x",
+                                   "name": "ok"}}
+
+
+def test_index_keeps_file_order():
+    index = index_uci(_parse())
+    assert index["http_host"] == [("output 2", "http_host"),
+                                  ("output @output[0]", "http_host"),
+                                  ("output @output[1]", "http_host")]
+
+
+@pytest.mark.parametrize("query", [
+    "**/http_host",
+    "*/http_host",
+    "output */http_host",
+    "output 2/http_host",
+    "**/missing",
+    "nothing/http_host",
+])
+def test_lookups_match_dpath_search(config_file, query):
+    dsr = DataSenderReader(config_file)
+    dsr.parse()
+    assert dsr._lookup(query) == dsr._glob(query)
+
+
+def test_search(config_file):
+    dsr = DataSenderReader(config_file)
+    assert dsr.search("output 2/http_host") == "https://a.example.com/#frag"
+    # the last of several matches
+    assert dsr.search("**/http_host") == "http://10.0.0.3/"
+    assert dsr.search("**/missing") == ""
+    # dpath would read the brackets as a glob
+    assert dsr.search("output @output[0]/http_header") \
+        == "content-type: application/json"
+    assert [p for p, _ in dsr.search_all("**/http_host")] == [
+        "output 2/http_host", "output @output[0]/http_host",
+        "output @output[1]/http_host"]
+
+
+def test_missing_file_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        DataSenderReader(str(tmp_path / "nope"))
+
+
+def test_parse_is_cached_on_disk(config_file, monkeypatch):
+    DataSenderReader(config_file).parse()
+    cache_dir = ps.UCI_CACHE_DIR
+    assert len(os.listdir(cache_dir)) == 1
+
+    # a new process: nothing in memory, only the file cache
+    monkeypatch.setattr(DataSenderReader, "_parsed", {})
+    monkeypatch.setattr("sniff.reader.parse_uci", _fail)
+    dsr = DataSenderReader(config_file)
+    assert dsr.parse()["output 2"]["name"] == "cloud"
+    assert dsr.search("**/plugin") == "base"
+
+
+def test_cache_is_dropped_when_file_changes(config_file, monkeypatch):
+    DataSenderReader(config_file).parse()
+    st = os.stat(config_file)
+
+    # same size, only the mtime says it changed
+    with open(config_file) as f:
+        text = f.read()
+    with open(config_file, "w") as f:
+        f.write(text.replace("'cloud'", "'cl0ud'"))
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert DataSenderReader(config_file).search("output 2/name") == "cl0ud"
+
+    # and from the file cache in a new process
+    monkeypatch.setattr(DataSenderReader, "_parsed", {})
+    with open(config_file, "a") as f:
+        f.write("\nconfig output 'new'\n\toption name 'new'\n")
+    assert DataSenderReader(config_file).search("output new/name") == "new"
+
+
+def test_bad_file_cache_is_ignored(config_file, monkeypatch):
+    DataSenderReader(config_file).parse()
+    monkeypatch.setattr(DataSenderReader, "_parsed", {})
+    [name] = os.listdir(ps.UCI_CACHE_DIR)
+    with open(os.path.join(ps.UCI_CACHE_DIR, name), "w") as f:
+        json.dump({"path": "other"}, f)
+    assert DataSenderReader(config_file).search("output 2/name") == "cloud"
+
+
+def test_not_cached(config_file):
+    DataSenderReader(config_file, is_cached=False).parse()
+    assert not os.path.exists(ps.UCI_CACHE_DIR)
+
+
+def _fail(lines):
+    raise AssertionError("parsed again")
@@ -0,0 +1,97 @@
+import asyncio
+import gzip
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import sniff.params as ps
+from sniff.receiver import BadRequest, Receiver, Store, decode_bodies
+
+BODY = {"id": "a", "router": {"mac": "00:1E:42:00:00:00"},
+        "scan": {"ble_start_s": 1700000000},
+        "wifi": [{"mac": "AA:BB:CC:DD:EE:01", "rssi": -60}],
+        "ble": [{"mac": "AA:BB:CC:DD:EE:02", "rssi": -70}]}
+
+
+def test_decode_bodies():
+    data = json.dumps([BODY, {**BODY, "id": "b"}]).encode()
+    assert decode_bodies(json.dumps(BODY).encode()) == [BODY]
+    assert len(decode_bodies(gzip.compress(data), "gzip")) == 2
+    with pytest.raises(BadRequest):
+        decode_bodies(b"[1, 2]")
+    with pytest.raises(BadRequest):
+        decode_bodies(data, "br")
+    with pytest.raises(BadRequest) as e:
+        decode_bodies(gzip.compress(data), "gzip", max_bytes=10)
+    assert e.value.status == 413
+
+
+async def post(port, data, headers=""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"POST / HTTP/1.1\r\nContent-Length: {len(data)}\r\n"
+                 f"Connection: close\r\n{headers}\r\n".encode() + data)
+    await writer.drain()
+    reply = (await reader.read()).decode()
+    writer.close()
+    return reply
+
+
+def serve(store, *requests):
+    async def main():
+        r = Receiver(store, host="127.0.0.1", port=0)
+        server = await r.start()
+        async with server:
+            return [await post(r.port, *request) for request in requests]
+    return asyncio.run(main())
+
+
+def test_batch_and_gzip_are_stored(tmp_path):
+    path = str(tmp_path / "sniff.db")
+    store = Store(path)
+    batch = json.dumps([BODY, {**BODY, "id": "b"}]).encode()
+    replies = serve(store,
+                    (batch,),
+                    (gzip.compress(json.dumps({**BODY, "id": "c"}).encode()),
+                     "Content-Encoding: gzip\r\n"),
+                    (batch,),  # an outbox retry
+                    (b"{not json",))
+    store.close()
+    assert [r.split("\r\n")[0] for r in replies] == \
+        ["HTTP/1.1 200 OK"] * 3 + ["HTTP/1.1 400 Bad Request"]
+    assert store.stats["bodies"] == 3
+    assert store.stats["duplicates"] == 2
+    db = sqlite3.connect(path)
+    assert db.execute("select count(*) from scans").fetchone() == (3,)
+    assert db.execute("select section, rssi from devices where scan = 1 "
+                      "order by section").fetchall() == \
+        [("ble", -70), ("wifi", -60)]
+
+
+def test_full_queue_is_busy(tmp_path, monkeypatch):
+    is_written = threading.Event()
+    write = Store._write
+
+    def slow_write(self, batch):
+        is_written.wait()
+        write(self, batch)
+
+    monkeypatch.setattr(Store, "_write", slow_write)
+    store = Store(str(tmp_path / "sniff.db"), max_pending=1)
+    done = []
+    assert store.submit([BODY], done.append)
+    # the writer takes the first, the second waits, the third doesn't fit
+    while store.pending.qsize():
+        time.sleep(0.01)
+    assert store.submit([{**BODY, "id": "b"}], done.append)
+    assert not store.submit([{**BODY, "id": "c"}], done.append)
+
+    reply = serve(store, (json.dumps(BODY).encode(),))[0]
+    assert reply.startswith("HTTP/1.1 503 ")
+    assert f"Retry-After: {ps.RECEIVER_RETRY_AFTER_S}\r\n" in reply
+    is_written.set()
+    store.close()
+    assert done == [None, None]
+    assert store.stats["bodies"] == 2
@@ -0,0 +1,70 @@
+import pytest
+
+from sniff.schedule import ChurnScheduler, churn
+
+
+def test_churn():
+    assert churn({1, 2}, {1, 2}) == (0, 0, 0.0)
+    assert churn({1, 2}, {2, 3}) == (1, 1, 2 / 3)
+    assert churn(set(), set()) == (0, 0, 0.0)
+
+
+def make_scheduler(path=None, **kwargs):
+    kwargs = {"min_interval_s": 60, "max_interval_s": 600,
+              "min_ble_wait_s": 2, "max_ble_wait_s": 10, "threshold": 0.2,
+              "growth": 2, **kwargs}
+    return ChurnScheduler(path=path, **kwargs)
+
+
+def test_backs_off_while_quiet():
+    s = make_scheduler()
+    assert s.update({"ble": [1, 2]}, started_s=1000) == 1.0
+    assert (s.interval_s, s.ble_wait_s, s.next_s) == (60, 10, 1060)
+    intervals = []
+    for _ in range(5):
+        s.update({"ble": [1, 2]}, started_s=1000)
+        intervals.append(s.interval_s)
+    assert intervals == [120, 240, 480, 600, 600]
+    assert s.ble_wait_s == 2
+
+
+def test_churn_resets_and_in_between_keeps():
+    s = make_scheduler()
+    s.update({"ble": range(10)})
+    s.update({"ble": range(10)})
+    assert s.interval_s == 120
+    # 2 of 12 came, under the threshold but over half of it
+    s.update({"ble": range(12)})
+    assert (s.interval_s, s.ble_wait_s) == (120, 5)
+    s.update({"ble": range(6, 18)})
+    assert (s.interval_s, s.ble_wait_s) == (60, 10)
+
+
+def test_missing_sections_dont_count():
+    s = make_scheduler()
+    s.update({"wifi": [1], "ble": [2]})
+    assert s.update({"wifi": [1]}) == 0.0
+    assert s.devices["ble"] == {2}
+
+
+@pytest.mark.parametrize("state", ["{not json", '{"next_s": 1}'])
+def test_bad_state_is_ignored(tmp_path, state):
+    path = tmp_path / "schedule.json"
+    path.write_text(state)
+    s = make_scheduler(str(path))
+    assert (s.interval_s, s.next_s) == (60, 0.0)
+    assert s.is_due()
+
+
+def test_state_carries_over(tmp_path):
+    path = str(tmp_path / "sniff" / "schedule.json")
+    s = make_scheduler(path)
+    s.update({"ble": [0xAABBCCDDEE01]}, started_s=1000)
+    s.update({"ble": [0xAABBCCDDEE01]}, started_s=1000)
+
+    s = make_scheduler(path, max_interval_s=100)
+    assert s.interval_s == 100  # clamped to the new limits
+    assert s.next_s == 1120
+    assert s.devices == {"ble": {0xAABBCCDDEE01}}
+    assert not s.is_due(1000)
+    assert s.is_due(1120)
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from sniff import stream
+from sniff.stream import JSONFiles, iter_array, iter_encode
+
+DOC = json.dumps({"scanning": 1, "name": "a [b]", "pi": 3.25,
+                  "devices": [{"rssi": -61, "name": "x, \"y\""},
+                              {"rssi": -174}, [], 12345, True, None],
+                  "after": [0]})
+DEVICES = json.loads(DOC)["devices"]
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_iter_array_any_chunks(size):
+    assert list(iter_array(split(DOC, size), "devices")) == DEVICES
+
+
+def test_number_split_across_chunks():
+    assert list(iter_array(['{"a": [12', '34]}'], "a")) == [1234]
+    assert list(iter_array(['{"a": [-3.', '25e', '1]}'], "a")) == [-32.5]
+
+
+def test_iter_array_missing_or_empty():
+    assert list(iter_array(['{"devices": []}'], "devices")) == []
+    assert list(iter_array(['{"devices": 1}'], "devices")) == []
+    assert list(iter_array(["{}"], "devices")) == []
+    assert list(iter_array([DOC], "results")) == []
+
+
+@pytest.mark.parametrize("text", ['{"devices": [1, 2', '[1]',
+                                  '{"devices": [1 2]}', ''])
+def test_iter_array_bad_json(text):
+    with pytest.raises(ValueError):
+        list(iter_array(split(text, 3), "devices"))
+
+
+def test_iter_encode_chunks(monkeypatch):
+    monkeypatch.setattr(stream, "_ITEMS_PER_PART", 4)
+    data = {"ble": [{"mac": f"{i:012X}", "rssi": -i} for i in range(50)],
+            "scan": {"rounds": 2}, "empty": []}
+    chunks = list(iter_encode(data, chunk_bytes=100))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 400 for chunk in chunks)
+    assert b"".join(chunks) == json.dumps(data).encode()
+    assert b"".join(chunks) == stream.encode(data)
+
+
+def test_json_files(tmp_path):
+    paths = []
+    for name in "ab":
+        path = tmp_path / f"{name}.json"
+        path.write_bytes(json.dumps({"id": name}).encode())
+        paths.append(str(path))
+    one = b"".join(iter_encode(JSONFiles(paths[:1]), chunk_bytes=3))
+    both = b"".join(iter_encode(JSONFiles(paths), chunk_bytes=3))
+    assert json.loads(one) == {"id": "a"}
+    assert json.loads(both) == [{"id": "a"}, {"id": "b"}]
+    assert stream.encode(JSONFiles(paths)) == both
@@ -0,0 +1,154 @@
+import socket
+import struct
+import subprocess
+
+import pytest
+
+from sniff import blobmsg
+from sniff import transport as t
+from sniff.bench import fakeubusd
+from sniff.bench.fakeubusd import FakeUbusd, synthetic_objects
+from sniff.transport import SocketTransport, Transport
+
+
+class Fallback(Transport):
+    """Records the commands that fell back to it"""
+    name = "fallback"
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, cmd_str, timeout_s=None):
+        self.calls.append(cmd_str)
+        return {"devices": ["from fallback"]}
+
+
+@pytest.fixture(scope="module")
+def ubusd(tmp_path_factory):
+    path = tmp_path_factory.mktemp("ubusd") / "ubus.sock"
+    server = FakeUbusd(str(path),
+                       synthetic_objects(n_wifi=3, n_ble=5)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ubus(ubusd):
+    fallback = Fallback()
+    transport = SocketTransport(ubusd.path, fallback=fallback, timeout_s=5)
+    yield transport
+    transport.close()
+
+
+def test_call(ubus):
+    result = ubus.call("""ubus call iwinfo scan '{"device": "wlan1"}'""")
+    assert len(result["results"]) == 3
+    assert {r["channel"] for r in result["results"]} <= {36, 149}
+    assert ubus.fallback.calls == []
+
+
+def test_call_without_args(ubus):
+    assert ubus.call("ubus call system board")["model"] == "RUTX11"
+
+
+def test_connection_is_reused(ubus, ubusd):
+    calls = ubusd.calls
+    for _ in range(3):
+        ubus.call("ubus call system board")
+    assert len(ubus._idle) == 1
+    assert ubusd.calls - calls == 3
+
+
+def test_stream(ubus):
+    devices = list(ubus.stream("ubus call blesem scan.result", "devices"))
+    assert len(devices) == 5
+    assert all(set(d) >= {"address", "rssi"} for d in devices)
+
+
+def test_error_status_raises_called_process_error(ubus):
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        ubus.call("""ubus call iwinfo info '{"device": "wlan9"}'""")
+    assert e.value.returncode == t.UBUS_STATUS_NOT_FOUND
+    assert e.value.cmd[:4] == ["ubus", "call", "iwinfo", "info"]
+
+
+def test_unknown_object_raises_not_found(ubus):
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        ubus.call("ubus call nothing here")
+    assert e.value.returncode == t.UBUS_STATUS_NOT_FOUND
+
+
+def test_stream_error_raises_while_iterating(ubus):
+    stream = ubus.stream("ubus call nothing here", "devices")
+    with pytest.raises(subprocess.CalledProcessError):
+        list(stream)
+
+
+def test_replies_with_other_sequence_numbers_are_skipped(ubus,
+                                                         monkeypatch):
+    invoke = fakeubusd._RequestHandler.invoke
+
+    def invoke_after_stray_replies(self, seq, peer, attrs):
+        # a reply and a status meant for another request come first
+        other = (seq + 1) & 0xffff
+        self.send(t.UBUS_MSG_DATA, other, peer,
+                  blobmsg.blob_attr(t.UBUS_ATTR_DATA,
+                                    blobmsg.encode({"model": "wrong"})))
+        self.send_status(other, peer, t.UBUS_STATUS_NOT_FOUND)
+        invoke(self, seq, peer, attrs)
+
+    monkeypatch.setattr(fakeubusd._RequestHandler, "invoke",
+                        invoke_after_stray_replies)
+    assert ubus.call("ubus call system board")["model"] == "RUTX11"
+
+
+def test_status_is_read_as_signed(ubus, monkeypatch):
+    def invoke(self, seq, peer, attrs):
+        self.send(t.UBUS_MSG_STATUS, seq, peer,
+                  blobmsg.blob_attr(t.UBUS_ATTR_STATUS,
+                                    struct.pack(">i", 6)))
+
+    monkeypatch.setattr(fakeubusd._RequestHandler, "invoke", invoke)
+    with pytest.raises(subprocess.CalledProcessError,
+                       match="non-zero exit status 6"):
+        ubus.call("ubus call blesem scan.start")
+
+
+def test_stale_connection_reconnects(ubus, ubusd):
+    ubus.call("ubus call system board")
+    ubus._idle[0].sock.close()
+    ubus._idle[0].sock = _closed_socket()
+    assert ubus.call("ubus call system board")["model"] == "RUTX11"
+
+
+def _closed_socket():
+    sock, peer = socket.socketpair()
+    peer.close()
+    return sock
+
+
+def test_no_ubusd_falls_back(tmp_path):
+    fallback = Fallback()
+    ubus = SocketTransport(str(tmp_path / "missing.sock"), fallback=fallback)
+    assert ubus.call("ubus call system board") == {
+        "devices": ["from fallback"]}
+    assert list(ubus.stream("ubus call blesem scan.result", "devices")) \
+        == ["from fallback"]
+    assert fallback.calls == ["ubus call system board",
+                              "ubus call blesem scan.result"]
+
+
+def test_other_commands_fall_back(ubus):
+    ubus.call("ubus list")
+    assert ubus.fallback.calls == ["ubus list"]
+
+
+def test_get_transport_picks_socket_if_it_exists(ubusd):
+    assert isinstance(t.get_transport("auto", ubusd.path), SocketTransport)
+    assert t.get_transport("auto", ubusd.path) \
+        is t.get_transport("auto", ubusd.path)
+    assert isinstance(t.get_transport("subprocess"),
+                      t.SubprocessTransport)
+    with pytest.raises(ValueError):
+        t.get_transport("carrier-pigeon")